@@ -0,0 +1,7 @@
+"""
+Package: benchmarks
+Performance benchmarks for the supplier service
+
+The benchmarks seed the database named by DATABASE_URI, so point it at a
+scratch database: every run drops and recreates the tables.
+"""
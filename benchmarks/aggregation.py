@@ -0,0 +1,110 @@
+"""
+Aggregation Benchmark
+
+Times GET /suppliers built three ways: loading Supplier model objects and
+calling serialize() (the ORM path), serializing row tuples in Python
+(serialize_rows), and letting the database build each Supplier's JSON with
+its products nested by json_agg (json_group_array on SQLite). Every way is
+timed for the whole list and for one page.
+
+Run it with:
+  DATABASE_URI=postgres://.../bench python -m benchmarks.aggregation --suppliers 10000 --per-supplier 20
+"""
+import sys
+import json
+import logging
+import argparse
+from flask import jsonify
+from service import app
+from service.models import db, cache, Supplier
+from service.routes import init_db
+from benchmarks.common import check_database, seed_suppliers, seed_products, time_call
+
+
+def run(suppliers, products, per_supplier, limit, repeat, reset=False):
+    """ Runs the benchmark and returns the results as a dictionary """
+    seed_suppliers(suppliers, reset=reset)
+    seed_products(suppliers, products, per_supplier)
+    results = {
+        "suppliers": suppliers,
+        "per_supplier": per_supplier,
+        "limit": limit,
+    }
+
+    def orm(page):
+        query = Supplier.query.order_by(Supplier.id)
+        if page:
+            query = query.limit(limit)
+        with app.test_request_context():
+            body = jsonify([supplier.serialize() for supplier in query]).get_data()
+        db.session.remove()
+        return body
+
+    def rows(page):
+        query = Supplier.rows().order_by(Supplier.id)
+        if page:
+            query = query.limit(limit)
+        with app.test_request_context():
+            body = jsonify(Supplier.serialize_rows(query.all())).get_data()
+        db.session.remove()
+        return body
+
+    def database(page):
+        query = Supplier.json_rows().order_by(Supplier.id)
+        if page:
+            query = query.limit(limit)
+        body = "[" + ",".join(row[1] for row in query) + "]\n"
+        db.session.remove()
+        return body
+
+    assert json.loads(orm(True)) == json.loads(rows(True)) == json.loads(database(True))
+    for name, page in [("list_ms", False), ("page_ms", True)]:
+        results[name] = {
+            "orm": time_call(lambda: orm(page), repeat),
+            "rows": time_call(lambda: rows(page), repeat),
+            "database": time_call(lambda: database(page), repeat),
+        }
+
+    client = app.test_client()
+    results["endpoint_ms"] = {}
+    try:
+        for mode in (False, True):
+            app.config["LIST_JSON_IN_DATABASE"] = mode
+
+            def get():
+                cache.clear()  # time building the list, not the list cache
+                assert client.get("/suppliers").status_code == 200
+
+            results["endpoint_ms"]["database" if mode else "rows"] = time_call(get, repeat)
+    finally:
+        app.config["LIST_JSON_IN_DATABASE"] = False
+    return results
+
+
+def main(argv=None):
+    """ Command line entry point """
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--suppliers", type=int, default=10000)
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--per-supplier", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--reset", action="store_true", help="seed the database even if it isn't named like *bench*")
+    args = parser.parse_args(argv)
+
+    app.logger.setLevel(logging.CRITICAL)
+    init_db()
+    try:
+        check_database(args.reset)
+    except ValueError as error:
+        parser.error(str(error))
+    json.dump(
+        run(args.suppliers, args.products, args.per_supplier, args.limit, args.repeat, args.reset),
+        sys.stdout,
+        indent=2,
+    )
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Helpers shared by the benchmarks
+"""
+import os
+import time
+from service.models import db, Supplier, Product, Association
+
+WORDS = [
+    "Acme", "Global", "United", "Northern", "Pacific", "Atlantic", "Summit",
+    "Pioneer", "Liberty", "Eagle", "Harbor", "Granite", "Cedar", "Silver",
+    "Golden", "Union", "Metro", "Coastal", "Prairie", "Valley",
+]
+KINDS = ["Tools", "Supply", "Foods", "Textiles", "Electronics", "Logistics", "Parts", "Trading"]
+STREETS = ["Main Street", "Baywatch Rd", "Cashville Ln", "Spain Dr", "Foxboro Pl", "Oak Ave"]
+
+
+def supplier_row(i):
+    """ Returns the column values of the i-th synthetic Supplier """
+    name = "{} {} {}".format(WORDS[i % len(WORDS)], WORDS[(i // len(WORDS)) % len(WORDS)], KINDS[i % len(KINDS)])
+    return {
+        "name": "{} {}".format(name, i),
+        "email": "supplier{}@example.com".format(i),
+        "address": "{} {}".format(i, STREETS[i % len(STREETS)]),
+        "phone_number": "800-555-{:04d}".format(i % 10000),
+        "available": i % 2 == 0,
+    }
+
+
+def is_benchmark_database(url):
+    """ Returns True if the database of url is an in memory one or is named like a benchmark database """
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return True
+    return "bench" in os.path.basename(url.database or "").lower()
+
+
+def check_database(reset):
+    """Refuses to seed a database that may hold real data
+
+    Seeding drops every table, so the database must be named like a
+    benchmark database (its name contains "bench"), or reset must be given
+
+    Raises:
+        ValueError: when the database isn't a benchmark database and reset is False
+    """
+    if not reset and not is_benchmark_database(db.engine.url):
+        raise ValueError(
+            "Seeding drops every table of {!r}: use a database whose name contains 'bench', "
+            "or pass --reset".format(db.engine.url)
+        )
+
+
+def seed_suppliers(count, batch_size=10000, reset=False):
+    """Recreates the tables and inserts count Suppliers with ids 1..count
+
+    Raises:
+        ValueError: when the database isn't a benchmark database and reset is False
+    """
+    check_database(reset)
+    db.drop_all()
+    db.create_all()
+    for start in range(0, count, batch_size):
+        rows = [supplier_row(i) for i in range(start, min(start + batch_size, count))]
+        db.session.execute(Supplier.__table__.insert(), rows)
+    db.session.commit()
+    # the GIN indexes are built after the rows are loaded, which is faster
+    Supplier.create_search_indexes()
+    Supplier.init_search()
+
+
+def seed_products(suppliers, products, per_supplier, batch_size=10000):
+    """ Inserts products Products and links each of the suppliers to per_supplier of them """
+    db.session.execute(
+        Product.__table__.insert(),
+        [{"name": "Product {}".format(i)} for i in range(1, products + 1)],
+    )
+    rows = []
+    for supplier_id in range(1, suppliers + 1):
+        for j in range(per_supplier):
+            product_id = (supplier_id + j) % products + 1
+            rows.append({"supplier_id": supplier_id, "product_id": product_id, "wholesale_price": 100 + j})
+            if len(rows) == batch_size:
+                db.session.execute(Association.__table__.insert(), rows)
+                rows = []
+    if rows:
+        db.session.execute(Association.__table__.insert(), rows)
+    db.session.commit()
+
+
+def time_call(func, repeat, setup=None):
+    """Returns the best wall clock time of func in milliseconds
+
+    When setup is given it is called before every call, untimed, and func is
+    called with what it returns
+    """
+    best = None
+    for _ in range(repeat):
+        if setup is None:
+            start = time.perf_counter()
+            func()
+        else:
+            value = setup()
+            start = time.perf_counter()
+            func(value)
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best, 3)
+
+
+def percentile(values, pct):
+    """ Returns the pct-th percentile of values by the nearest rank, or 0 if empty """
+    if not values:
+        return 0
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))]
@@ -0,0 +1,324 @@
+"""
+Load Generator
+
+Replays a traffic profile against a running instance of the service with
+many concurrent clients, and reports the throughput, latency percentiles,
+status codes and error rate of every route as JSON. By default it seeds
+the database named by DATABASE_URI and starts the app on gunicorn with
+gunicorn_config.py, as it is deployed, or it drives an instance that is
+already running with --url.
+
+A profile is a JSON file of weighted requests:
+
+  {"routes": [
+    {"name": "GET /suppliers/<id>", "method": "GET", "path": "/suppliers/{supplier_id}", "weight": 60},
+    {"name": "POST /suppliers", "method": "POST", "path": "/suppliers", "body": "supplier", "weight": 3}
+  ]}
+
+The paths are filled in with {supplier_id} (a seeded Supplier), {product_id}
+(one of its Products), {any_product_id}, {word} (a word of the seeded
+names), {serial} (a number no other request used) and {created_id} (a
+Supplier this client created, and no other request of this client used).
+A request whose {created_id} isn't available yet is skipped. The bodies
+are one of BODIES. The weights of a recorded mix can be read off the
+http_requests_total counters of GET /metrics.
+
+The clients are a closed loop: each one sends its next request only after
+the previous response. When the server stalls, the clients stop sending,
+so the requests that real users would have sent during the stall are
+never timed. This is coordinated omission, and it makes the p99 and max
+latencies lower than what an open stream of users would see. Read them as
+a lower bound, and compare the rps with the rate the profile is meant to
+carry.
+
+Run it with:
+  DATABASE_URI=postgres://.../bench python -m benchmarks.load --clients 50 --duration 60
+  python -m benchmarks.load --url http://127.0.0.1:8080 --suppliers 10000 --profile mix.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+import http.client
+from itertools import count
+from urllib.parse import urlsplit
+from service import app
+from service.routes import init_db
+from benchmarks.common import WORDS, check_database, seed_suppliers, seed_products, supplier_row, percentile
+from benchmarks.serving import SERVERS as SERVING_SERVERS, free_port, start_server
+
+# the deployed server by default, or the single worker ones of benchmarks.serving
+GUNICORN_CONFIG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "gunicorn_config.py")
+SERVERS = dict(
+    SERVING_SERVERS,
+    gunicorn=["gunicorn", "--config=" + GUNICORN_CONFIG, "--bind=127.0.0.1:{port}", "service:app"],
+)
+
+# mostly single Supplier reads, some lists and searches, occasional writes
+PROFILE = {
+    "routes": [
+        {"name": "GET /suppliers/<id>", "method": "GET", "path": "/suppliers/{supplier_id}", "weight": 60},
+        {"name": "GET /suppliers?limit", "method": "GET", "path": "/suppliers?limit=20", "weight": 10},
+        {"name": "GET /suppliers?q", "method": "GET", "path": "/suppliers?q={word}&limit=20", "weight": 8},
+        {"name": "GET /products/<id>", "method": "GET", "path": "/products/{product_id}", "weight": 5},
+        {"name": "GET /suppliers/<id>/products", "method": "GET", "path": "/suppliers/{supplier_id}/products",
+         "weight": 5},
+        {"name": "GET /suppliers/<id>/products/<id>", "method": "GET",
+         "path": "/suppliers/{supplier_id}/products/{product_id}", "weight": 3},
+        {"name": "POST /suppliers", "method": "POST", "path": "/suppliers", "body": "supplier", "weight": 3},
+        {"name": "PUT /suppliers/<id>", "method": "PUT", "path": "/suppliers/{supplier_id}",
+         "body": "supplier_update", "weight": 2},
+        {"name": "POST /suppliers/<id>/products/<id>", "method": "POST",
+         "path": "/suppliers/{created_id}/products/{any_product_id}", "body": "association", "weight": 2},
+        {"name": "PUT /suppliers/<id>/products/<id>", "method": "PUT",
+         "path": "/suppliers/{supplier_id}/products/{product_id}", "body": "association", "weight": 2},
+    ]
+}
+
+METHODS = ("GET", "POST", "PUT", "DELETE")
+
+# the JSON bodies a request of a profile can send, built from its values
+BODIES = {
+    "supplier": lambda values: dict(supplier_row(values["serial"]), products=[]),
+    "supplier_update": lambda values: dict(supplier_row(values["supplier_id"] - 1), products=[]),
+    "product": lambda values: {"id": 0, "name": "Product {}".format(values["serial"])},
+    "association": lambda values: {
+        "supplier_id": values["created_id"] or values["supplier_id"],
+        "product_id": values["any_product_id"] if values["created_id"] else values["product_id"],
+        "wholesale_price": 100 + values["serial"] % 100,
+    },
+}
+
+
+def load_profile(profile):
+    """Checks a traffic profile and returns its routes
+
+    Raises:
+        ValueError: when a route of the profile is malformed
+    """
+    routes = profile.get("routes") if isinstance(profile, dict) else None
+    if not routes:
+        raise ValueError("A profile needs a list of routes")
+    for route in routes:
+        for key in ("name", "path", "weight"):
+            if key not in route:
+                raise ValueError("Route {} is missing {}".format(route, key))
+        if route.setdefault("method", "GET") not in METHODS:
+            raise ValueError("Route {} has an unknown method".format(route["name"]))
+        if route.get("body") is not None and route["body"] not in BODIES:
+            raise ValueError("Route {} has an unknown body {}".format(route["name"], route["body"]))
+        if route["weight"] <= 0:
+            raise ValueError("Route {} needs a positive weight".format(route["name"]))
+    return routes
+
+
+class Client:
+    """ One simulated client: picks requests from the profile and sends them on one connection """
+
+    def __init__(self, url, routes, suppliers, products, per_supplier, seed, serial):
+        self.url = urlsplit(url)
+        self.routes = routes
+        self.weights = [route["weight"] for route in routes]
+        self.suppliers = suppliers
+        self.products = products
+        self.per_supplier = per_supplier
+        self.random = random.Random(seed)
+        self.serial = serial
+        self.created = []
+        self.stats = {route["name"]: {"latencies": [], "errors": 0, "statuses": {}} for route in routes}
+        self.connection = None
+
+    def connect(self):
+        """ Opens a new keep-alive connection """
+        if self.connection is not None:
+            self.connection.close()
+        self.connection = http.client.HTTPConnection(self.url.hostname, self.url.port or 80, timeout=30)
+
+    def values(self, route):
+        """ Returns the values of the placeholders of a request, or None to skip it """
+        supplier_id = self.random.randint(1, self.suppliers)
+        created_id = None
+        if "{created_id}" in route["path"]:
+            if not self.created:
+                return None
+            created_id = self.created.pop()
+        return {
+            "supplier_id": supplier_id,
+            "product_id": (supplier_id + self.random.randrange(self.per_supplier)) % self.products + 1,
+            "any_product_id": self.random.randint(1, self.products),
+            "word": self.random.choice(WORDS),
+            "serial": next(self.serial),
+            "created_id": created_id,
+        }
+
+    def request(self, record):
+        """ Sends one request of the profile and records it when record is set """
+        route = self.random.choices(self.routes, self.weights)[0]
+        values = self.values(route)
+        if values is None:
+            return
+        body = None
+        headers = {}
+        if route.get("body"):
+            body = json.dumps(BODIES[route["body"]](values))
+            headers["Content-Type"] = "application/json"
+        stats = self.stats[route["name"]]
+        start = time.perf_counter()
+        try:
+            self.connection.request(route["method"], route["path"].format(**values), body, headers)
+            response = self.connection.getresponse()
+            data = response.read()
+            status = str(response.status)
+        except (OSError, http.client.HTTPException) as error:
+            status = type(error).__name__
+            self.connect()
+            data = None
+        elapsed = time.perf_counter() - start
+        if route["path"] == "/suppliers" and route["method"] == "POST" and status == "201":
+            self.created.append(json.loads(data)["id"])
+        if not record:
+            return
+        stats["statuses"][status] = stats["statuses"].get(status, 0) + 1
+        if not status.isdigit() or int(status) >= 400:
+            stats["errors"] += 1
+        else:
+            stats["latencies"].append(elapsed)
+
+    def run(self, start, deadline):
+        """ Sends requests until the deadline, recording the ones sent after start """
+        self.connect()
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            self.request(now >= start)
+        self.connection.close()
+
+
+def summarize(clients, routes, elapsed):
+    """ Merges the stats of the clients into the report of every route and the total """
+    def report(latencies, errors, statuses):
+        requests = len(latencies) + errors
+        return {
+            "requests": requests,
+            "errors": errors,
+            "error_rate": round(errors / requests, 4) if requests else 0,
+            "rps": round(requests / elapsed, 1),
+            "statuses": statuses,
+            "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+            "p90_ms": round(percentile(latencies, 90) * 1000, 3),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+            "max_ms": round(max(latencies, default=0) * 1000, 3),
+        }
+
+    results = {}
+    everything = ([], 0, {})
+    for route in routes:
+        latencies = []
+        errors = 0
+        statuses = {}
+        for client in clients:
+            stats = client.stats[route["name"]]
+            latencies.extend(stats["latencies"])
+            errors += stats["errors"]
+            for status, number in stats["statuses"].items():
+                statuses[status] = statuses.get(status, 0) + number
+                everything[2][status] = everything[2].get(status, 0) + number
+        everything[0].extend(latencies)
+        results[route["name"]] = report(latencies, errors, statuses)
+    return report(everything[0], sum(result["errors"] for result in results.values()), everything[2]), results
+
+
+def drive(url, routes, suppliers, products, per_supplier, clients, duration, warmup, seed):
+    """ Runs the clients for warmup plus duration seconds and returns their report """
+    serial = count(suppliers + 1000000)  # shared, next() is atomic
+    simulated = [
+        Client(url, routes, suppliers, products, per_supplier, seed + i, serial) for i in range(clients)
+    ]
+    start = time.monotonic() + warmup
+    deadline = start + duration
+    threads = [threading.Thread(target=client.run, args=(start, deadline)) for client in simulated]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    total, results = summarize(simulated, routes, duration)
+    return dict(total, routes=results)
+
+
+def run(routes, url, server, suppliers, products, per_supplier, clients, duration, warmup, seed, reset=False):
+    """ Runs the load and returns the results as a dictionary """
+    results = {
+        "suppliers": suppliers,
+        "clients": clients,
+        "duration": duration,
+        "warmup": warmup,
+        "seed": seed,
+    }
+    if url is not None:
+        results["url"] = url
+        results.update(drive(url, routes, suppliers, products, per_supplier, clients, duration, warmup, seed))
+        return results
+
+    seed_suppliers(suppliers, reset=reset)
+    seed_products(suppliers, products, per_supplier)
+    port = free_port()
+    process = start_server(SERVERS[server], port)
+    try:
+        results["server"] = server
+        results.update(drive(
+            "http://127.0.0.1:{}".format(port), routes, suppliers, products, per_supplier,
+            clients, duration, warmup, seed,
+        ))
+    finally:
+        process.terminate()
+        process.wait()
+    return results
+
+
+def main(argv=None):
+    """ Command line entry point """
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--profile", help="a JSON traffic profile, the built in PROFILE by default")
+    parser.add_argument("--url", help="the running instance to drive, instead of seeding and starting one")
+    parser.add_argument("--server", choices=sorted(SERVERS), default="gunicorn")
+    parser.add_argument("--suppliers", type=int, default=10000)
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--per-supplier", type=int, default=5)
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--warmup", type=float, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--reset", action="store_true", help="seed the database even if it isn't named like *bench*")
+    args = parser.parse_args(argv)
+
+    profile = PROFILE
+    if args.profile:
+        with open(args.profile) as profile_file:
+            profile = json.load(profile_file)
+    try:
+        routes = load_profile(profile)
+    except ValueError as error:
+        parser.error(str(error))
+
+    if args.url is None:
+        app.logger.setLevel(logging.CRITICAL)
+        init_db()
+        try:
+            check_database(args.reset)
+        except ValueError as error:
+            parser.error(str(error))
+    results = run(
+        routes, args.url, args.server, args.suppliers, args.products, args.per_supplier,
+        args.clients, args.duration, args.warmup, args.seed, args.reset,
+    )
+    json.dump(results, sys.stdout, indent=2, sort_keys=True)
+    print()
+
+
+if __name__ == "__main__":
+    main()
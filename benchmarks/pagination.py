@@ -0,0 +1,76 @@
+"""
+Pagination Benchmark
+
+Times GET /suppliers pages at increasing depth to show that keyset
+(cursor) pagination has flat latency, compared against an OFFSET scan
+of the same page.
+
+Run it with:
+  DATABASE_URI=postgres://.../bench python -m benchmarks.pagination --suppliers 100000
+"""
+import sys
+import json
+import logging
+import argparse
+from service import app
+from service.models import db, Supplier, cache
+from service.routes import init_db, encode_cursor
+from benchmarks.common import check_database, seed_suppliers, time_call
+
+PAGES = [1, 10, 100, 1000, 10000]
+
+
+def run(suppliers, limit, repeat, reset=False):
+    """ Runs the benchmark and returns the results as a dictionary """
+    seed_suppliers(suppliers, reset=reset)
+    client = app.test_client()
+    results = {"suppliers": suppliers, "limit": limit, "pages": []}
+    for page in PAGES:
+        last_id = (page - 1) * limit
+        if last_id + limit > suppliers:
+            break
+        query_string = {"limit": limit}
+        if last_id:
+            query_string["cursor"] = encode_cursor([last_id])
+
+        def keyset(_):
+            resp = client.get("/suppliers", query_string=query_string)
+            assert resp.status_code == 200 and len(resp.get_json()) == limit
+
+        def offset():
+            rows = Supplier.query.order_by(Supplier.id).offset(last_id).limit(limit).all()
+            assert len(rows) == limit
+            db.session.remove()
+
+        results["pages"].append(
+            {
+                "page": page,
+                # time the query and encoding, not the list cache
+                "keyset_ms": time_call(keyset, repeat, setup=cache.clear),
+                "offset_query_ms": time_call(offset, repeat),
+            }
+        )
+    return results
+
+
+def main(argv=None):
+    """ Command line entry point """
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--suppliers", type=int, default=100000)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--reset", action="store_true", help="seed the database even if it isn't named like *bench*")
+    args = parser.parse_args(argv)
+
+    app.logger.setLevel(logging.CRITICAL)
+    init_db()
+    try:
+        check_database(args.reset)
+    except ValueError as error:
+        parser.error(str(error))
+    json.dump(run(args.suppliers, args.limit, args.repeat, args.reset), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Search Benchmark
+
+Times GET /suppliers?q= for prefix and substring searches. With pg_trgm the
+searches are served by GIN trigram indexes, on other databases by the in
+memory trigram index.
+
+Run it with:
+  DATABASE_URI=postgres://.../bench python -m benchmarks.search --suppliers 1000000
+"""
+import sys
+import json
+import logging
+import argparse
+from service import app
+from service.models import Supplier, cache
+from service.routes import init_db
+from benchmarks.common import check_database, seed_suppliers, time_call
+
+QUERIES = ["Acme", "acme glo", "Summit Eagle Tools 12", "Logist", "Baywatch", "zzz"]
+
+
+def run(suppliers, limit, repeat, reset=False):
+    """ Runs the benchmark and returns the results as a dictionary """
+    seed_suppliers(suppliers, reset=reset)
+    client = app.test_client()
+    # the first search builds the in memory index when there is one
+    client.get("/suppliers", query_string={"q": QUERIES[0], "limit": limit})
+    results = {
+        "suppliers": suppliers,
+        "limit": limit,
+        "backend": "pg_trgm" if Supplier.trigram_search else
+                   "memory" if Supplier.search_index is not None else "scan",
+        "queries": [],
+    }
+    for text in QUERIES:
+        def search(_):
+            resp = client.get("/suppliers", query_string={"q": text, "limit": limit})
+            assert resp.status_code == 200
+
+        # time the search, not the list cache
+        results["queries"].append({"q": text, "ms": time_call(search, repeat, setup=cache.clear)})
+    return results
+
+
+def main(argv=None):
+    """ Command line entry point """
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--suppliers", type=int, default=100000)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--reset", action="store_true", help="seed the database even if it isn't named like *bench*")
+    args = parser.parse_args(argv)
+
+    app.logger.setLevel(logging.CRITICAL)
+    init_db()
+    try:
+        check_database(args.reset)
+    except ValueError as error:
+        parser.error(str(error))
+    json.dump(run(args.suppliers, args.limit, args.repeat, args.reset), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
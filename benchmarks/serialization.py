@@ -0,0 +1,114 @@
+"""
+Serialization Benchmark
+
+Times serializing a page of Suppliers with their products from model
+objects (Supplier.serialize) against row tuples (Supplier.serialize_rows)
+and against a sparse fieldset of their ids and names. Then times encoding
+the page with every installed JSON provider, and the list endpoints
+GET /suppliers, /products and /associations with each provider.
+
+Run it with:
+  DATABASE_URI=postgres://.../bench python -m benchmarks.serialization --suppliers 10000
+"""
+import sys
+import json
+import logging
+import argparse
+from service import app
+from service.json_provider import available_providers, create_encoder
+from service.models import db, cache, Supplier
+from service.routes import init_db
+from benchmarks.common import check_database, seed_suppliers, seed_products, time_call
+
+ENDPOINTS = ["/suppliers", "/products", "/associations"]
+# the sparse fieldset of GET /suppliers?fields=id,name
+SPARSE_FIELDS = ["id", "name"]
+
+
+def run(suppliers, products, per_supplier, limit, repeat, reset=False):
+    """ Runs the benchmark and returns the results as a dictionary """
+    seed_suppliers(suppliers, reset=reset)
+    seed_products(suppliers, products, per_supplier)
+    results = {
+        "suppliers": suppliers,
+        "products": products,
+        "per_supplier": per_supplier,
+        "limit": limit,
+    }
+
+    def load_models():
+        models = Supplier.query.order_by(Supplier.id).limit(limit).all()
+        db.session.remove()
+        return models
+
+    def load_rows(fields=None):
+        rows = Supplier.rows(fields=fields).order_by(Supplier.id).limit(limit).all()
+        db.session.remove()
+        return rows
+
+    models = load_models()
+    rows = load_rows()
+    data = Supplier.serialize_rows(rows)
+    assert data == [supplier.serialize() for supplier in models]
+    results["serialize_ms"] = {
+        "serialize": time_call(lambda: [supplier.serialize() for supplier in models], repeat),
+        "query_and_serialize": time_call(
+            lambda: [supplier.serialize() for supplier in load_models()], repeat
+        ),
+        "query_and_serialize_rows": time_call(lambda: Supplier.serialize_rows(load_rows()), repeat),
+        "query_and_serialize_id_name": time_call(
+            lambda: Supplier.serialize_rows(load_rows(SPARSE_FIELDS), SPARSE_FIELDS), repeat
+        ),
+    }
+
+    client = app.test_client()
+    encoder = app.json_encoder
+    results["encode_ms"] = {}
+    results["endpoints_ms"] = {}
+    try:
+        for name in available_providers():
+            app.json_encoder = create_encoder(name)
+            results["encode_ms"][name] = time_call(
+                lambda: app.json_encoder(sort_keys=True).encode(data), repeat
+            )
+            results["endpoints_ms"][name] = {}
+            for path in ENDPOINTS:
+
+                def get():
+                    cache.clear()  # time the query and encoding, not the list cache
+                    resp = client.get(path, query_string={"limit": limit})
+                    assert resp.status_code == 200
+
+                results["endpoints_ms"][name][path] = time_call(get, repeat)
+    finally:
+        app.json_encoder = encoder
+    return results
+
+
+def main(argv=None):
+    """ Command line entry point """
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--suppliers", type=int, default=10000)
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--per-supplier", type=int, default=5)
+    parser.add_argument("--limit", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--reset", action="store_true", help="seed the database even if it isn't named like *bench*")
+    args = parser.parse_args(argv)
+
+    app.logger.setLevel(logging.CRITICAL)
+    init_db()
+    try:
+        check_database(args.reset)
+    except ValueError as error:
+        parser.error(str(error))
+    json.dump(
+        run(args.suppliers, args.products, args.per_supplier, args.limit, args.repeat, args.reset),
+        sys.stdout,
+        indent=2,
+    )
+    print()
+
+
+if __name__ == "__main__":
+    main()
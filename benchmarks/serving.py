@@ -0,0 +1,149 @@
+"""
+Serving Benchmark
+
+Load tests the sync app on gunicorn (as in the Procfile) against the ASGI
+app on uvicorn at 1, 10 and 100 concurrent clients, and reports the
+requests per second and latency percentiles of each. Every client keeps
+one connection open and alternates between a page of GET /suppliers and a
+random GET /suppliers/<id>.
+
+Run it with:
+  DATABASE_URI=postgres://.../bench python -m benchmarks.serving --suppliers 10000
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import logging
+import argparse
+import threading
+import subprocess
+import http.client
+from service import app
+from service.routes import init_db
+from benchmarks.common import check_database, seed_suppliers, percentile
+
+SERVERS = {
+    "sync": ["gunicorn", "--workers=1", "--bind=127.0.0.1:{port}", "service:app"],
+    "asgi": ["uvicorn", "--workers=1", "--port={port}", "--log-level=warning", "service.asgi:application"],
+}
+CLIENTS = [1, 10, 100]
+
+
+def free_port():
+    """ Returns a TCP port nobody is listening on """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(command, port, timeout=30):
+    """ Starts a server and waits until it answers """
+    process = subprocess.Popen(
+        [part.format(port=port) for part in command],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        env=dict(os.environ),
+    )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/suppliers/1")
+            connection.getresponse().read()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("{} did not start".format(command[0]))
+
+
+def client(port, suppliers, deadline, latencies, errors):
+    """ Sends requests on one keep-alive connection until the deadline """
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    paths = ["/suppliers?limit=20", None]
+    count = 0
+    while time.monotonic() < deadline:
+        path = paths[count % 2] or "/suppliers/{}".format(random.randint(1, suppliers))
+        count += 1
+        start = time.perf_counter()
+        try:
+            connection.request("GET", path)
+            response = connection.getresponse()
+            response.read()
+            if response.status != 200:
+                errors.append(response.status)
+        except (OSError, http.client.HTTPException) as error:
+            errors.append(type(error).__name__)
+            connection.close()
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            continue
+        latencies.append(time.perf_counter() - start)
+    connection.close()
+
+
+def load(port, suppliers, clients, duration):
+    """ Runs clients concurrently for duration seconds and summarizes them """
+    latencies = []
+    errors = []
+    deadline = time.monotonic() + duration
+    threads = [
+        threading.Thread(target=client, args=(port, suppliers, deadline, latencies, errors))
+        for _ in range(clients)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return {
+        "clients": clients,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+def run(suppliers, duration, servers, reset=False):
+    """ Runs the benchmark and returns the results as a dictionary """
+    seed_suppliers(suppliers, reset=reset)
+    results = {"suppliers": suppliers, "duration": duration, "servers": {}}
+    for name in servers:
+        port = free_port()
+        process = start_server(SERVERS[name], port)
+        try:
+            results["servers"][name] = [
+                load(port, suppliers, clients, duration) for clients in CLIENTS
+            ]
+        finally:
+            process.terminate()
+            process.wait()
+    return results
+
+
+def main(argv=None):
+    """ Command line entry point """
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--suppliers", type=int, default=10000)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--servers", nargs="+", choices=sorted(SERVERS), default=sorted(SERVERS, reverse=True))
+    parser.add_argument("--reset", action="store_true", help="seed the database even if it isn't named like *bench*")
+    args = parser.parse_args(argv)
+
+    app.logger.setLevel(logging.CRITICAL)
+    init_db()
+    try:
+        check_database(args.reset)
+    except ValueError as error:
+        parser.error(str(error))
+    json.dump(run(args.suppliers, args.duration, args.servers, args.reset), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
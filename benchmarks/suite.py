@@ -0,0 +1,424 @@
+"""
+Benchmark Suite
+
+Seeds a realistic dataset (Suppliers, Products and the Associations between
+them) and times every query classmethod of the models and every REST route
+through the Flask test client. The results are printed as JSON with sorted
+keys, one best-of-repeat time in milliseconds per benchmark, so the output
+of two commits can be diffed.
+
+With --baseline the results are compared with an earlier run on the same
+database and size, and the command exits with 1 when a tracked benchmark
+got slower than the baseline by more than --threshold (a fraction) and
+--min-ms (to ignore the noise of sub-millisecond timings).
+
+Every call runs in a new session with an empty cache, so lookups measure
+the database and not the identity map or the read-through cache, except
+the find_cached benchmarks which time a cache hit. Benchmarks that read a
+whole table are skipped above --scan-limit Suppliers.
+
+Run it with:
+  DATABASE_URI=sqlite:////tmp/bench.db python -m benchmarks.suite --size small > before.json
+  DATABASE_URI=postgres://.../bench python -m benchmarks.suite --size medium --baseline before.json
+"""
+import re
+import sys
+import json
+import logging
+import argparse
+import platform
+import subprocess
+from itertools import count
+from service import app
+from service.models import db, cache, Supplier, Product, Association, TableVersion, ImportJob
+from service.routes import init_db, encode_cursor
+from benchmarks.common import check_database, seed_suppliers, seed_products, supplier_row, time_call
+
+SIZES = {"small": 1000, "medium": 100000, "large": 1000000}
+
+# the keys of the results that must match for two runs to be compared
+COMPARABLE = ("database", "suppliers", "products", "per_supplier", "limit")
+
+
+class Dataset:
+    """ The seeded rows the benchmarks look up, and new ones for the writes """
+
+    def __init__(self, suppliers, products, per_supplier):
+        self.suppliers = suppliers
+        self.products = products
+        self.per_supplier = per_supplier
+        self.serial = count(suppliers)
+        # spread the lookups over the table instead of reading one hot row
+        self.ids = [1 + (i * 7919) % suppliers for i in range(64)]
+        self.lookups = count()
+
+    def supplier_id(self):
+        """ Returns the id of the next seeded Supplier to look up """
+        return self.ids[next(self.lookups) % len(self.ids)]
+
+    def product_id(self, supplier_id, j=0):
+        """ Returns the id of the j-th Product seed_products() linked to a Supplier """
+        return (supplier_id + j) % self.products + 1
+
+    def catalog(self, supplier_id, size=100):
+        """ Returns new wholesale prices of size Products for a Supplier, most of them linked already """
+        price = next(self.serial) % 1000
+        return {self.product_id(supplier_id, j): price + j for j in range(min(size, self.products))}
+
+    def supplier_data(self):
+        """ Returns the body of a new Supplier """
+        return dict(supplier_row(next(self.serial)), products=[])
+
+    def new_supplier(self):
+        """ Inserts a Supplier outside of the timed call and returns its id """
+        result = db.session.execute(Supplier.__table__.insert().values(supplier_row(next(self.serial))))
+        db.session.commit()
+        return result.inserted_primary_key[0]
+
+    def new_suppliers(self, number):
+        """ Inserts number Suppliers outside of the timed call and returns their ids """
+        return [self.new_supplier() for _ in range(number)]
+
+    def new_product(self):
+        """ Inserts a Product outside of the timed call and returns its id """
+        result = db.session.execute(Product.__table__.insert().values(name="Product {}".format(next(self.serial))))
+        db.session.commit()
+        return result.inserted_primary_key[0]
+
+    def new_association(self):
+        """ Links a new Supplier to a Product outside of the timed call """
+        supplier_id = self.new_supplier()
+        db.session.execute(Association.__table__.insert().values(
+            supplier_id=supplier_id, product_id=1, wholesale_price=100
+        ))
+        db.session.commit()
+        return supplier_id
+
+
+def model_benchmarks(data, limit):
+    """Returns the benchmarks of the model classmethods
+
+    Each one is a (name, setup, func, scan) tuple: setup runs untimed before
+    every call of func and returns its argument, and scan marks the ones
+    that read a whole table
+    """
+    def lookup():
+        return data.supplier_id()
+
+    def middle():
+        return (data.suppliers // 2,)
+
+    def warm_supplier():
+        supplier_id = data.supplier_id()
+        Supplier.find_cached(supplier_id)
+        return supplier_id
+
+    def warm_product():
+        product_id = data.product_id(data.supplier_id())
+        Product.find_cached(product_id)
+        return product_id
+
+    def warm_association():
+        supplier_id = data.supplier_id()
+        Association.find_cached(supplier_id, data.product_id(supplier_id))
+        return supplier_id
+
+    def import_job():
+        job = ImportJob(content_type="application/json", payload="[]")
+        job.create()
+        return job.id
+
+    return [
+        ("Supplier.all", None, lambda _: Supplier.all(), True),
+        ("Supplier.stream", None, lambda _: sum(1 for _ in Supplier.stream(1000)), True),
+        ("Supplier.page", middle, lambda after: Supplier.page(limit, after), False),
+        ("Supplier.rows+serialize_rows", middle,
+         lambda after: Supplier.serialize_rows(Supplier.page(limit, after, Supplier.rows())), False),
+        ("Supplier.json_rows", middle, lambda after: Supplier.page(limit, after, Supplier.json_rows()), False),
+        ("Supplier.find", lookup, Supplier.find, False),
+        ("Supplier.find_cached", warm_supplier, Supplier.find_cached, False),
+        ("Supplier.find_or_404", lookup, Supplier.find_or_404, False),
+        ("Supplier.find_many", None,
+         lambda _: Supplier.serialize_rows(Supplier.rows(Supplier.find_many(data.ids)).all()), False),
+        ("Supplier.find_by_name", lookup,
+         lambda by_id: Supplier.find_by_name(supplier_row(by_id - 1)["name"]).all(), False),
+        ("Supplier.find_by_email", lookup,
+         lambda by_id: Supplier.find_by_email(supplier_row(by_id - 1)["email"]).all(), False),
+        ("Supplier.find_by_address", lookup,
+         lambda by_id: Supplier.find_by_address(supplier_row(by_id - 1)["address"]).all(), False),
+        ("Supplier.find_by_available", None, lambda _: Supplier.find_by_available(True).limit(limit).all(), False),
+        ("Supplier.find_by_filters", lookup,
+         lambda by_id: Supplier.find_by_filters(name=supplier_row(by_id - 1)["name"], available=by_id % 2 == 1).all(),
+         False),
+        ("Supplier.search", None, lambda _: Supplier.search("Summit Eagle", limit), False),
+        ("Supplier.sort_by", None, lambda _: Supplier.sort_by("name").limit(limit).all(), False),
+        ("Product.all", None, lambda _: Product.all(), False),
+        ("Product.page", None, lambda _: Product.page(limit, (data.products // 2,)), False),
+        ("Product.rows+serialize_rows", None, lambda _: Product.serialize_rows(Product.page(limit, None, Product.rows())),
+         False),
+        ("Product.find", lookup, lambda by_id: Product.find(data.product_id(by_id)), False),
+        ("Product.find_cached", warm_product, Product.find_cached, False),
+        ("Product.find_or_404", lookup, lambda by_id: Product.find_or_404(data.product_id(by_id)), False),
+        ("Product.find_many", None, lambda _: Product.find_many([data.product_id(by_id) for by_id in data.ids]).all(),
+         False),
+        ("Product.find_by_name", lookup,
+         lambda by_id: Product.find_by_name("Product {}".format(data.product_id(by_id))).all(), False),
+        ("Association.all", None, lambda _: Association.all(), True),
+        ("Association.page", middle, lambda after: Association.page(limit, (after[0], 0)), False),
+        ("Association.rows+serialize_rows", middle,
+         lambda after: Association.serialize_rows(Association.page(limit, (after[0], 0), Association.rows())), False),
+        ("Association.find", lookup, lambda by_id: Association.find(by_id, data.product_id(by_id)), False),
+        ("Association.find_many", None,
+         lambda _: Association.find_many([(by_id, data.product_id(by_id)) for by_id in data.ids]), False),
+        ("Association.find_cached", warm_association,
+         lambda by_id: Association.find_cached(by_id, data.product_id(by_id)), False),
+        ("TableVersion.current", None, lambda _: TableVersion.current("supplier", "association"), False),
+        ("ImportJob.find", import_job, ImportJob.find, False),
+        # the writes come last so they don't make the reads above stale
+        ("Supplier.bulk_create", None,
+         lambda _: Supplier.bulk_create([Supplier().deserialize(data.supplier_data()) for _ in range(100)], 1000),
+         False),
+        ("Supplier.delete_all", lambda: data.new_suppliers(10), lambda ids: Supplier.delete_all(ids=ids), False),
+        ("Association.replace_all", lookup, lambda by_id: Association.replace_all(by_id, data.catalog(by_id), 1000),
+         False),
+    ]
+
+
+def route_benchmarks(data, limit):
+    """Returns the benchmarks of the REST routes as (name, setup, func, scan) tuples
+
+    func makes the request and checks its status, so a broken route fails
+    the run instead of timing an error
+    """
+    client = app.test_client()
+
+    def call(method, path, expected, **kwargs):
+        resp = client.open(path, method=method, **kwargs)
+        assert resp.status_code == expected, "{} {} returned {}".format(method, path, resp.status_code)
+        return resp
+
+    def lookup():
+        return data.supplier_id()
+
+    def import_job():
+        job = ImportJob(content_type="application/json", payload="[]")
+        job.create()
+        return job.id
+
+    cursor = encode_cursor([data.suppliers // 2])
+    association_cursor = encode_cursor([data.suppliers // 2, 0])
+    name = supplier_row(data.suppliers // 2)["name"]
+    return [
+        ("GET /", None, lambda _: call("GET", "/", 200), False),
+        ("GET /suppliers", None, lambda _: call("GET", "/suppliers", 200), True),
+        ("GET /suppliers?limit", None, lambda _: call("GET", "/suppliers?limit={}".format(limit), 200), False),
+        ("GET /suppliers?limit&cursor", None,
+         lambda _: call("GET", "/suppliers?limit={}&cursor={}".format(limit, cursor), 200), False),
+        ("GET /suppliers?limit&fields", None,
+         lambda _: call("GET", "/suppliers?limit={}&fields=id,name".format(limit), 200), False),
+        ("GET /suppliers?name", None, lambda _: call("GET", "/suppliers", 200, query_string={"name": name}), False),
+        ("GET /suppliers?q", None,
+         lambda _: call("GET", "/suppliers", 200, query_string={"q": "Summit Eagle", "limit": 20}), False),
+        ("GET /suppliers/export", None, lambda _: call("GET", "/suppliers/export", 200).get_data(), True),
+        ("GET /suppliers/<id>", lookup, lambda by_id: call("GET", "/suppliers/{}".format(by_id), 200), False),
+        ("GET /suppliers?ids", None,
+         lambda _: call("GET", "/suppliers?ids={}".format(",".join(map(str, data.ids))), 200), False),
+        ("POST /suppliers/lookup", None, lambda _: call("POST", "/suppliers/lookup", 200, json={"ids": data.ids}),
+         False),
+        ("GET /suppliers/<id>/products", lookup,
+         lambda by_id: call("GET", "/suppliers/{}/products".format(by_id), 200), False),
+        ("GET /suppliers/<id>/products/<id>", lookup,
+         lambda by_id: call("GET", "/suppliers/{}/products/{}".format(by_id, data.product_id(by_id)), 200), False),
+        ("GET /products", None, lambda _: call("GET", "/products", 200), False),
+        ("GET /products?limit", None, lambda _: call("GET", "/products?limit={}".format(limit), 200), False),
+        ("GET /products/<id>", lookup,
+         lambda by_id: call("GET", "/products/{}".format(data.product_id(by_id)), 200), False),
+        ("POST /products/lookup", None,
+         lambda _: call("POST", "/products/lookup", 200, json={"ids": [data.product_id(by_id) for by_id in data.ids]}),
+         False),
+        ("POST /associations/lookup", None,
+         lambda _: call("POST", "/associations/lookup", 200, json={"keys": [
+             {"supplier_id": by_id, "product_id": data.product_id(by_id)} for by_id in data.ids
+         ]}), False),
+        ("GET /associations", None, lambda _: call("GET", "/associations", 200), True),
+        ("GET /associations?limit&cursor", None,
+         lambda _: call("GET", "/associations?limit={}&cursor={}".format(limit, association_cursor), 200), False),
+        ("GET /imports/<id>", import_job, lambda by_id: call("GET", "/imports/{}".format(by_id), 200), False),
+        ("GET /stats", None, lambda _: call("GET", "/stats", 200), False),
+        ("GET /metrics", None, lambda _: call("GET", "/metrics", 200), False),
+        # the writes come last so they don't make the reads above stale
+        ("POST /suppliers", None, lambda _: call("POST", "/suppliers", 201, json=data.supplier_data()), False),
+        ("POST /suppliers/bulk", None,
+         lambda _: call("POST", "/suppliers/bulk", 201, json=[data.supplier_data() for _ in range(100)]), False),
+        ("PUT /suppliers/<id>", lookup,
+         lambda by_id: call("PUT", "/suppliers/{}".format(by_id), 200, json=dict(supplier_row(by_id - 1), products=[])),
+         False),
+        ("PUT /suppliers/<id>/unavailable", lookup,
+         lambda by_id: call("PUT", "/suppliers/{}/unavailable".format(by_id), 200), False),
+        ("DELETE /suppliers/<id>", data.new_supplier,
+         lambda by_id: call("DELETE", "/suppliers/{}".format(by_id), 204), False),
+        ("DELETE /suppliers?ids", lambda: data.new_suppliers(10),
+         lambda ids: call("DELETE", "/suppliers?ids={}".format(",".join(map(str, ids))), 204), False),
+        ("POST /products", None,
+         lambda _: call("POST", "/products", 201, json={"id": 0, "name": "Product {}".format(next(data.serial))}),
+         False),
+        ("PUT /products/<id>", lookup,
+         lambda by_id: call("PUT", "/products/{}".format(data.product_id(by_id)), 200,
+                            json={"id": data.product_id(by_id), "name": "Product {}".format(data.product_id(by_id))}),
+         False),
+        ("DELETE /products/<id>", data.new_product,
+         lambda by_id: call("DELETE", "/products/{}".format(by_id), 204), False),
+        ("POST /suppliers/<id>/products/<id>", data.new_supplier,
+         lambda by_id: call("POST", "/suppliers/{}/products/1".format(by_id), 201,
+                            json={"supplier_id": by_id, "product_id": 1, "wholesale_price": 100}), False),
+        ("PUT /suppliers/<id>/products/<id>", lookup,
+         lambda by_id: call("PUT", "/suppliers/{}/products/{}".format(by_id, data.product_id(by_id)), 200,
+                            json={"supplier_id": by_id, "product_id": data.product_id(by_id), "wholesale_price": 100}),
+         False),
+        ("PUT /suppliers/<id>/products", lookup,
+         lambda by_id: call("PUT", "/suppliers/{}/products".format(by_id), 200, json=[
+             {"product_id": product_id, "wholesale_price": price} for product_id, price in data.catalog(by_id).items()
+         ]), False),
+        ("DELETE /suppliers/<id>/products/<id>", data.new_association,
+         lambda by_id: call("DELETE", "/suppliers/{}/products/1".format(by_id), 204, json={}), False),
+        ("POST /imports", None, lambda _: call("POST", "/imports", 202, json=[data.supplier_data()]), False),
+    ]
+
+
+def fresh(setup):
+    """ Wraps a setup so every call starts with a new session and an empty cache """
+    def prepare():
+        db.session.remove()
+        cache.clear()
+        return setup() if setup is not None else None
+    return prepare
+
+
+def run(suppliers, products, per_supplier, limit, repeat, scan_limit, only=None, reset=False):
+    """ Runs the benchmarks and returns the results as a dictionary """
+    seed_suppliers(suppliers, reset=reset)
+    seed_products(suppliers, products, per_supplier)
+    data = Dataset(suppliers, products, per_supplier)
+    results = {
+        "database": db.engine.dialect.name,
+        "suppliers": suppliers,
+        "products": products,
+        "per_supplier": per_supplier,
+        "limit": limit,
+        "repeat": repeat,
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "ms": {},
+        "skipped": [],
+    }
+    benchmarks = [("model " + name, setup, func, scan) for name, setup, func, scan in model_benchmarks(data, limit)]
+    benchmarks += [("route " + name, setup, func, scan) for name, setup, func, scan in route_benchmarks(data, limit)]
+    for name, setup, func, scan in benchmarks:
+        if only is not None and not re.search(only, name):
+            continue
+        if scan and suppliers > scan_limit:
+            results["skipped"].append(name)
+            continue
+        prepare = fresh(setup)
+        func(prepare())  # warm up, and build the in memory search index
+        results["ms"][name] = time_call(func, repeat, prepare)
+    db.session.remove()
+    return results
+
+
+def check_comparable(baseline, results):
+    """Checks that two runs were made on the same database and dataset
+
+    Raises:
+        ValueError: when the runs can't be compared
+    """
+    for key in COMPARABLE:
+        if baseline.get(key) != results.get(key):
+            raise ValueError("The baseline has {}={} but this run has {}={}".format(
+                key, baseline.get(key), key, results.get(key)
+            ))
+
+
+def compare(baseline, results, threshold, min_ms, track=None):
+    """Returns the tracked benchmarks that are slower than in the baseline
+
+    A benchmark regressed when it takes more than (1 + threshold) times its
+    baseline and at least min_ms more. Benchmarks missing from either run
+    are not compared
+
+    Raises:
+        ValueError: when the runs were made on another database or dataset
+    """
+    check_comparable(baseline, results)
+    regressions = []
+    for name, ms in sorted(results["ms"].items()):
+        before = baseline["ms"].get(name)
+        if before is None or (track is not None and not re.search(track, name)):
+            continue
+        if ms > before * (1 + threshold) and ms - before >= min_ms:
+            regressions.append({
+                "name": name, "baseline_ms": before, "ms": ms, "change": round(ms / before - 1, 3) if before else None,
+            })
+    return regressions
+
+
+def git_commit():
+    """ Returns the commit the benchmarks ran on, or None outside of a git checkout """
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, universal_newlines=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    """ Command line entry point, returns 1 when a tracked benchmark regressed """
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", choices=sorted(SIZES), default="small")
+    parser.add_argument("--suppliers", type=int, help="overrides the number of Suppliers of --size")
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--per-supplier", type=int, default=5)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--scan-limit", type=int, default=100000)
+    parser.add_argument("--only", help="only run the benchmarks whose name matches this regular expression")
+    parser.add_argument("--baseline", help="the JSON results of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.25)
+    parser.add_argument("--min-ms", type=float, default=1.0)
+    parser.add_argument("--track", help="only fail on the benchmarks whose name matches this regular expression")
+    parser.add_argument("--reset", action="store_true", help="seed the database even if it isn't named like *bench*")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    app.logger.setLevel(logging.CRITICAL)
+    init_db()
+    try:
+        check_database(args.reset)
+    except ValueError as error:
+        parser.error(str(error))
+    suppliers = args.suppliers or SIZES[args.size]
+    if baseline is not None:
+        # fail before seeding rather than after a long run
+        try:
+            check_comparable(baseline, {
+                "database": db.engine.dialect.name, "suppliers": suppliers, "products": args.products,
+                "per_supplier": args.per_supplier, "limit": args.limit,
+            })
+        except ValueError as error:
+            parser.error(str(error))
+    results = run(suppliers, args.products, args.per_supplier, args.limit, args.repeat, args.scan_limit, args.only, args.reset)
+    if baseline is not None:
+        results["baseline"] = baseline.get("commit")
+        results["regressions"] = compare(baseline, results, args.threshold, args.min_ms, args.track)
+    json.dump(results, sys.stdout, indent=2, sort_keys=True)
+    print()
+    return 1 if results.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
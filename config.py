@@ -20,6 +20,122 @@ if 'VCAP_SERVICES' in os.environ:
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Optional comma separated read replicas of the database. GET requests read
+# from a replica, except for clients that wrote in the last
+# REPLICA_STICKY_SECONDS, which read their own writes from the primary
+DATABASE_REPLICA_URIS = os.getenv("DATABASE_REPLICA_URIS", "")
+REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", "10"))
+
+# Worker processes serving the app. gunicorn_config.py exports the number of
+# workers it runs as WEB_CONCURRENCY before the app is loaded
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+# Connection pool of each worker (seconds for the timeouts of the pool and
+# milliseconds for the statement timeout, 0 disables it)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("true", "yes", "1")
+DB_STATEMENT_TIMEOUT = int(os.getenv("DB_STATEMENT_TIMEOUT", "30000"))
+
+# override with the credentials of the database service in Cloud Foundry,
+# never opening more connections than its plan allows (max_conns), which
+# the workers share
+if 'VCAP_SERVICES' in os.environ:
+    credentials = vcap['user-provided'][0]['credentials']
+    DB_POOL_SIZE = int(credentials.get('pool_size', DB_POOL_SIZE))
+    DB_MAX_OVERFLOW = int(credentials.get('max_overflow', DB_MAX_OVERFLOW))
+    DB_POOL_TIMEOUT = float(credentials.get('pool_timeout', DB_POOL_TIMEOUT))
+    DB_POOL_RECYCLE = int(credentials.get('pool_recycle', DB_POOL_RECYCLE))
+    DB_STATEMENT_TIMEOUT = int(credentials.get('statement_timeout', DB_STATEMENT_TIMEOUT))
+    if 'max_conns' in credentials:
+        max_conns = max(1, int(credentials['max_conns']) // WEB_CONCURRENCY)
+        DB_POOL_SIZE = min(DB_POOL_SIZE, max_conns)
+        DB_MAX_OVERFLOW = min(DB_MAX_OVERFLOW, max_conns - DB_POOL_SIZE)
+
+# Threads running the requests of the ASGI app (service/asgi.py), one per
+# database connection the pool can open
+ASGI_THREADS = int(os.getenv("ASGI_THREADS", str(DB_POOL_SIZE + DB_MAX_OVERFLOW)))
+
+# Keyset pagination of the list endpoints
+PAGE_SIZE_DEFAULT = int(os.getenv("PAGE_SIZE_DEFAULT", "100"))
+PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", "1000"))
+
+# Number of rows fetched per server side cursor batch by the export
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+# Number of rows sent per INSERT statement by the bulk create
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "1000"))
+
+# Most ids one POST /suppliers/lookup (or /products, /associations) or one
+# GET ?ids= accepts
+LOOKUP_MAX_IDS = int(os.getenv("LOOKUP_MAX_IDS", "1000"))
+
+# Build the JSON of GET /suppliers in the database (json_agg on PostgreSQL,
+# json_group_array on SQLite) instead of serializing the rows in Python
+LIST_JSON_IN_DATABASE = os.getenv("LIST_JSON_IN_DATABASE", "false").lower() in ("true", "yes", "1")
+
+# Background imports: IMPORT_WORKERS threads per process claim the queued
+# jobs and create their Suppliers IMPORT_BATCH_SIZE rows at a time. They look
+# for jobs queued by other processes every IMPORT_POLL_SECONDS, and resume a
+# job whose worker saved no progress for IMPORT_STALE_SECONDS
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", "2"))
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+IMPORT_POLL_SECONDS = float(os.getenv("IMPORT_POLL_SECONDS", "30"))
+IMPORT_STALE_SECONDS = float(os.getenv("IMPORT_STALE_SECONDS", "300"))
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "100"))
+
+# Opt-in SQL profiler: records every statement by fingerprint and logs the
+# ones slower than SQL_SLOW_QUERY_MS with their EXPLAIN plan. SQL_PROFILER_DEBUG
+# adds an X-SQL-Profile header to the responses and serves GET /debug/sql
+SQL_PROFILER = os.getenv("SQL_PROFILER", "false").lower() in ("true", "yes", "1")
+SQL_SLOW_QUERY_MS = float(os.getenv("SQL_SLOW_QUERY_MS", "100"))
+SQL_PROFILER_DEBUG = os.getenv("SQL_PROFILER_DEBUG", "false").lower() in ("true", "yes", "1")
+
+# Read-through cache of single Supplier, Product and Association lookups
+CACHE_MAX_SIZE = int(os.getenv("CACHE_MAX_SIZE", "10000"))
+CACHE_TTL = float(os.getenv("CACHE_TTL", "60"))
+
+# Largest list response body cached, in bytes. Bigger bodies, such as an
+# unpaginated list of every Supplier, are built on every request, so the
+# cached lists take at most CACHE_MAX_SIZE times this much memory
+CACHE_LIST_MAX_BYTES = int(os.getenv("CACHE_LIST_MAX_BYTES", "262144"))
+
+# Directory shared by the worker processes, where each one writes its
+# request metrics every METRICS_INTERVAL seconds so that GET /metrics adds up
+# those of every worker. Empty keeps the metrics of each process apart, which
+# is only right with one worker; gunicorn_config.py makes one for several
+METRICS_DIR = os.getenv("METRICS_DIR", "")
+METRICS_INTERVAL = float(os.getenv("METRICS_INTERVAL", "1"))
+
+# Cache backend shared by the workers: memory, redis or fakeredis. The redis
+# backend keeps a local tier of CACHE_LOCAL_SIZE entries (0 disables it)
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+CACHE_LOCAL_SIZE = int(os.getenv("CACHE_LOCAL_SIZE", "1000"))
+CACHE_LOCAL_TTL = float(os.getenv("CACHE_LOCAL_TTL", "5"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# override if a Redis service is bound in Cloud Foundry
+if 'VCAP_SERVICES' in os.environ:
+    for service in vcap.get('rediscloud', []) + vcap.get('redis', []):
+        credentials = service['credentials']
+        REDIS_URL = credentials.get('uri') or "redis://:{}@{}:{}/0".format(
+            credentials['password'], credentials['hostname'], credentials['port']
+        )
+        CACHE_BACKEND = os.getenv("CACHE_BACKEND", "redis")
+
+# The memory and fakeredis backends live in each worker, which would keep
+# serving what another worker changed, so nothing is cached with them when
+# there is more than one worker: use the redis backend to cache there
+if CACHE_BACKEND in ("memory", "fakeredis") and WEB_CONCURRENCY > 1:
+    CACHE_BACKEND = "memory"
+    CACHE_MAX_SIZE = 0
+
+# Library that encodes the JSON responses: auto picks the fastest one that is
+# installed (orjson, then ujson), json is the standard library
+JSON_PROVIDER = os.getenv("JSON_PROVIDER", "auto")
+
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "s3cr3t-key-shhhh")
 
@@ -23,15 +23,13 @@ ID_PREFIX = 'supplier_'
 def step_impl(context):
     """ Delete all Suppliers and load new ones """
     headers = {'Content-Type': 'application/json'}
-    # list all of the suppliers and delete them one by one
-    context.resp = requests.get(context.base_url + '/suppliers', headers=headers)
-    expect(context.resp.status_code).to_equal(200)
-    for supplier in context.resp.json():
-        context.resp = requests.delete(context.base_url + '/suppliers/' + str(supplier["id"]), headers=headers)
-        expect(context.resp.status_code).to_equal(204)
+    # delete all of the suppliers in a single request
+    context.resp = requests.delete(context.base_url + '/suppliers?all=true', headers=headers)
+    expect(context.resp.status_code).to_equal(204)
     
-    # load the database with new suppliers
-    create_url = context.base_url + '/suppliers'
+    # load the database with new suppliers in a single request
+    create_url = context.base_url + '/suppliers/bulk'
+    suppliers = []
     for row in context.table:
         data = {
             "name": row['name'],
@@ -41,9 +39,10 @@ def step_impl(context):
             "available": row['available'] in ['True', 'true', '1'],
             "products": []
             }
-        payload = json.dumps(data)
-        context.resp = requests.post(create_url, data=payload, headers=headers)
-        expect(context.resp.status_code).to_equal(201)
+        suppliers.append(data)
+    payload = json.dumps(suppliers)
+    context.resp = requests.post(create_url, data=payload, headers=headers)
+    expect(context.resp.status_code).to_equal(201)
 
 @when('I visit the "home page"')
 def step_impl(context):
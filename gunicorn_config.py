@@ -0,0 +1,114 @@
+"""
+Gunicorn configuration
+
+Sizes the workers and threads from the CPUs and memory the container is
+allowed to use, and preloads the app so the imports and metadata are set up
+once in the master before the workers are forked. Importing the app doesn't
+connect to the database, so the workers don't inherit any connections:
+
+  gunicorn --config=gunicorn_config.py service:app
+
+WEB_CONCURRENCY and GUNICORN_THREADS override the computed sizes. The number
+of workers is exported as WEB_CONCURRENCY for config.py, which shares the
+database connections among the workers and turns off the per process cache
+backends when there is more than one. Several workers also get a METRICS_DIR
+to add up their metrics in, unless one is given, which is removed on exit
+"""
+import os
+import shutil
+import tempfile
+
+# Memory a worker needs on top of what it shares with the preloaded master
+WORKER_MEMORY_MB = int(os.getenv("GUNICORN_WORKER_MEMORY_MB", "64"))
+# Memory kept for the master process
+MASTER_MEMORY_MB = 64
+
+
+def read_cgroup(*paths):
+    """ Returns the first line of the first cgroup file that exists, or None """
+    for path in paths:
+        try:
+            with open(path) as cgroup:
+                return cgroup.readline().strip()
+        except OSError:
+            continue
+    return None
+
+
+def cpu_count():
+    """ Returns the CPUs the process may use, honoring a cgroup CPU quota """
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    quota = read_cgroup("/sys/fs/cgroup/cpu.max")
+    if quota:
+        limit, period = quota.split()
+        if limit != "max":
+            cpus = min(cpus, int(limit) / int(period))
+    else:
+        limit = read_cgroup("/sys/fs/cgroup/cpu/cpu.cfs_quota_us")
+        period = read_cgroup("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+        if limit and period and int(limit) > 0:
+            cpus = min(cpus, int(limit) / int(period))
+    return max(1, int(cpus))
+
+
+def parse_size_mb(size):
+    """ Returns a size like 128M, 1G or a number of bytes in megabytes """
+    size = size.strip().upper().rstrip("B")
+    units = {"K": 1 / 1024, "M": 1, "G": 1024, "T": 1024 * 1024}
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size) // (1024 * 1024)
+
+
+def memory_limit_mb():
+    """ Returns the memory the process may use from Cloud Foundry, the cgroup or the machine """
+    if os.getenv("MEMORY_LIMIT"):
+        return parse_size_mb(os.environ["MEMORY_LIMIT"])
+    physical = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+    limit = read_cgroup("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes")
+    if limit and limit != "max":
+        return min(physical, parse_size_mb(limit))
+    return physical
+
+
+def worker_count(cpus, memory_mb):
+    """ Returns 2 workers per CPU plus one, as many as fit in memory """
+    fit = (memory_mb - MASTER_MEMORY_MB) // WORKER_MEMORY_MB
+    return max(1, min(2 * cpus + 1, fit))
+
+
+def thread_count():
+    """ Returns the threads per worker, never more than the connections of its pool """
+    from config import DB_POOL_SIZE, DB_MAX_OVERFLOW  # pylint: disable=import-outside-toplevel
+    threads = int(os.getenv("GUNICORN_THREADS", "4"))
+    return max(1, min(threads, DB_POOL_SIZE + DB_MAX_OVERFLOW))
+
+
+bind = "0.0.0.0:{}".format(os.getenv("PORT", "8080"))
+workers = int(os.getenv("WEB_CONCURRENCY", "0")) or worker_count(cpu_count(), memory_limit_mb())
+os.environ["WEB_CONCURRENCY"] = str(workers)
+# the METRICS_DIR made for the workers, if any
+metrics_tempdir = None
+if workers > 1 and not os.getenv("METRICS_DIR"):
+    metrics_tempdir = tempfile.mkdtemp(prefix="suppliers-metrics-")
+    os.environ["METRICS_DIR"] = metrics_tempdir
+threads = thread_count()
+worker_class = "gthread" if threads > 1 else "sync"
+preload_app = True
+accesslog = "-"
+errorlog = "-"
+
+
+def on_starting(server):
+    """ Forgets the metrics of the workers of a previous run in METRICS_DIR """
+    directory = os.getenv("METRICS_DIR")
+    if directory:
+        for name in os.listdir(directory):
+            if name.endswith(".json"):
+                os.remove(os.path.join(directory, name))
+
+
+def on_exit(server):
+    """ Removes the METRICS_DIR made for the workers """
+    if metrics_tempdir:
+        shutil.rmtree(metrics_tempdir, ignore_errors=True)
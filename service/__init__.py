@@ -1,11 +1,11 @@
 """
 Package: service
 Package for the application models and service routes
-This module creates and configures the Flask app and sets up the logging
-and SQL database
+This module creates and configures the Flask app and sets up the logging.
+Importing it doesn't touch the database: the schema is created by
+"flask bootstrap" and the rest is set up on the first request
 """
 import os
-import sys
 import logging
 from flask import Flask
 
@@ -14,7 +14,7 @@ app = Flask(__name__)
 app.config.from_object("config")
 
 # Import the rutes After the Flask app is created
-from service import routes, models
+from service import routes, models, commands, json_provider, profiler, metrics
 
 # Set up logging for production
 if __name__ != "__main__":
@@ -34,11 +34,9 @@ app.logger.info(70 * "*")
 app.logger.info("  S U P P L I E R S   S E R V I C E   R U N N I N G  ".center(70, "*"))
 app.logger.info(70 * "*")
 
-try:
-    routes.init_db()  # make our sqlalchemy tables
-except Exception as error:
-    app.logger.critical("%s: Cannot continue", error)
-    # gunicorn requires exit code 4 to stop spawning workers when they die
-    sys.exit(4)
+json_provider.init_app(app)
+profiler.init_app(app)
+metrics.init_app(app)
+models.Supplier.init_app(app)
 
 app.logger.info("Service inititalized!")
@@ -0,0 +1,189 @@
+"""
+ASGI entry point
+
+Serves the same routes as the WSGI app on an ASGI server such as uvicorn:
+
+  WEB_CONCURRENCY=2 METRICS_DIR=$(mktemp -d) uvicorn service.asgi:application
+
+uvicorn starts WEB_CONCURRENCY workers, and config.py reads the same
+variable to turn off the per process cache backends when there is more than
+one. Starting the workers with --workers instead leaves each one caching on
+its own, which is warned about when a worker imports this module
+
+SQLAlchemy 1.3 and Flask-SQLAlchemy have no asyncio support, so the event
+loop only does the network I/O. Each request runs from start to finish on
+one thread of a pool sized to the database connection pool, which keeps
+the blocking database calls and the thread local sessions off the loop.
+Response bodies are streamed back to the loop through a bounded queue, so a
+slow client slows down its own export instead of filling memory
+"""
+import io
+import sys
+import asyncio
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+from service import app
+
+# Number of response chunks a request may run ahead of its client
+QUEUE_SIZE = 8
+
+
+class ThreadedASGIApp:
+    """ Adapts a WSGI application to ASGI by running it on a thread pool """
+
+    def __init__(self, wsgi_app, threads):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix="asgi")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self.http(scope, receive, send)
+        else:
+            raise ValueError("Unsupported ASGI scope type: " + scope["type"])
+
+    async def lifespan(self, receive, send):
+        """ Answers the startup and shutdown events of the server """
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=True)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def http(self, scope, receive, send):
+        """ Runs one request on the thread pool and sends its response """
+        body = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            body.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        environ = build_environ(scope, b"".join(body))
+
+        loop = asyncio.get_running_loop()
+        messages = asyncio.Queue(QUEUE_SIZE)
+        future = loop.run_in_executor(self.executor, self.run, environ, loop, messages)
+        disconnected = None
+        while True:
+            message = await messages.get()
+            if disconnected is None:
+                try:
+                    await send(message)
+                except OSError as error:
+                    # keep draining so the request thread doesn't block on the queue
+                    disconnected = error
+            if not message.get("more_body", True):
+                break
+        await future
+        if disconnected is not None:
+            raise disconnected
+
+    def run(self, environ, loop, messages):
+        """ Calls the WSGI application and queues the ASGI messages of its response """
+        def put(message):
+            asyncio.run_coroutine_threadsafe(messages.put(message), loop).result()
+
+        start = {}
+
+        def start_response(status, headers, exc_info=None):
+            start["message"] = {
+                "type": "http.response.start",
+                "status": int(status.split(" ", 1)[0]),
+                "headers": [
+                    (name.lower().encode("latin-1"), value.encode("latin-1"))
+                    for name, value in headers
+                ],
+            }
+            return lambda data: None
+
+        def send_start():
+            if not start.get("sent"):
+                put(start["message"])
+                start["sent"] = True
+
+        try:
+            iterable = self.wsgi_app(environ, start_response)
+            try:
+                for chunk in iterable:
+                    if chunk:
+                        send_start()
+                        put({"type": "http.response.body", "body": chunk, "more_body": True})
+            finally:
+                if hasattr(iterable, "close"):
+                    iterable.close()
+        except Exception:  # pylint: disable=broad-except
+            app.logger.exception("Unhandled error in ASGI request")
+            if not start.get("sent"):
+                start["message"] = {
+                    "type": "http.response.start",
+                    "status": 500,
+                    "headers": [(b"content-type", b"text/plain")],
+                }
+        # a response that has already started can only be ended early
+        send_start()
+        put({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def build_environ(scope, body):
+    """ Returns the WSGI environ of an ASGI http scope """
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_PROTOCOL": "HTTP/" + scope.get("http_version", "1.1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            name = "HTTP_" + name
+        # repeated headers are joined with commas, except cookies (RFC 7540 8.1.2.5)
+        separator = "; " if name == "HTTP_COOKIE" else ","
+        environ[name] = environ[name] + separator + value if name in environ else value
+    # the whole body has been read, including chunked ones without a length
+    environ["CONTENT_LENGTH"] = str(len(body))
+    return environ
+
+
+def check_workers(config, worker):
+    """Returns what is wrong with running as one of several workers, if anything
+
+    Args:
+        config (dict): the application configuration
+        worker (bool): whether the process was started by a server process
+    """
+    if not worker or config["WEB_CONCURRENCY"] > 1:
+        return []
+    problems = []
+    if config["CACHE_BACKEND"] in ("memory", "fakeredis") and config["CACHE_MAX_SIZE"] > 0:
+        problems.append(
+            "the {} cache isn't shared, so workers serve what another one changed".format(config["CACHE_BACKEND"])
+        )
+    if not config["METRICS_DIR"]:
+        problems.append("GET /metrics only counts the requests of one worker")
+    return problems
+
+
+for problem in check_workers(app.config, multiprocessing.parent_process() is not None):
+    app.logger.warning("Started as a worker without WEB_CONCURRENCY set: %s", problem)
+
+application = ThreadedASGIApp(app, app.config["ASGI_THREADS"])
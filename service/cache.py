@@ -0,0 +1,348 @@
+"""
+Read-through cache
+
+Serialized resources and list responses are kept in a pluggable backend so
+repeated lookups don't go to the database:
+
+memory    - a bounded, thread safe LRU cache local to each worker process
+redis     - a cache shared by every worker through a Redis server, with an
+            optional local tier kept coherent by publishing invalidations
+fakeredis - the redis backend on an embedded Redis stand-in, for tests and
+            single machine runs
+
+List responses are cached under a generation number per table, which
+writes increment instead of finding and deleting every cached page. The
+generations only ever go up, even when the cache is cleared, so a reader
+can tell whether a table was written while it loaded a value
+"""
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+from service.fakeredis import FakeRedis
+
+logger = logging.getLogger("flask.app")
+
+
+class LRUCache:
+    """
+    Least recently used cache whose entries also expire after ttl seconds
+
+    A maxsize of 0 disables the cache. Hits, misses, evictions and
+    expirations are counted so the cache can be sized
+    """
+
+    def __init__(self, maxsize=10000, ttl=60, clock=time.monotonic):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._clock = clock
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def configure(self, maxsize, ttl):
+        """ Changes the size and time to live of the cache and empties it """
+        with self._lock:
+            self.maxsize = maxsize
+            self.ttl = ttl
+            self._entries.clear()
+
+    def get(self, key):
+        """ Returns the value cached for key, or None if there is none """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires = entry
+            if expires <= self._clock():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """ Caches value under key, evicting the least recently used entries """
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, self._clock() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, *keys):
+        """ Removes the given keys from the cache """
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        """ Removes every entry from the cache, keeping the generations """
+        with self._lock:
+            self._entries.clear()
+
+    def generation(self, name):
+        """ Returns the current generation of a table """
+        return self._generations.get(name, 0)
+
+    def bump(self, *names):
+        """ Starts a new generation of the given tables """
+        with self._lock:
+            for name in names:
+                self._generations[name] = self._generations.get(name, 0) + 1
+
+    def stats(self):
+        """ Returns the counters and size of the cache as a dictionary """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+            }
+
+
+class RedisCache:
+    """
+    Cache shared by every worker through a Redis server
+
+    Values are stored as JSON under a key prefix with the time to live as
+    their expiry. When a local LRUCache tier is given, reads are served from
+    it first and deletes are published on a channel that every worker
+    listens to, so no worker keeps serving a value another worker changed.
+    Redis errors are logged and treated as misses so an unavailable cache
+    only costs database round trips
+    """
+
+    def __init__(self, client, ttl=60, local=None, prefix="suppliers:"):
+        self.client = client
+        self.ttl = ttl
+        self.local = local
+        self.prefix = prefix
+        self.channel = prefix + "invalidate"
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._listener = None
+        self._listener_pid = None
+        try:
+            import redis  # pylint: disable=import-outside-toplevel
+            self._errors = (OSError, redis.RedisError)
+        except ImportError:
+            self._errors = (OSError,)
+
+    def _listen(self):
+        """ Subscribes this process to the invalidations of the other workers """
+        if self.local is None or self._listener_pid == os.getpid():
+            return
+        # threads don't survive a fork, so every worker starts its own
+        self._listener_pid = os.getpid()
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{self.channel: self._on_invalidate})
+        self._listener = pubsub.run_in_thread(sleep_time=0.1, daemon=True)
+
+    def _on_invalidate(self, message):
+        """ Drops the published keys from the local tier """
+        keys = json.loads(message["data"])
+        if keys is None:
+            self.local.clear()
+        else:
+            self.local.delete(*keys)
+
+    def _publish(self, keys):
+        """ Tells every worker to drop keys from its local tier, or everything if None """
+        if self.local is None:
+            return
+        if keys is None:
+            self.local.clear()
+        else:
+            self.local.delete(*keys)
+        self.client.publish(self.channel, json.dumps(keys))
+
+    def _failed(self, error):
+        """ Logs a Redis error that is handled as a cache miss """
+        self.errors += 1
+        logger.warning("Cache unavailable: %s", error)
+
+    def get(self, key):
+        """ Returns the value cached for key, or None if there is none """
+        if self.local is not None:
+            self._listen()
+            value = self.local.get(key)
+            if value is not None:
+                self.hits += 1
+                return value
+        try:
+            data = self.client.get(self.prefix + key)
+        except self._errors as error:
+            self._failed(error)
+            return None
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        value = json.loads(data)
+        if self.local is not None:
+            self.local.set(key, value)
+        return value
+
+    def set(self, key, value):
+        """ Caches value under key until the time to live runs out """
+        try:
+            self.client.set(self.prefix + key, json.dumps(value), ex=max(1, int(self.ttl)))
+        except self._errors as error:
+            self._failed(error)
+            return
+        if self.local is not None:
+            self.local.set(key, value)
+
+    def delete(self, *keys):
+        """ Removes the given keys from the cache of every worker """
+        if not keys:
+            return
+        try:
+            self.client.delete(*(self.prefix + key for key in keys))
+            self._publish(list(keys))
+        except self._errors as error:
+            self._failed(error)
+
+    def clear(self):
+        """ Removes every entry from the cache of every worker, keeping the generations """
+        generations = self.prefix + "generation:"
+        try:
+            names = [
+                name for name in self.client.scan_iter(match=self.prefix + "*")
+                if not (name.decode("utf-8") if isinstance(name, bytes) else name).startswith(generations)
+            ]
+            if names:
+                self.client.delete(*names)
+            self._publish(None)
+        except self._errors as error:
+            self._failed(error)
+
+    def generation(self, name):
+        """ Returns the current generation of a table """
+        try:
+            return int(self.client.get(self.prefix + "generation:" + name) or 0)
+        except self._errors as error:
+            self._failed(error)
+            return None
+
+    def bump(self, *names):
+        """ Starts a new generation of the given tables for every worker """
+        try:
+            for name in names:
+                self.client.incr(self.prefix + "generation:" + name)
+        except self._errors as error:
+            self._failed(error)
+
+    def stats(self):
+        """ Returns the counters of the cache as a dictionary """
+        stats = {"hits": self.hits, "misses": self.misses, "errors": self.errors, "ttl": self.ttl}
+        if self.local is not None:
+            stats["local"] = self.local.stats()
+        return stats
+
+
+class Cache:
+    """
+    The cache used by the models and routes
+
+    Delegates to the backend chosen in init_db() so that modules can import
+    the one instance before the application is configured. Nothing is read
+    or stored while the optional skip function returns True, so a session
+    reading from a lagging replica never mixes its rows with values cached
+    from the primary
+    """
+
+    def __init__(self, backend=None, skip=None):
+        self.backend = backend or LRUCache()
+        self.skip = skip
+
+    def configure(self, backend):
+        """ Replaces the backend """
+        self.backend = backend
+
+    def get(self, key):
+        """ Returns the value cached for key, or None if there is none """
+        if self.skip is not None and self.skip():
+            return None
+        return self.backend.get(key)
+
+    def set(self, key, value):
+        """ Caches value under key """
+        if self.skip is None or not self.skip():
+            self.backend.set(key, value)
+
+    def set_if_current(self, key, value, name, generation):
+        """Caches value under key unless table name was written since generation
+
+        generation is read before value is loaded from the database. Writers
+        bump the generation before they delete their keys, so reading it
+        again after the set tells whether a write may have been missed, and
+        the value is removed then. A stale value is never left behind
+        """
+        if generation is None:
+            return
+        self.set(key, value)
+        if self.generation(name) != generation:
+            self.delete(key)
+
+    def delete(self, *keys):
+        """ Removes the given keys from the cache """
+        self.backend.delete(*keys)
+
+    def clear(self):
+        """ Removes every entry from the cache """
+        self.backend.clear()
+
+    def generation(self, name):
+        """ Returns the current generation of a table, or None if it is unknown """
+        return self.backend.generation(name)
+
+    def bump(self, *names):
+        """ Starts a new generation of the given tables """
+        self.backend.bump(*names)
+
+    def stats(self):
+        """ Returns the counters of the backend as a dictionary """
+        return dict(self.backend.stats(), backend=type(self.backend).__name__)
+
+
+def create_backend(config):
+    """Returns the cache backend selected by the configuration
+
+    Args:
+        config (dict): the application configuration with CACHE_BACKEND,
+            CACHE_MAX_SIZE, CACHE_TTL, CACHE_LOCAL_SIZE, CACHE_LOCAL_TTL
+            and REDIS_URL
+    """
+    name = config.get("CACHE_BACKEND", "memory")
+    if name == "memory":
+        return LRUCache(config["CACHE_MAX_SIZE"], config["CACHE_TTL"])
+    if name == "redis":
+        import redis  # pylint: disable=import-outside-toplevel
+        client = redis.Redis.from_url(config["REDIS_URL"])
+    elif name == "fakeredis":
+        client = FakeRedis()
+    else:
+        raise ValueError("Unknown CACHE_BACKEND: " + name)
+    local = None
+    if config.get("CACHE_LOCAL_SIZE"):
+        local = LRUCache(config["CACHE_LOCAL_SIZE"], config["CACHE_LOCAL_TTL"])
+    return RedisCache(client, config["CACHE_TTL"], local)
@@ -0,0 +1,22 @@
+"""
+Command line interface
+
+Commands run with the flask command, for example:
+  FLASK_APP=service:app flask bootstrap
+"""
+import sys
+import click
+from sqlalchemy import exc
+from service import app
+from service.models import Supplier
+
+
+@app.cli.command("bootstrap")
+def bootstrap():
+    """ Creates the missing tables and indexes of the database """
+    try:
+        Supplier.create_schema()
+    except exc.SQLAlchemyError as error:
+        app.logger.critical("%s: Cannot continue", error)
+        sys.exit(4)
+    click.echo("Database ready")
@@ -0,0 +1,158 @@
+"""
+Embedded Redis stand-in
+
+Implements the small part of the redis-py client used by the shared cache
+(strings with expiry, INCR, SCAN and publish/subscribe) on top of an in
+process server, so the Redis cache backend can run in tests and on a
+single machine without a Redis server. Clients created with the same
+FakeRedisServer share their data and channels like workers sharing a Redis.
+"""
+import time
+import queue
+import fnmatch
+import threading
+
+
+class FakeRedisServer:
+    """ The data and channels shared by every FakeRedis client connected to it """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = {}
+        self.subscribers = {}
+
+
+class FakeRedis:
+    """ A redis.Redis look-alike backed by a FakeRedisServer """
+
+    def __init__(self, server=None):
+        self.server = server or FakeRedisServer()
+
+    @staticmethod
+    def _encode(value):
+        """ Stores values as bytes the way Redis returns them """
+        if isinstance(value, bytes):
+            return value
+        return str(value).encode("utf-8")
+
+    def _get_live(self, name):
+        """ Returns the value of a key that hasn't expired, holding the lock """
+        entry = self.server.data.get(name)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires is not None and expires <= time.monotonic():
+            del self.server.data[name]
+            return None
+        return value
+
+    def get(self, name):
+        """ Returns the value of a key or None """
+        with self.server.lock:
+            return self._get_live(name)
+
+    def set(self, name, value, ex=None):
+        """ Sets a key, expiring it after ex seconds when given """
+        expires = time.monotonic() + ex if ex else None
+        with self.server.lock:
+            self.server.data[name] = (self._encode(value), expires)
+        return True
+
+    def delete(self, *names):
+        """ Removes keys and returns how many existed """
+        with self.server.lock:
+            return sum(self.server.data.pop(name, None) is not None for name in names)
+
+    def incr(self, name, amount=1):
+        """ Increments the integer value of a key """
+        with self.server.lock:
+            value = int(self._get_live(name) or 0) + amount
+            self.server.data[name] = (self._encode(value), None)
+            return value
+
+    def scan_iter(self, match=None):
+        """ Iterates over the keys matching a glob style pattern """
+        with self.server.lock:
+            names = list(self.server.data)
+        for name in names:
+            if match is None or fnmatch.fnmatchcase(name, match):
+                yield name
+
+    def publish(self, channel, message):
+        """ Sends a message to the subscribers of a channel """
+        with self.server.lock:
+            subscribers = list(self.server.subscribers.get(channel, ()))
+        for pubsub in subscribers:
+            pubsub.messages.put(
+                {"type": "message", "channel": channel.encode("utf-8"), "data": self._encode(message)}
+            )
+        return len(subscribers)
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        """ Returns a new publish/subscribe connection """
+        return FakePubSub(self.server)
+
+
+class FakePubSub:
+    """ A redis.client.PubSub look-alike """
+
+    def __init__(self, server):
+        self.server = server
+        self.messages = queue.Queue()
+        self.handlers = {}
+
+    def subscribe(self, *channels, **handlers):
+        """ Subscribes to channels, optionally with a handler per channel """
+        self.handlers.update(handlers)
+        with self.server.lock:
+            for channel in list(channels) + list(handlers):
+                self.server.subscribers.setdefault(channel, []).append(self)
+
+    def unsubscribe(self):
+        """ Unsubscribes from every channel """
+        with self.server.lock:
+            for subscribers in self.server.subscribers.values():
+                if self in subscribers:
+                    subscribers.remove(self)
+
+    def get_message(self, timeout=0.0):
+        """ Returns the next message, calling its handler instead if it has one """
+        try:
+            message = self.messages.get(timeout=timeout) if timeout else self.messages.get_nowait()
+        except queue.Empty:
+            return None
+        handler = self.handlers.get(message["channel"].decode("utf-8"))
+        if handler is not None:
+            handler(message)
+            return None
+        return message
+
+    def run_in_thread(self, sleep_time=0.1, daemon=True):
+        """ Dispatches messages to their handlers from a background thread """
+        thread = FakePubSubWorkerThread(self, sleep_time, daemon)
+        thread.start()
+        return thread
+
+    def close(self):
+        """ Closes the connection """
+        self.unsubscribe()
+
+
+class FakePubSubWorkerThread(threading.Thread):
+    """ A redis.client.PubSubWorkerThread look-alike """
+
+    def __init__(self, pubsub, sleep_time, daemon):
+        super().__init__(daemon=daemon)
+        self.pubsub = pubsub
+        self.sleep_time = sleep_time
+        self._running = threading.Event()
+
+    def run(self):
+        self._running.set()
+        while self._running.is_set():
+            self.pubsub.get_message(timeout=self.sleep_time)
+        self.pubsub.close()
+
+    def stop(self):
+        """ Stops dispatching messages """
+        self._running.clear()
@@ -0,0 +1,179 @@
+"""
+Background Import Jobs
+
+POST /imports queues a file of Suppliers as an ImportJob and returns at
+once. A pool of IMPORT_WORKERS threads in every process claims the queued
+jobs from the import_job table and creates their Suppliers in batches of
+IMPORT_BATCH_SIZE with the same validation as POST /suppliers. Because the
+queue is a table it works the same on SQLite and PostgreSQL, and any
+process can report the progress of any job.
+
+The workers are woken up when their own process queues a job, and look
+for jobs queued or abandoned by other processes every IMPORT_POLL_SECONDS.
+"""
+import os
+import json
+import logging
+import threading
+from sqlalchemy import exc
+from service.models import db, Supplier, ImportJob, DataValidationError
+
+logger = logging.getLogger("flask.app")
+
+# the content types a file of Suppliers may be sent as, and by file extension
+FORMATS = ("application/json", "application/x-ndjson")
+EXTENSIONS = {".json": "application/json", ".ndjson": "application/x-ndjson", ".jsonl": "application/x-ndjson"}
+
+
+def parse_rows(content_type, text):
+    """Returns the rows of a JSON array or newline delimited JSON of Suppliers
+
+    A line that is not valid JSON is returned as None so it is reported as
+    bad data along with the rest of the rows
+
+    Raises:
+        DataValidationError: when a JSON body is not an array
+    """
+    if content_type == "application/x-ndjson":
+        rows = []
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                rows.append(None)
+        return rows
+    try:
+        rows = json.loads(text)
+    except ValueError:
+        rows = None
+    if not isinstance(rows, list):
+        raise DataValidationError("Body must be a JSON array of Suppliers")
+    return rows
+
+
+def run_job(job, batch_size, max_errors):
+    """Creates the Suppliers of a claimed ImportJob, resuming after its last saved batch
+
+    Args:
+        job (ImportJob): the job to run
+        batch_size (int): the number of rows validated and inserted together
+        max_errors (int): the number of row errors kept in the report
+    """
+    try:
+        rows = parse_rows(job.content_type, job.payload)
+    except DataValidationError as error:
+        job.finish(str(error))
+        return
+    job.total = len(rows)
+    for start in range(job.processed, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        suppliers = []
+        errors = []
+        for index, data in enumerate(batch, start):
+            try:
+                suppliers.append(Supplier().deserialize(data))
+            except DataValidationError as error:
+                errors.append({"index": index, "error": str(error)})
+        # the progress is committed together with the Suppliers of the batch
+        job.record(len(batch), len(suppliers), errors, max_errors)
+        if not job.renew():
+            # the batch took longer than IMPORT_STALE_SECONDS and another
+            # worker resumed the job, it creates these Suppliers instead
+            db.session.rollback()
+            logger.warning("Import %s was claimed by another worker", job.id)
+            return
+        if suppliers:
+            Supplier.bulk_create(suppliers, batch_size)
+        else:
+            db.session.commit()
+    job.finish()
+
+
+class ImportWorkers:
+    """ The threads of one process that run the queued ImportJobs """
+
+    def __init__(self):
+        self.threads = []
+        self.pid = None
+        self.lock = threading.Lock()
+        # guards the wake up calls, counted so a worker that is busy while
+        # a job is queued looks for it again instead of going to sleep
+        self.condition = threading.Condition()
+        self.notified = 0
+        self.stopping = False
+
+    def start(self, app):
+        """ Starts the workers of this process unless they are running """
+        with self.lock:
+            # threads don't survive a fork, so a forked worker starts its own
+            if self.pid == os.getpid() and any(thread.is_alive() for thread in self.threads):
+                return
+            self.pid = os.getpid()
+            self.stopping = False
+            self.threads = [
+                threading.Thread(target=self.run, args=(app,), name="import-worker-{}".format(i), daemon=True)
+                for i in range(app.config["IMPORT_WORKERS"])
+            ]
+            for thread in self.threads:
+                thread.start()
+
+    def notify(self):
+        """ Wakes the workers up to claim a job that was just queued """
+        with self.condition:
+            self.notified += 1
+            self.condition.notify_all()
+
+    def stop(self):
+        """ Stops the workers after the jobs they are running """
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def work(self, app):
+        """ Claims and runs one ImportJob, returns False if there was none """
+        with app.app_context():
+            job = None
+            try:
+                job = ImportJob.claim(app.config["IMPORT_STALE_SECONDS"])
+                if job is None:
+                    return False
+                run_job(job, app.config["IMPORT_BATCH_SIZE"], app.config["IMPORT_MAX_ERRORS"])
+                return True
+            except exc.OperationalError as error:
+                # the database went away, the job is resumed by a worker once it is stale
+                logger.error("Import worker failed: %s", error)
+                return False
+            except Exception as error:  # pylint: disable=broad-except
+                # anything else would fail again on every resume, so the job fails
+                logger.exception("Import %s failed", job.id if job else None)
+                if job is None:
+                    return False
+                db.session.rollback()
+                try:
+                    job.finish("{}: {}".format(type(error).__name__, error))
+                except exc.SQLAlchemyError as finish_error:
+                    logger.error("Import %s could not be marked failed: %s", job.id, finish_error)
+                return True
+            finally:
+                db.session.remove()
+
+    def run(self, app):
+        """ Runs jobs until stopped, waiting for new ones when the queue is empty """
+        while True:
+            with self.condition:
+                if self.stopping:
+                    return
+                notified = self.notified
+            if self.work(app):
+                continue
+            with self.condition:
+                if not self.stopping and self.notified == notified:
+                    self.condition.wait(app.config["IMPORT_POLL_SECONDS"])
+
+
+workers = ImportWorkers()
@@ -0,0 +1,109 @@
+"""
+JSON Provider
+
+Encodes the JSON responses with orjson or ujson when they are installed and
+falls back to the standard library json module. JSON_PROVIDER chooses one:
+
+  auto   - the fastest one installed: orjson, then ujson, then json
+  orjson - https://github.com/ijl/orjson
+  ujson  - https://github.com/ultrajson/ultrajson
+  json   - the standard library
+
+Flask 1.1 has no provider hook of its own, so the provider is plugged in as
+the app's json_encoder and jsonify() keeps working unchanged. Pretty printed
+responses and objects a provider cannot encode go through the standard
+library encoder. JSON_AS_ASCII is honored like the standard library does,
+escaping every non ASCII character as \\uXXXX when it is true.
+"""
+import re
+from flask.json import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import ujson
+except ImportError:  # pragma: no cover
+    ujson = None
+
+
+NON_ASCII = re.compile(r"[^\x00-\x7f]")
+
+
+def escape_non_ascii(match):
+    """ Returns the \\uXXXX escape of a character, a surrogate pair above U+FFFF """
+    code = ord(match.group())
+    if code < 0x10000:
+        return "\\u{:04x}".format(code)
+    code -= 0x10000
+    return "\\u{:04x}\\u{:04x}".format(0xD800 | (code >> 10), 0xDC00 | (code & 0x3FF))
+
+
+def orjson_dumps(obj, sort_keys, default, ensure_ascii):
+    """ Encodes obj with orjson, leaving dates to default like Flask does """
+    option = orjson.OPT_PASSTHROUGH_DATETIME
+    if sort_keys:
+        option |= orjson.OPT_SORT_KEYS
+    text = orjson.dumps(obj, default=default, option=option).decode("utf-8")
+    # orjson only writes UTF-8, and non ASCII characters only occur in strings
+    if ensure_ascii and not text.isascii():
+        text = NON_ASCII.sub(escape_non_ascii, text)
+    return text
+
+
+def ujson_dumps(obj, sort_keys, default, ensure_ascii):
+    """ Encodes obj with ujson """
+    return ujson.dumps(
+        obj, sort_keys=sort_keys, default=default, ensure_ascii=ensure_ascii, escape_forward_slashes=False
+    )
+
+
+# the providers from the fastest to the slowest
+PROVIDERS = {
+    "orjson": orjson_dumps if orjson is not None else None,
+    "ujson": ujson_dumps if ujson is not None else None,
+    "json": None,
+}
+
+
+class ProviderJSONEncoder(JSONEncoder):
+    """ The Flask JSON encoder that hands compact encoding to a provider """
+
+    provider = "json"
+    dumps = None
+
+    def encode(self, o):
+        if self.dumps is None or self.indent is not None:
+            return super().encode(o)
+        try:
+            return self.dumps(o, self.sort_keys, self.default, self.ensure_ascii)
+        except (TypeError, ValueError, OverflowError):
+            # e.g. integers wider than 64 bits, let the standard library try
+            return super().encode(o)
+
+
+def available_providers():
+    """ Returns the names of the installed providers, fastest first """
+    return [name for name, dumps in PROVIDERS.items() if dumps is not None or name == "json"]
+
+
+def create_encoder(name="auto"):
+    """ Returns a JSONEncoder class that encodes with the named provider """
+    if name == "auto":
+        name = available_providers()[0]
+    if name not in PROVIDERS:
+        raise ValueError("Unknown JSON_PROVIDER '{}'".format(name))
+    if name not in available_providers():
+        raise ValueError("JSON_PROVIDER '{}' is not installed".format(name))
+    return type(
+        "ProviderJSONEncoder",
+        (ProviderJSONEncoder,),
+        {"provider": name, "dumps": staticmethod(PROVIDERS[name]) if PROVIDERS[name] else None},
+    )
+
+
+def init_app(app):
+    """ Encodes the JSON responses of app with its JSON_PROVIDER """
+    app.json_encoder = create_encoder(app.config["JSON_PROVIDER"])
@@ -0,0 +1,376 @@
+"""
+Request Metrics
+
+Counters, gauges and histograms of the requests of one process, rendered
+in the Prometheus text format by GET /metrics. The routes record the
+latency, response size and in-flight requests of every request labelled
+by its Flask endpoint, and the SQLAlchemy cursor events count the queries
+each request sends and the time it spends in them.
+
+Every gunicorn worker keeps its own metrics, and the workers share one
+listening socket, so a scrape reaches any one of them. When METRICS_DIR is
+set each worker writes its metrics there and GET /metrics adds up those of
+every worker. Without it the metrics are only right with a single worker.
+"""
+import os
+import json
+import time
+import uuid
+import threading
+from bisect import bisect_left
+from flask import g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+
+def format_value(value):
+    """ Returns a sample value the way Prometheus writes it """
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def format_labels(names, values):
+    """ Returns the {name="value",...} label set of a sample """
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append('{}="{}"'.format(name, value))
+    return "{" + ",".join(pairs) + "}"
+
+
+class Metric:
+    """ A named family of samples, one per combination of label values """
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def snapshot(self):
+        """ Returns a copy of the value of every label set """
+        with self._lock:
+            return {labels: list(value) if isinstance(value, list) else value for labels, value in self._values.items()}
+
+    def combine(self, value, other):
+        """ Returns the sum of the values of one label set in two processes """
+        return value + other
+
+    def render(self, values=None):
+        """ Returns the lines of the metric, or of the given values, in the Prometheus text format """
+        lines = [
+            "# HELP {} {}".format(self.name, self.documentation),
+            "# TYPE {} {}".format(self.name, self.kind),
+        ]
+        if values is None:
+            values = self.snapshot()
+        for labels, value in sorted(values.items()):
+            lines.extend(self.samples(labels, value))
+        return lines
+
+    def samples(self, labels, value):
+        """ Returns the sample lines of one label set """
+        return ["{}{} {}".format(self.name, format_labels(self.labelnames, labels), format_value(value))]
+
+
+class Counter(Metric):
+    """ A value that only goes up """
+
+    kind = "counter"
+
+    def inc(self, labels=(), amount=1):
+        """ Adds amount to the counter of the label values """
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def set(self, labels=(), value=0):
+        """ Sets the counter of the label values to a count kept somewhere else """
+        with self._lock:
+            self._values[labels] = value
+
+
+class Gauge(Metric):
+    """ A value that goes up and down """
+
+    kind = "gauge"
+
+    def inc(self, labels=(), amount=1):
+        """ Adds amount to the gauge of the label values """
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, labels=(), amount=1):
+        """ Subtracts amount from the gauge of the label values """
+        self.inc(labels, -amount)
+
+    def set(self, labels=(), value=0):
+        """ Sets the gauge of the label values """
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    """ Counts observations in cumulative buckets, with their sum and count """
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, labels, value):
+        """ Records one observation of the label values """
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                # one count per bucket, then +Inf, then the sum
+                counts = self._values[labels] = [0] * (len(self.buckets) + 1) + [0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def combine(self, value, other):
+        return [count + more for count, more in zip(value, other)]
+
+    def samples(self, labels, value):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), value[:-1]):
+            cumulative += count
+            lines.append("{}_bucket{} {}".format(
+                self.name, format_labels(self.labelnames + ("le",), labels + (format_value(float(bound)),)), cumulative
+            ))
+        labelset = format_labels(self.labelnames, labels)
+        lines.append("{}_sum{} {}".format(self.name, labelset, format_value(value[-1])))
+        lines.append("{}_count{} {}".format(self.name, labelset, cumulative))
+        return lines
+
+
+def is_alive(pid):
+    """ Returns True if the process pid is running """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Registry:
+    """
+    The metrics of this process, or of every process sharing a directory
+
+    With a directory each process writes its metrics to <pid>-<uuid>.json
+    there every interval seconds and before rendering, and the rendered
+    metrics add up the files of every process. The random part keeps a
+    process that gets the pid of an exited one from overwriting its file.
+    The counters and histograms of the processes that exited are kept so the
+    totals never go down, while their gauges are dropped
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.directory = None
+        self.interval = 1.0
+        self.pid = None
+        self._filename = None
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """ Adds a metric to the registry and returns it """
+        self.metrics.append(metric)
+        return metric
+
+    def configure(self, directory, interval):
+        """ Shares the metrics through directory, or keeps them in this process when it is empty """
+        with self._lock:
+            self.directory = directory or None
+            self.interval = interval
+            self.pid = None
+
+    def start(self):
+        """ Starts writing the metrics of this process to the directory, once per process """
+        if self.directory is None or self.pid == os.getpid():
+            return
+        with self._lock:
+            # threads don't survive a fork, so a forked worker starts its own
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+        threading.Thread(target=self.run, args=(self.pid,), name="metrics-writer", daemon=True).start()
+
+    def run(self, pid):
+        """ Writes the metrics every interval until the registry is configured again """
+        while True:
+            time.sleep(self.interval)
+            if self.pid != pid or self.directory is None:
+                return
+            self.write()
+
+    def filename(self):
+        """ Returns the name of the file of this process, new in every process """
+        pid = os.getpid()
+        if self._filename is None or self._filename[0] != pid:
+            self._filename = (pid, "{}-{}.json".format(pid, uuid.uuid4().hex))
+        return self._filename[1]
+
+    def write(self):
+        """ Writes the metrics of this process to its file in the directory """
+        data = {
+            metric.name: [[list(labels), value] for labels, value in metric.snapshot().items()]
+            for metric in self.metrics
+        }
+        path = os.path.join(self.directory, self.filename())
+        with self._lock:
+            with open(path + ".tmp", "w") as output:
+                json.dump(data, output)
+            os.replace(path + ".tmp", path)
+
+    def collect(self):
+        """ Returns the values of every metric added up over the files of the directory """
+        self.write()
+        merged = {metric.name: {} for metric in self.metrics}
+        snapshots = []
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(".json"):
+                continue
+            try:
+                pid = int(filename.split("-", 1)[0])
+                path = os.path.join(self.directory, filename)
+                modified = os.path.getmtime(path)
+                with open(path) as snapshot:
+                    data = json.load(snapshot)
+            except (OSError, ValueError):
+                continue
+            snapshots.append((pid, modified, data))
+        # of the files of a reused pid, only the last one written is the live process
+        latest = {}
+        for pid, modified, _ in snapshots:
+            latest[pid] = max(latest.get(pid, modified), modified)
+        for pid, modified, data in snapshots:
+            alive = modified == latest[pid] and is_alive(pid)
+            for metric in self.metrics:
+                if metric.kind == "gauge" and not alive:
+                    continue
+                values = merged[metric.name]
+                for labels, value in data.get(metric.name, []):
+                    labels = tuple(labels)
+                    values[labels] = metric.combine(values[labels], value) if labels in values else value
+        return merged
+
+    def render(self):
+        """ Returns every metric in the Prometheus text format """
+        merged = self.collect() if self.directory is not None else {}
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render(merged.get(metric.name)))
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+requests_total = registry.register(Counter(
+    "http_requests_total", "Requests by endpoint, method and status", ("endpoint", "method", "status")
+))
+request_seconds = registry.register(Histogram(
+    "http_request_duration_seconds", "Request latency by endpoint", ("endpoint", "method"), LATENCY_BUCKETS
+))
+response_bytes = registry.register(Histogram(
+    "http_response_size_bytes", "Response body sizes by endpoint", ("endpoint",), SIZE_BUCKETS
+))
+requests_in_progress = registry.register(Gauge(
+    "http_requests_in_progress", "Requests being served by endpoint", ("endpoint",)
+))
+request_queries = registry.register(Histogram(
+    "db_queries_per_request", "SQL statements sent per request by endpoint", ("endpoint",), QUERY_BUCKETS
+))
+request_query_seconds = registry.register(Histogram(
+    "db_query_duration_seconds_per_request", "Time spent in SQL per request by endpoint", ("endpoint",), LATENCY_BUCKETS
+))
+pool_connections = registry.register(Gauge(
+    "db_pool_connections", "Connections of the pool by state", ("state",)
+))
+pool_events = registry.register(Counter(
+    "db_pool_events_total", "Checkouts, overflows and timeouts of the pool", ("event",)
+))
+
+
+def init_app(app):
+    """ Shares the metrics through the METRICS_DIR of the configuration of app """
+    registry.configure(app.config["METRICS_DIR"], app.config["METRICS_INTERVAL"])
+
+
+def start_request(endpoint):
+    """ Starts measuring a request """
+    registry.start()
+    g.metrics_start = time.perf_counter()
+    g.metrics_endpoint = endpoint
+    g.metrics_queries = 0
+    g.metrics_query_seconds = 0.0
+    requests_in_progress.inc((endpoint,))
+
+
+def finish_request(method, response):
+    """ Records the latency, size and queries of a request """
+    start = g.get("metrics_start")
+    if start is None:
+        return
+    endpoint = g.metrics_endpoint
+    requests_total.inc((endpoint, method, str(response.status_code)))
+    request_seconds.observe((endpoint, method), time.perf_counter() - start)
+    # streamed responses have no length until they are sent
+    if response.content_length is not None:
+        response_bytes.observe((endpoint,), response.content_length)
+    request_queries.observe((endpoint,), g.metrics_queries)
+    request_query_seconds.observe((endpoint,), g.metrics_query_seconds)
+
+
+def end_request():
+    """ Stops counting a request as in progress, whatever happened to it """
+    if g.get("metrics_start") is not None:
+        requests_in_progress.dec((g.metrics_endpoint,))
+        g.metrics_start = None
+
+
+def record_pool(stats):
+    """ Sets the pool gauges from pool_stats(), which is None for unpooled engines """
+    if stats is None:
+        return
+    for state in ("size", "checked_in", "checked_out", "overflow"):
+        if state in stats:
+            pool_connections.set((state,), stats[state])
+    for name in ("checkouts", "overflows", "timeouts"):
+        if name in stats:
+            pool_events.set((name,), stats[name])
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def start_query(conn, cursor, statement, parameters, context, executemany):
+    """ Notes when a statement of a request was sent """
+    if context is not None:
+        context.metrics_start = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def finish_query(conn, cursor, statement, parameters, context, executemany):
+    """ Adds a statement to the queries of the request that sent it """
+    start = getattr(context, "metrics_start", None)
+    if start is None or not has_app_context() or g.get("metrics_start") is None:
+        return
+    g.metrics_queries += 1
+    g.metrics_query_seconds += time.perf_counter() - start
@@ -3,15 +3,29 @@ Models for Supplier
 
 All of the models are stored in this module
 """
+import json
+import time
+import uuid
 import logging
-from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import asc, desc
+import warnings
+from datetime import datetime, timedelta
+from sqlalchemy import DDL, and_, asc, bindparam, case, cast, desc, event, exc, func, inspect, literal_column, or_
+from sqlalchemy import select, tuple_
+from sqlalchemy.dialects import postgresql
+from service.cache import Cache, create_backend
+from service.pool import engine_options
+from service.routing import RoutingSQLAlchemy
+from service.search import TrigramIndex
 
 
 logger = logging.getLogger("flask.app")
 
 # Create the SQLAlchemy object to be initialized later in init_db()
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
+
+# Serialized resources and list responses, backend chosen later in init_db().
+# What is read from a replica may lag behind the primary, so it isn't cached
+cache = Cache(skip=db.reading_replica)
 
 
 class DataValidationError(Exception):
@@ -19,6 +33,68 @@ class DataValidationError(Exception):
 
     pass
 
+
+def keyset_page(query, keys, limit, after=None):
+    """Returns one page of a query using a keyset (seek) instead of OFFSET
+
+    Args:
+        query (Query): the query to page through
+        keys (list): the primary key columns that order the pages
+        limit (int): the maximum number of rows in the page
+        after (tuple): the key values of the last row of the previous page
+    """
+    if after is not None:
+        query = query.filter(tuple_(*keys) > tuple_(*after))
+    return query.order_by(*keys).limit(limit).all()
+
+
+def row_dicts(columns, rows):
+    """ Returns row tuples as dictionaries keyed by the names of their columns """
+    return [dict(zip(columns, row)) for row in rows]
+
+
+def json_object(dialect, pairs):
+    """Returns a SQL expression that builds a JSON object from (name, value) pairs
+
+    PostgreSQL uses json_build_object and SQLite the json_object function of
+    its JSON1 extension. SQLite has no boolean type, so boolean columns are
+    turned into JSON true and false explicitly
+    """
+    arguments = []
+    for name, value in pairs:
+        if dialect == "sqlite" and isinstance(value.type, db.Boolean):
+            value = func.json(case([(value, "true")], else_="false"))
+        arguments.extend([name, value])
+    if dialect == "sqlite":
+        return func.json_object(*arguments)
+    return func.json_build_object(*arguments)
+
+
+def json_array_agg(dialect, value):
+    """ Returns a SQL aggregate of the JSON values of a group into an array, [] when empty """
+    if dialect == "sqlite":
+        return func.json_group_array(value)
+    return func.coalesce(func.json_agg(value), literal_column("'[]'::json"))
+
+def create_missing_indexes():
+    """
+    Creates the indexes declared on the models that an existing table is missing
+    db.create_all() only creates indexes together with new tables
+    """
+    inspector = inspect(db.engine)
+    tables = set(inspector.get_table_names())
+    for table in db.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        with warnings.catch_warnings():
+            # only the names are needed, not the reflected partial index predicates
+            warnings.simplefilter("ignore", exc.SAWarning)
+            existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                logger.info("Creating index %s", index.name)
+                index.create(db.engine)
+
 ######################################################################
 #  A S S O C I A T I O N  T A B L E
 ######################################################################
@@ -29,7 +105,9 @@ class Association(db.Model):
     wholesale_price = db.Column(db.Integer)
     product = db.relationship("Product", back_populates="suppliers")
     supplier = db.relationship("Supplier", back_populates="products")
-    
+    # the columns serialize() returns, in order
+    COLUMNS = ("supplier_id", "product_id", "wholesale_price")
+
     def serialize(self):
         """ Serializes an Association into a dictionary """
         return {
@@ -72,11 +150,167 @@ class Association(db.Model):
         logger.info("Processing all Associations")
         return cls.query.all()
 
+    @classmethod
+    def page(cls, limit, after=None, query=None):
+        """ Returns a page of Associations that follows the key after """
+        logger.info("Processing page of %s Associations after %s", limit, after)
+        if query is None:
+            query = cls.query
+        return keyset_page(query, [cls.supplier_id, cls.product_id], limit, after)
+
+    @classmethod
+    def rows(cls, query=None):
+        """ Returns a query of the serialized columns as row tuples instead of Associations """
+        if query is None:
+            query = cls.query
+        return query.with_entities(*[getattr(cls, name) for name in cls.COLUMNS])
+
+    @classmethod
+    def serialize_rows(cls, rows):
+        """ Serializes the row tuples of rows() like serialize() without creating Associations """
+        return row_dicts(cls.COLUMNS, rows)
+
     @classmethod
     def find(cls, supplier_id, product_id):
         """ Finds Association by it's ID """
         logger.info("Processing lookup for id %s ...", supplier_id)
         return cls.query.get((supplier_id, product_id))
+
+    @classmethod
+    def find_many(cls, keys, batch_size=200):
+        """Returns the Associations with any of the (supplier_id, product_id) keys
+
+        The keys are looked up batch_size at a time, with a row value IN on
+        PostgreSQL. Other databases match the products of each supplier of
+        the batch, since SQLite only accepts a subquery on the right of a
+        row value IN
+
+        Args:
+            keys (list): the (supplier_id, product_id) keys to look up
+            batch_size (int): the number of keys looked up per query
+
+        Returns:
+            list: the row tuples of rows() of the keys that were found
+        """
+        logger.info("Processing lookup for %s Associations ...", len(keys))
+        keys = sorted(set(keys))
+        rows = []
+        for start in range(0, len(keys), batch_size):
+            batch = keys[start:start + batch_size]
+            if db.engine.dialect.name == "postgresql":
+                condition = tuple_(cls.supplier_id, cls.product_id).in_(batch)
+            else:
+                products = {}
+                for supplier_id, product_id in batch:
+                    products.setdefault(supplier_id, []).append(product_id)
+                condition = or_(*[
+                    and_(cls.supplier_id == supplier_id, cls.product_id.in_(product_ids))
+                    for supplier_id, product_ids in products.items()
+                ])
+            rows.extend(cls.rows().filter(condition))
+        return rows
+
+    @classmethod
+    def replace_all(cls, supplier_id, prices, batch_size):
+        """Makes the products of a Supplier exactly the ones of prices, in one transaction
+
+        On PostgreSQL the rows are upserted with INSERT ... ON CONFLICT DO
+        UPDATE, skipping the ones whose price didn't change. Other databases
+        read the current prices once and send an INSERT and an UPDATE of the
+        rows that changed. The products that aren't in prices are deleted
+
+        Args:
+            supplier_id (int): the id of the Supplier
+            prices (dict): the wholesale price of each product id
+            batch_size (int): the number of rows sent per statement
+
+        Returns:
+            dict: the number of associations created, updated and deleted
+        """
+        logger.info("Replacing the %s products of Supplier %s", len(prices), supplier_id)
+        table = cls.__table__
+        product_ids = list(prices)
+        created = []
+        updated = []
+        if db.engine.dialect.name == "postgresql":
+            for start in range(0, len(product_ids), batch_size):
+                rows = [
+                    {"supplier_id": supplier_id, "product_id": product_id, "wholesale_price": prices[product_id]}
+                    for product_id in product_ids[start:start + batch_size]
+                ]
+                statement = postgresql.insert(table).values(rows)
+                statement = statement.on_conflict_do_update(
+                    index_elements=[table.c.supplier_id, table.c.product_id],
+                    set_={"wholesale_price": statement.excluded.wholesale_price},
+                    where=table.c.wholesale_price.is_distinct_from(statement.excluded.wholesale_price),
+                ).returning(table.c.product_id, literal_column("xmax = 0"))
+                # xmax is 0 for the rows that were inserted rather than updated
+                for product_id, inserted in db.session.execute(statement):
+                    (created if inserted else updated).append(product_id)
+            deleted = table.delete().where(table.c.supplier_id == supplier_id)
+            if product_ids:
+                deleted = deleted.where(table.c.product_id.notin_(product_ids))
+            deleted = [row[0] for row in db.session.execute(deleted.returning(table.c.product_id))]
+        else:
+            current = dict(
+                db.session.query(cls.product_id, cls.wholesale_price).filter(cls.supplier_id == supplier_id)
+            )
+            created = [product_id for product_id in product_ids if product_id not in current]
+            updated = [
+                product_id for product_id in product_ids
+                if product_id in current and current[product_id] != prices[product_id]
+            ]
+            deleted = [product_id for product_id in current if product_id not in prices]
+            if created:
+                db.session.execute(table.insert(), [
+                    {"supplier_id": supplier_id, "product_id": product_id, "wholesale_price": prices[product_id]}
+                    for product_id in created
+                ])
+            if updated:
+                db.session.execute(
+                    table.update()
+                    .where(table.c.supplier_id == bindparam("b_supplier_id"))
+                    .where(table.c.product_id == bindparam("b_product_id"))
+                    .values(wholesale_price=bindparam("b_wholesale_price")),
+                    [
+                        {"b_supplier_id": supplier_id, "b_product_id": product_id,
+                         "b_wholesale_price": prices[product_id]}
+                        for product_id in updated
+                    ],
+                )
+            for start in range(0, len(deleted), batch_size):
+                db.session.execute(table.delete().where(
+                    and_(table.c.supplier_id == supplier_id, table.c.product_id.in_(deleted[start:start + batch_size]))
+                ))
+        # Suppliers are serialized and listed together with their associations
+        tables = [cls.__tablename__, Supplier.__tablename__]
+        TableVersion.bump(*tables)
+        db.session.commit()
+        keys = [cls.cache_key(supplier_id, product_id) for product_id in created + updated + deleted]
+        keys.append(Supplier.cache_key(supplier_id))
+        keys.extend(TableVersion.cache_key(name) for name in tables)
+        cache.bump(*tables)
+        cache.delete(*keys)
+        return {"created": len(created), "updated": len(updated), "deleted": len(deleted)}
+
+    @staticmethod
+    def cache_key(supplier_id, product_id):
+        """ Returns the key of a serialized Association in the cache """
+        return "association:{}:{}".format(supplier_id, product_id)
+
+    @classmethod
+    def find_cached(cls, supplier_id, product_id):
+        """ Returns a serialized Association from the cache or the database """
+        key = cls.cache_key(supplier_id, product_id)
+        data = cache.get(key)
+        if data is None:
+            generation = cache.generation(cls.__tablename__)
+            association = cls.find(supplier_id, product_id)
+            if association is None:
+                return None
+            data = association.serialize()
+            cache.set_if_current(key, data, cls.__tablename__, generation)
+        return data
     
 ######################################################################
 #  S U P P L I E R   M O D E L
@@ -88,17 +322,40 @@ class Supplier(db.Model):
     """
 
     app = None
+    # True when PostgreSQL has pg_trgm to index and rank the search
+    trigram_search = False
+    # the pg_trgm GIN indexes created by create_search_indexes() and their columns
+    TRIGRAM_INDEXES = {"ix_supplier_name_trgm": "name", "ix_supplier_address_trgm": "address"}
+    # the in memory index used to search on other databases
+    search_index = None
+    # the columns serialize() returns, in order, besides the products
+    COLUMNS = ("id", "name", "address", "email", "phone_number", "available")
+    # the fields a sparse fieldset may ask for
+    FIELDS = COLUMNS + ("products",)
    
     __tablename__ = 'supplier'
 
     # Table Schema
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(63), nullable=False)
-    email = db.Column(db.String(63), nullable=False)
+    name = db.Column(db.String(63), nullable=False, index=True)
+    email = db.Column(db.String(63), nullable=False, index=True)
     address = db.Column(db.String(256), nullable=False)
     phone_number = db.Column(db.String(20))
-    available = db.Column(db.Boolean(), nullable=False, default=True)
-    products = db.relationship("Association", back_populates="supplier")
+    available = db.Column(db.Boolean(), nullable=False, default=True, index=True)
+    # partial index that serves the available suppliers listing in id order
+    __table_args__ = (
+        db.Index(
+            "ix_supplier_available_id",
+            id,
+            postgresql_where=available.is_(True),
+            sqlite_where=available.is_(True),
+        ),
+    )
+    # products are eagerly loaded with a single SELECT ... IN per batch of
+    # suppliers so that serialize() doesn't issue one query per supplier
+    products = db.relationship(
+        "Association", back_populates="supplier", lazy="selectin"
+    )
 
     def __repr__(self):
         return "<Supplier %r id=[%s]>" % (self.name, self.id)
@@ -125,6 +382,16 @@ class Supplier(db.Model):
         db.session.delete(self)
         db.session.commit()
 
+    def column_values(self):
+        """ Returns the Supplier table columns as a dictionary for bulk inserts """
+        return {
+            "name": self.name,
+            "address": self.address,
+            "email": self.email,
+            "phone_number": self.phone_number,
+            "available": self.available,
+        }
+
     def serialize(self):
         """ Serializes a Supplier into a dictionary """
         supplier = {"id": self.id,
@@ -166,17 +433,156 @@ class Supplier(db.Model):
             raise DataValidationError(
                 "Invalid Supplier: body of request contained bad or no data"
             )
+        self.check_types()
         return self
 
+    def check_types(self):
+        """Checks that the columns hold values the database accepts
+
+        Raises:
+            DataValidationError: when a column has the wrong type or is too long
+        """
+        for name in ("name", "address", "email", "phone_number"):
+            column = self.__table__.c[name]
+            value = getattr(self, name)
+            if value is None and column.nullable:
+                continue
+            if not isinstance(value, str) or len(value) > column.type.length:
+                raise DataValidationError(
+                    "Invalid Supplier: {} must be a string of at most {} characters".format(
+                        name, column.type.length
+                    )
+                )
+        if not isinstance(self.available, bool):
+            raise DataValidationError("Invalid Supplier: available must be true or false")
+
     @classmethod
-    def init_db(cls, app):
-        """ Initializes the database session """
-        logger.info("Initializing database")
+    def init_app(cls, app):
+        """ Connects the models to the Flask app without touching the database """
         cls.app = app
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config)
         # This is where we initialize SQLAlchemy from the Flask app
         db.init_app(app)
+        db.init_replicas(app.config)
+        cache.configure(create_backend(app.config))
+
+    @classmethod
+    def init_db(cls, app):
+        """ Initializes the database session and creates the schema """
+        logger.info("Initializing database")
+        cls.init_app(app)
         app.app_context().push()
+        cls.create_schema()
+        cls.init_search()
+
+    @classmethod
+    def create_schema(cls):
+        """ Creates the missing tables and indexes, including the search indexes """
         db.create_all()  # make our sqlalchemy tables
+        create_missing_indexes()
+        cls.create_search_indexes()
+
+    @classmethod
+    def create_search_indexes(cls):
+        """ Enables pg_trgm and its GIN indexes on PostgreSQL when it is available """
+        if db.engine.dialect.name != "postgresql":
+            return
+        try:
+            db.session.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            for index, column in cls.TRIGRAM_INDEXES.items():
+                db.session.execute(DDL(
+                    "CREATE INDEX IF NOT EXISTS {0} "
+                    "ON supplier USING gin ({1} gin_trgm_ops)".format(index, column)
+                ))
+            db.session.commit()
+        except exc.DBAPIError as error:
+            db.session.rollback()
+            logger.warning("pg_trgm is not available, search will scan the table: %s", error.orig)
+
+    @classmethod
+    def init_search(cls):
+        """
+        Searches with the pg_trgm GIN indexes on PostgreSQL when they exist,
+        falling back to an in memory trigram index on other databases
+        """
+        cls.trigram_search = False
+        cls.search_index = None
+        if db.engine.dialect.name != "postgresql":
+            logger.info("Using the in memory search index")
+            cls.search_index = TrigramIndex()
+            return
+        found = db.session.execute(
+            "SELECT count(*) FROM pg_indexes WHERE indexname IN :names",
+            {"names": tuple(cls.TRIGRAM_INDEXES)},
+        ).scalar()
+        cls.trigram_search = found == len(cls.TRIGRAM_INDEXES)
+
+    @classmethod
+    def bulk_create(cls, suppliers, batch_size):
+        """Creates many Suppliers in batches inside a single transaction
+
+        Args:
+            suppliers (list): the Suppliers to create
+            batch_size (int): the number of rows sent per INSERT statement
+
+        Returns:
+            list: the ids of the new Suppliers, in the same order
+        """
+        logger.info("Bulk creating %s Suppliers", len(suppliers))
+        ids = []
+        for start in range(0, len(suppliers), batch_size):
+            rows = [supplier.column_values() for supplier in suppliers[start:start + batch_size]]
+            if db.engine.dialect.implicit_returning:
+                # one multi-row INSERT ... VALUES ... RETURNING id per batch
+                statement = cls.__table__.insert().values(rows).returning(cls.id)
+                ids.extend(row[0] for row in db.session.execute(statement))
+            else:
+                db.session.bulk_insert_mappings(cls, rows, return_defaults=True)
+                ids.extend(row["id"] for row in rows)
+        TableVersion.bump(cls.__tablename__)
+        db.session.commit()
+        cache.bump(cls.__tablename__)
+        cache.delete(TableVersion.cache_key(cls.__tablename__))
+        supplier_changed()
+        return ids
+
+    @classmethod
+    def delete_all(cls, name=None, email=None, address=None, available=None, ids=None, everything=False):
+        """Removes every Supplier that matches all of the given filters
+
+        The Suppliers and their associations are removed with set based
+        DELETE statements in one transaction, or with a TRUNCATE on
+        PostgreSQL when no filter is given. The filters are the same as
+        the ones of find_by_filters
+
+        Raises:
+            DataValidationError: when no filter is given and everything isn't set
+        """
+        logger.info(
+            "Deleting Suppliers name=%s email=%s address=%s available=%s ids=%s everything=%s",
+            name, email, address, available, ids, everything
+        )
+        suppliers = cls.find_by_filters(name, email, address, available, ids)
+        if suppliers.whereclause is None:
+            if not everything:
+                raise DataValidationError("Deleting every Supplier needs an explicit everything=True")
+            if db.engine.dialect.name == "postgresql":
+                db.session.execute("TRUNCATE association, supplier")
+            else:
+                Association.query.delete(synchronize_session=False)
+                cls.query.delete(synchronize_session=False)
+        else:
+            supplier_ids = suppliers.with_entities(cls.id).subquery()
+            Association.query.filter(
+                Association.supplier_id.in_(supplier_ids)
+            ).delete(synchronize_session=False)
+            suppliers.delete(synchronize_session=False)
+        TableVersion.bump(Association.__tablename__, cls.__tablename__)
+        db.session.commit()
+        # the deleted ids aren't loaded, so forget everything
+        cache.bump(Association.__tablename__, cls.__tablename__)
+        cache.clear()
+        supplier_changed()
 
     @classmethod
     def all(cls):
@@ -184,12 +590,145 @@ class Supplier(db.Model):
         logger.info("Processing all Suppliers")
         return cls.query.all()
 
+    @classmethod
+    def page(cls, limit, after=None, query=None):
+        """Returns a page of Suppliers that follows the key after
+
+        Args:
+            limit (int): the maximum number of Suppliers to return
+            after (tuple): the id of the last Supplier of the previous page
+            query (Query): an optional filtered query to page through
+        """
+        logger.info("Processing page of %s Suppliers after %s", limit, after)
+        if query is None:
+            query = cls.query
+        return keyset_page(query, [cls.id], limit, after)
+
+    @classmethod
+    def columns(cls, fields=None):
+        """ Returns the names of the columns selected for fields, id always first """
+        return ["id"] + [name for name in cls.COLUMNS[1:] if fields is None or name in fields]
+
+    @classmethod
+    def rows(cls, query=None, fields=None):
+        """Returns a query of the serialized columns as row tuples instead of Suppliers
+
+        Args:
+            query (Query): an optional filtered query of Suppliers
+            fields (list): only select the columns of these fields, and the id
+        """
+        if query is None:
+            query = cls.query
+        return query.with_entities(*[getattr(cls, name) for name in cls.columns(fields)])
+
+    @classmethod
+    def json_rows(cls, query=None, fields=None):
+        """Returns a query of (id, JSON text) row tuples of the serialized Suppliers
+
+        The database builds the JSON of each Supplier and nests its products
+        with a correlated json_agg (json_group_array on SQLite) subquery, so
+        the rows are joined into a response without being decoded. The keys
+        are in sorted order like jsonify()
+
+        Args:
+            query (Query): an optional filtered query of Suppliers
+            fields (list): only include these fields, None for all
+        """
+        if query is None:
+            query = cls.query
+        # the query may be routed to a replica, which is the bind that runs it
+        dialect = query.session.get_bind(cls.__mapper__).dialect.name
+        values = {name: getattr(cls, name) for name in cls.COLUMNS}
+        if fields is None or "products" in fields:
+            product = json_object(dialect, [(name, getattr(Association, name)) for name in sorted(Association.COLUMNS)])
+            products = (
+                select([json_array_agg(dialect, product)])
+                .where(Association.supplier_id == cls.id)
+                .correlate(cls.__table__)
+                .as_scalar()
+            )
+            # SQLite only nests JSON built by the same expression, so the
+            # text of the subquery is parsed back into JSON with json()
+            values["products"] = func.json(products) if dialect == "sqlite" else products
+        pairs = [(name, values[name]) for name in sorted(values) if fields is None or name in fields]
+        return query.with_entities(cls.id, cast(json_object(dialect, pairs), db.Text))
+
+    @classmethod
+    def serialize_rows(cls, rows, fields=None, batch_size=500):
+        """Serializes the row tuples of rows() like serialize() without creating Suppliers
+
+        The products are read as row tuples too, with one SELECT ... IN per
+        batch_size Suppliers like the selectin products relationship, unless
+        fields leaves them out
+
+        Args:
+            rows (list): the row tuples of the Suppliers
+            fields (list): the fields rows were selected for, None for all
+            batch_size (int): the number of Suppliers per query of their products
+        """
+        suppliers = row_dicts(cls.columns(fields), rows)
+        if fields is None or "products" in fields:
+            products = {}
+            for supplier in suppliers:
+                supplier["products"] = products[supplier["id"]] = []
+            ids = list(products)
+            for start in range(0, len(ids), batch_size):
+                query = Association.rows().filter(Association.supplier_id.in_(ids[start:start + batch_size]))
+                for row in query:
+                    products[row[0]].append(dict(zip(Association.COLUMNS, row)))
+        if fields is not None and "id" not in fields:
+            for supplier in suppliers:
+                del supplier["id"]
+        return suppliers
+
+    @classmethod
+    def stream(cls, batch_size):
+        """Returns an iterator over every Supplier ordered by id
+
+        Rows are read through a server side cursor batch_size at a time so
+        memory stays bounded no matter how many Suppliers there are
+
+        Args:
+            batch_size (int): the number of Suppliers fetched per batch
+        """
+        logger.info("Streaming all Suppliers in batches of %s", batch_size)
+        return cls.query.order_by(cls.id).yield_per(batch_size)
+
     @classmethod
     def find(cls, by_id):
         """ Finds a Supplier by it's ID """
         logger.info("Processing lookup for id %s ...", by_id)
         return cls.query.get(by_id)
 
+    @classmethod
+    def find_many(cls, ids):
+        """Returns a query of the Suppliers with any of the ids, in one IN query
+
+        Args:
+            ids (list): the ids of the Suppliers you want to look up
+        """
+        logger.info("Processing lookup for %s Suppliers ...", len(ids))
+        return cls.query.filter(cls.id.in_(ids))
+
+    @staticmethod
+    def cache_key(by_id):
+        """ Returns the key of a serialized Supplier in the cache """
+        return "supplier:{}".format(by_id)
+
+    @classmethod
+    def find_cached(cls, by_id):
+        """ Returns a serialized Supplier from the cache or the database """
+        key = cls.cache_key(by_id)
+        data = cache.get(key)
+        if data is None:
+            generation = cache.generation(cls.__tablename__)
+            supplier = cls.find(by_id)
+            if supplier is None:
+                return None
+            data = supplier.serialize()
+            cache.set_if_current(key, data, cls.__tablename__, generation)
+        return data
+
     @classmethod
     def find_or_404(cls, by_id):
         """ Find a Supplier by it's id """
@@ -236,12 +775,89 @@ class Supplier(db.Model):
         logger.info("Processing available query for %s ...", available)
         return cls.query.filter(cls.available == available)     
 
+    @classmethod
+    def find_by_filters(cls, name=None, email=None, address=None, available=None, ids=None):
+        """Returns all Suppliers that match every one of the given filters
+
+        Filters that are None are ignored so the query can use the indexes
+        of the remaining columns together
+
+        Args:
+            name (string): the name of the Suppliers you want to match
+            email (string): the email of the Suppliers you want to match
+            address (string): the address of the Suppliers you want to match
+            available (bool): the availability of the Suppliers you want to match
+            ids (list): the ids of the Suppliers you want to match
+        """
+        logger.info(
+            "Processing query for name=%s email=%s address=%s available=%s ids=%s",
+            name, email, address, available, ids
+        )
+        query = cls.query
+        if name is not None:
+            query = query.filter(cls.name == name)
+        if email is not None:
+            query = query.filter(cls.email == email)
+        if address is not None:
+            query = query.filter(cls.address == address)
+        if available is not None:
+            query = query.filter(cls.available == available)
+        if ids is not None:
+            query = query.filter(cls.id.in_(ids))
+        return query
+
+    @classmethod
+    def search(cls, text, limit, offset=0):
+        """Returns the Suppliers whose name or address contains text
+
+        Matches are ranked with name prefixes first, then by trigram
+        similarity, and paged with limit and offset
+
+        Args:
+            text (string): the text to look for
+            limit (int): the maximum number of Suppliers to return
+            offset (int): the number of ranked matches to skip
+        """
+        logger.info("Processing search for %s ...", text)
+        if cls.search_index is not None:
+            # keyed on the shared table version, so writes of other workers rebuild it too
+            version = TableVersion.current(cls.__tablename__)[0]
+            if not cls.search_index.is_current(version):
+                cls.search_index.rebuild(db.session.query(cls.id, cls.name, cls.address), version)
+            ids = cls.search_index.search(text, limit, offset)
+            suppliers = {supplier.id: supplier for supplier in cls.query.filter(cls.id.in_(ids))}
+            return [suppliers[by_id] for by_id in ids if by_id in suppliers]
+
+        escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        matches = or_(
+            cls.name.ilike("%" + escaped + "%", escape="\\"),
+            cls.address.ilike("%" + escaped + "%", escape="\\"),
+        )
+        order = [desc(cls.name.ilike(escaped + "%", escape="\\"))]
+        if cls.trigram_search:
+            order.append(desc(func.greatest(
+                func.similarity(cls.name, text), func.similarity(cls.address, text)
+            )))
+        else:
+            order.append(func.length(cls.name))
+        order.append(cls.id)
+        return cls.query.filter(matches).order_by(*order).offset(offset).limit(limit).all()
+
     @classmethod
     def sort_by(cls, sort_by):
         """Returns all of the suppliers sorted by customer_id"""
         logger.info("Processing all suppliers query sorted by %s ...", sort_by)
         return cls.query.order_by(asc(sort_by))
 
+def supplier_changed():
+    """Marks the in memory search index stale once Suppliers were written
+
+    Called after the commit or the rollback of the write, so a search that
+    runs in between can't mark an index built without it as fresh
+    """
+    if Supplier.search_index is not None:
+        Supplier.search_index.invalidate()
+
 ######################################################################
 #  P R O D U C T  M O D E L
 ######################################################################
@@ -256,6 +872,8 @@ class Product(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64))
     suppliers = db.relationship("Association", back_populates="product") 
+    # the columns serialize() returns, in order
+    COLUMNS = ("id", "name")
 
     def __repr__(self):
         return "<Product %r id=[%s]>" % (self.name, self.id)
@@ -315,14 +933,365 @@ class Product(db.Model):
         logger.info("Processing all Products")
         return cls.query.all()
 
+    @classmethod
+    def page(cls, limit, after=None, query=None):
+        """ Returns a page of Products that follows the key after """
+        logger.info("Processing page of %s Products after %s", limit, after)
+        if query is None:
+            query = cls.query
+        return keyset_page(query, [cls.id], limit, after)
+
+    @classmethod
+    def rows(cls, query=None):
+        """ Returns a query of the serialized columns as row tuples instead of Products """
+        if query is None:
+            query = cls.query
+        return query.with_entities(*[getattr(cls, name) for name in cls.COLUMNS])
+
+    @classmethod
+    def serialize_rows(cls, rows):
+        """ Serializes the row tuples of rows() like serialize() without creating Products """
+        return row_dicts(cls.COLUMNS, rows)
+
+    @classmethod
+    def find_by_name(cls, name):
+        """ Returns all Products with the given name """
+        logger.info("Processing name query for %s ...", name)
+        return cls.query.filter(cls.name == name)
+
     @classmethod
     def find(cls, by_id):
         """ Finds a Product by it's ID """
         logger.info("Processing lookup for id %s ...", by_id)
         return cls.query.get(by_id)
 
+    @classmethod
+    def find_many(cls, ids):
+        """ Returns a query of the Products with any of the ids, in one IN query """
+        logger.info("Processing lookup for %s Products ...", len(ids))
+        return cls.query.filter(cls.id.in_(ids))
+
+    @staticmethod
+    def cache_key(by_id):
+        """ Returns the key of a serialized Product in the cache """
+        return "product:{}".format(by_id)
+
+    @classmethod
+    def find_cached(cls, by_id):
+        """ Returns a serialized Product from the cache or the database """
+        key = cls.cache_key(by_id)
+        data = cache.get(key)
+        if data is None:
+            generation = cache.generation(cls.__tablename__)
+            product = cls.find(by_id)
+            if product is None:
+                return None
+            data = product.serialize()
+            cache.set_if_current(key, data, cls.__tablename__, generation)
+        return data
+
     @classmethod
     def find_or_404(cls, by_id):
         """ Find a Product by it's id """
         logger.info("Processing lookup or 404 for id %s ...", by_id)
-        return cls.query.get_or_404(by_id)
\ No newline at end of file
+        return cls.query.get_or_404(by_id)
+
+
+######################################################################
+#  T A B L E   V E R S I O N S
+######################################################################
+class TableVersion(db.Model):
+    """
+    Counts the changes to each table
+
+    The counter is incremented in the same transaction as every write, so
+    it can be used as a strong validator of anything read from the table.
+    The increment is the last statement before the commit, so concurrent
+    writers of a table only wait for each other's commits
+    """
+
+    __tablename__ = "table_version"
+
+    name = db.Column(db.String(63), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False)
+
+    @staticmethod
+    def cache_key(name):
+        """ Returns the key of the version of a table in the cache """
+        return "table_version:{}".format(name)
+
+    @classmethod
+    def bump(cls, *names):
+        """Increments the versions of the given tables in the current transaction
+
+        The rows are locked one at a time in name order, so transactions
+        bumping the same tables can't deadlock. Call it right before the
+        commit to hold the locks as briefly as possible
+        """
+        for name in sorted(set(names)):
+            db.session.execute(
+                cls.__table__.update()
+                .where(cls.name == name)
+                .values(version=cls.version + 1)
+            )
+
+    @classmethod
+    def current(cls, *names):
+        """Returns the versions of the given tables from the cache or the database
+
+        Returns:
+            list: the version of each table, in the same order
+        """
+        versions = {name: cache.get(cls.cache_key(name)) for name in names}
+        missing = [name for name, version in versions.items() if version is None]
+        if missing:
+            generations = {name: cache.generation(name) for name in missing}
+            rows = db.session.query(cls.name, cls.version).filter(cls.name.in_(missing))
+            for name, version in rows:
+                versions[name] = version
+                cache.set_if_current(cls.cache_key(name), version, name, generations[name])
+        return [versions[name] for name in names]
+
+
+@event.listens_for(TableVersion.__table__, "after_create")
+def seed_table_versions(target, connection, **kw):
+    """ Starts the counters from the clock so a recreated table never repeats a version """
+    start = int(time.time() * 1000)
+    connection.execute(
+        target.insert(),
+        [{"name": table.name, "version": start} for table in db.metadata.sorted_tables],
+    )
+
+
+######################################################################
+#  I M P O R T   J O B S
+######################################################################
+class ImportJob(db.Model):
+    """
+    A file of Suppliers imported in the background
+
+    The table is the queue of the import workers: a job is claimed by
+    switching its status from queued to running under a new claim token, and
+    its progress is saved in the same transaction as each batch of Suppliers
+    it creates, as long as the token is still that of the worker
+    """
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    __tablename__ = "import_job"
+
+    id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String(16), nullable=False, default=QUEUED, index=True)
+    content_type = db.Column(db.String(63), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    total = db.Column(db.Integer)
+    processed = db.Column(db.Integer, nullable=False, default=0)
+    created = db.Column(db.Integer, nullable=False, default=0)
+    failed = db.Column(db.Integer, nullable=False, default=0)
+    errors = db.Column(db.Text, nullable=False, default="[]")
+    error = db.Column(db.String(256))
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    claim_token = db.Column(db.String(32))
+
+    def __repr__(self):
+        return "<ImportJob id=[%s] %s>" % (self.id, self.status)
+
+    def create(self):
+        """ Queues an ImportJob """
+        logger.info("Queueing import of %s characters", len(self.payload))
+        db.session.add(self)
+        db.session.commit()
+
+    def serialize(self):
+        """ Serializes the progress of an ImportJob into a dictionary """
+        end = self.finished_at or self.updated_at
+        elapsed = (end - self.started_at).total_seconds() if self.started_at and end else 0
+        return {
+            "id": self.id,
+            "status": self.status,
+            "rows": self.total,
+            "processed": self.processed,
+            "created": self.created,
+            "failed": self.failed,
+            "errors": json.loads(self.errors),
+            "error": self.error,
+            "elapsed_seconds": round(elapsed, 6),
+            "rows_per_sec": round(self.processed / elapsed, 1) if elapsed else None,
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+    def record(self, processed, created, errors, max_errors):
+        """Adds the outcome of a batch to the progress, keeping at most max_errors errors
+
+        Args:
+            processed (int): the number of rows in the batch
+            created (int): the number of Suppliers the batch created
+            errors (list): the index and error of every bad row of the batch
+            max_errors (int): the number of row errors kept for the report
+        """
+        self.processed += processed
+        self.created += created
+        self.failed += len(errors)
+        kept = json.loads(self.errors)
+        if len(kept) < max_errors:
+            self.errors = json.dumps(kept + errors[:max_errors - len(kept)])
+        self.updated_at = datetime.utcnow()
+
+    def renew(self):
+        """Refreshes the claim of this worker in the transaction of a batch
+
+        On PostgreSQL the row stays locked until the batch is committed, so
+        it can't be claimed again meanwhile
+
+        Returns:
+            bool: False if another worker claimed the job since, and the
+            batch must be rolled back
+        """
+        cls = type(self)
+        renewed = cls.query.filter(cls.id == self.id, cls.claim_token == self.claim_token).update(
+            {cls.updated_at: datetime.utcnow()}, synchronize_session=False
+        )
+        return renewed == 1
+
+    def finish(self, error=None):
+        """ Marks an ImportJob done, or failed with an error """
+        logger.info("Import %s finished: %s", self.id, error or "done")
+        self.status = self.FAILED if error else self.DONE
+        self.error = error[:256] if error else None
+        self.finished_at = self.updated_at = datetime.utcnow()
+        db.session.commit()
+
+    @classmethod
+    def find(cls, by_id):
+        """ Finds an ImportJob by it's ID """
+        logger.info("Processing lookup for import %s ...", by_id)
+        return cls.query.get(by_id)
+
+    @classmethod
+    def claim(cls, stale_seconds):
+        """Claims the oldest queued ImportJob for this worker
+
+        A running job whose progress has not been saved for stale_seconds
+        belongs to a worker that died, so it is claimed again and resumed
+
+        Returns:
+            ImportJob: the claimed job, or None if there is nothing to do
+        """
+        now = datetime.utcnow()
+        claimable = or_(
+            cls.status == cls.QUEUED,
+            and_(cls.status == cls.RUNNING, cls.updated_at < now - timedelta(seconds=stale_seconds)),
+        )
+        candidates = [row.id for row in db.session.query(cls.id).filter(claimable).order_by(cls.id).limit(10)]
+        for job_id in candidates:
+            # only one worker's UPDATE still matches when several race for a job
+            claimed = cls.query.filter(cls.id == job_id, claimable).update(
+                {
+                    cls.status: cls.RUNNING,
+                    cls.started_at: func.coalesce(cls.started_at, now),
+                    cls.updated_at: now,
+                    cls.claim_token: uuid.uuid4().hex,
+                },
+                synchronize_session=False,
+            )
+            db.session.commit()
+            if claimed:
+                logger.info("Claimed import %s", job_id)
+                return cls.query.get(job_id)
+        return None
+
+
+######################################################################
+#  C A C H E   I N V A L I D A T I O N
+######################################################################
+def cache_keys(instance):
+    """ Returns the cache keys holding a serialized copy of a model instance """
+    if isinstance(instance, Supplier):
+        return [Supplier.cache_key(instance.id)]
+    if isinstance(instance, Product):
+        return [Product.cache_key(instance.id)]
+    if isinstance(instance, Association):
+        # Suppliers are serialized together with their associations
+        return [
+            Association.cache_key(instance.supplier_id, instance.product_id),
+            Supplier.cache_key(instance.supplier_id),
+        ]
+    return []
+
+
+def cache_tables(instance):
+    """ Returns the tables whose cached list responses include a model instance """
+    if isinstance(instance, Association):
+        # Suppliers are listed together with their associations
+        return [Association.__tablename__, Supplier.__tablename__]
+    if isinstance(instance, (Supplier, Product)):
+        return [instance.__tablename__]
+    return []
+
+
+@event.listens_for(db.session, "after_flush")
+def invalidate_flushed(session, flush_context):
+    """ Removes every instance written by the flush from the cache """
+    keys = session.info.setdefault("cache_keys", set())
+    tables = session.info.setdefault("cache_tables", set())
+    flushed = set()
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        keys.update(cache_keys(instance))
+        flushed.update(cache_tables(instance))
+    session.info.setdefault("version_tables", set()).update(flushed)
+    if Supplier.__tablename__ in flushed:
+        session.info["suppliers_flushed"] = True
+    if session.info.get("committing"):
+        # the flush of the commit, its last statements
+        TableVersion.bump(*session.info.pop("version_tables"))
+    tables.update(flushed)
+    keys.update(TableVersion.cache_key(table) for table in tables)
+    # bumped first, so a reader that loaded the old rows doesn't cache them
+    cache.bump(*tables)
+    cache.delete(*keys)
+
+
+@event.listens_for(db.session, "before_commit")
+def bump_committed(session):
+    """ Bumps the versions of the flushed tables as the last statements of the transaction """
+    if session.new or session.dirty or session.deleted:
+        # the commit flushes after this hook, invalidate_flushed bumps then
+        session.info["committing"] = True
+    else:
+        TableVersion.bump(*session.info.pop("version_tables", ()))
+
+
+@event.listens_for(db.session, "after_rollback")
+def forget_rolled_back(session):
+    """ The tables of a rolled back transaction didn't change """
+    session.info.pop("version_tables", None)
+    session.info.pop("committing", None)
+    if session.info.pop("suppliers_flushed", None):
+        # a search may have indexed the flushed rows before the rollback
+        supplier_changed()
+
+
+@event.listens_for(db.session, "after_commit")
+def invalidate_committed(session):
+    """ Removes the flushed instances again in case a reader cached them before the commit """
+    session.info.pop("committing", None)
+    if session.info.pop("suppliers_flushed", None):
+        supplier_changed()
+    cache.bump(*session.info.pop("cache_tables", ()))
+    cache.delete(*session.info.pop("cache_keys", ()))
+
+
+@event.listens_for(db.metadata, "after_create")
+@event.listens_for(db.metadata, "after_drop")
+def invalidate_schema(target, connection, **kw):
+    """ Forgets everything cached when the tables are created or dropped """
+    cache.clear()
+    supplier_changed()
@@ -0,0 +1,117 @@
+"""
+Database connection pool
+
+Builds the engine options of the connection pool from the configuration
+and counts how long requests wait for a connection, how many are in use
+and how often the pool has to overflow or times out
+"""
+import time
+import threading
+from sqlalchemy import exc
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+
+
+class PoolMetrics:
+    """ Counters of the connection checkouts of a pool """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.checkout_seconds = 0.0
+        self.checkout_seconds_max = 0.0
+        self.overflows = 0
+        self.timeouts = 0
+
+    def record(self, seconds, overflowed):
+        """ Counts one checkout that waited seconds for a connection """
+        with self._lock:
+            self.checkouts += 1
+            self.checkout_seconds += seconds
+            self.checkout_seconds_max = max(self.checkout_seconds_max, seconds)
+            if overflowed:
+                self.overflows += 1
+
+    def timed_out(self):
+        """ Counts a checkout that gave up waiting for a connection """
+        with self._lock:
+            self.timeouts += 1
+
+
+class InstrumentedQueuePool(QueuePool):
+    """ A QueuePool that records its checkouts in a PoolMetrics """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        overflow = self.overflow()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.metrics.timed_out()
+            raise
+        # the overflow counter goes above 0 once the pool itself is exhausted
+        self.metrics.record(time.perf_counter() - start, self.overflow() > max(overflow, 0))
+        return connection
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+    def stats(self):
+        """ Returns the state and counters of the pool as a dictionary """
+        metrics = self.metrics
+        with metrics._lock:
+            average = metrics.checkout_seconds / metrics.checkouts if metrics.checkouts else 0.0
+            return {
+                "size": self.size(),
+                "checked_in": self.checkedin(),
+                "checked_out": self.checkedout(),
+                "overflow": max(self.overflow(), 0),
+                "max_overflow": self._max_overflow,
+                "checkouts": metrics.checkouts,
+                "checkout_ms_avg": round(average * 1000, 3),
+                "checkout_ms_max": round(metrics.checkout_seconds_max * 1000, 3),
+                "overflows": metrics.overflows,
+                "timeouts": metrics.timeouts,
+            }
+
+
+def engine_options(config):
+    """Returns the SQLAlchemy engine options of the configured pool
+
+    SQLite keeps the pool SQLAlchemy chooses for it, since file and memory
+    databases don't support a QueuePool of this size
+
+    Args:
+        config (dict): the application configuration with DB_POOL_SIZE,
+            DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE,
+            DB_POOL_PRE_PING and DB_STATEMENT_TIMEOUT
+    """
+    url = make_url(config["SQLALCHEMY_DATABASE_URI"])
+    if url.get_backend_name() == "sqlite":
+        return {}
+    options = {
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": config["DB_POOL_SIZE"],
+        "max_overflow": config["DB_MAX_OVERFLOW"],
+        "pool_timeout": config["DB_POOL_TIMEOUT"],
+        "pool_recycle": config["DB_POOL_RECYCLE"],
+        "pool_pre_ping": config["DB_POOL_PRE_PING"],
+    }
+    if url.get_backend_name() in ("postgres", "postgresql") and config["DB_STATEMENT_TIMEOUT"]:
+        options["connect_args"] = {
+            "options": "-c statement_timeout={}".format(config["DB_STATEMENT_TIMEOUT"])
+        }
+    return options
+
+
+def pool_stats(engine):
+    """ Returns the stats of the pool of an engine, or None if it isn't instrumented """
+    if isinstance(engine.pool, InstrumentedQueuePool):
+        return engine.pool.stats()
+    return None
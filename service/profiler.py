@@ -0,0 +1,203 @@
+"""
+SQL Profiler
+
+An opt-in profiler of the SQL statements the models send. It is built on
+the SQLAlchemy before/after_cursor_execute events and records every
+statement by fingerprint (the statement with its literals and parameters
+replaced by ?), with its duration, the rows it returned or changed, the
+route of the request that sent it and the function of the service that
+ran it, like Supplier.find_cached or list_suppliers.
+
+  SQL_PROFILER=true       turns it on
+  SQL_SLOW_QUERY_MS=100   logs slower statements with their EXPLAIN plan
+  SQL_PROFILER_DEBUG=true adds the X-SQL-Profile summary header to every
+                          response and serves GET /debug/sql
+
+sqlite3 doesn't count the rows of a SELECT, so they are -1 on SQLite.
+"""
+import os
+import re
+import sys
+import time
+import logging
+import threading
+from collections import deque
+from flask import g, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger("flask.app")
+
+# the source files whose functions are reported as the origin of a statement
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+PROFILER_FILE = os.path.abspath(__file__)
+
+FINGERPRINT_RULES = [
+    (re.compile(r"'(?:[^']|'')*'"), "?"),                      # string literals
+    (re.compile(r"%\(\w+\)s|(?<![:\w]):\w+"), "?"),             # bound parameters
+    (re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b"), "?"),           # numbers
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)"), "(?)"),          # IN lists
+    (re.compile(r"\s+"), " "),
+]
+
+
+def fingerprint(statement):
+    """ Returns a statement with its literals and parameters replaced by ? """
+    for pattern, replacement in FINGERPRINT_RULES:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()
+
+
+def origin():
+    """ Returns the innermost function of the service that is running a statement """
+    frame = sys._getframe(2)  # pylint: disable=protected-access
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(SERVICE_DIR) and filename != PROFILER_FILE:
+            name = frame.f_code.co_name
+            owner = frame.f_locals.get("cls") or getattr(frame.f_locals.get("self"), "__class__", None)
+            if owner is not None and hasattr(owner, name):
+                return "{}.{}".format(owner.__name__, name)
+            return name
+        frame = frame.f_back
+    return None
+
+
+def explain(conn, statement, parameters):
+    """ Returns the plan of a SELECT on the connection that ran it """
+    dialect = conn.dialect.name
+    prefix = "EXPLAIN QUERY PLAN " if dialect == "sqlite" else "EXPLAIN "
+    explain_cursor = conn.connection.cursor()
+    try:
+        if dialect != "sqlite":
+            # a failed EXPLAIN must not abort the transaction of the request
+            explain_cursor.execute("SAVEPOINT sql_profiler")
+        try:
+            explain_cursor.execute(prefix + statement, parameters)
+            plan = "\n".join(" ".join(str(column) for column in row) for row in explain_cursor.fetchall())
+        except Exception as error:  # pylint: disable=broad-except
+            plan = "no plan: {}".format(error)
+            if dialect != "sqlite":
+                explain_cursor.execute("ROLLBACK TO SAVEPOINT sql_profiler")
+        if dialect != "sqlite":
+            explain_cursor.execute("RELEASE SAVEPOINT sql_profiler")
+        return plan
+    finally:
+        explain_cursor.close()
+
+
+class SQLProfiler:
+    """ Collects the statements of every request while it is enabled """
+
+    def __init__(self, slow_query_ms=100, history=100):
+        self.enabled = False
+        self.slow_query_ms = slow_query_ms
+        self._lock = threading.Lock()
+        self._fingerprints = {}
+        self._requests = deque(maxlen=history)
+
+    def configure(self, enabled, slow_query_ms):
+        """ Turns the profiler on or off """
+        self.slow_query_ms = slow_query_ms
+        if enabled and not self.enabled:
+            event.listen(Engine, "before_cursor_execute", self.before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", self.after_cursor_execute)
+        elif self.enabled and not enabled:
+            event.remove(Engine, "before_cursor_execute", self.before_cursor_execute)
+            event.remove(Engine, "after_cursor_execute", self.after_cursor_execute)
+        self.enabled = enabled
+
+    def reset(self):
+        """ Forgets everything that was recorded """
+        with self._lock:
+            self._fingerprints.clear()
+            self._requests.clear()
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        """ Notes when a statement was sent """
+        conn.info.setdefault("sql_profiler_start", []).append(time.perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        """ Records a statement once it has run """
+        starts = conn.info.get("sql_profiler_start")
+        if not starts:
+            return
+        elapsed_ms = (time.perf_counter() - starts.pop()) * 1000
+        route = request.endpoint if has_request_context() else None
+        caller = origin()
+        key = fingerprint(statement)
+        rows = cursor.rowcount
+        with self._lock:
+            stats = self._fingerprints.get(key)
+            if stats is None:
+                stats = self._fingerprints[key] = {
+                    "fingerprint": key, "count": 0, "total_ms": 0.0, "max_ms": 0.0, "rows": 0, "origins": {},
+                }
+            stats["count"] += 1
+            stats["total_ms"] += elapsed_ms
+            stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+            stats["rows"] += max(rows, 0)
+            where = "{} {}".format(route or "-", caller or "-")
+            stats["origins"][where] = stats["origins"].get(where, 0) + 1
+
+        if has_app_context() and g.get("sql_profile") is not None:
+            g.sql_profile.append({"fingerprint": key, "ms": round(elapsed_ms, 3), "rows": rows, "origin": caller})
+
+        if elapsed_ms >= self.slow_query_ms:
+            plan = None
+            if not executemany and statement.lstrip().upper().startswith("SELECT"):
+                try:
+                    plan = explain(conn, statement, parameters)
+                except Exception as error:  # pylint: disable=broad-except
+                    plan = "no plan: {}".format(error)
+            logger.warning(
+                "Slow query %.1f ms in %s %s (%s rows): %s\n%s",
+                elapsed_ms, route or "-", caller or "-", rows, statement, plan or "no plan",
+            )
+
+    def start_request(self):
+        """ Starts collecting the statements of a request """
+        g.sql_profile = []
+
+    def finish_request(self, response):
+        """Ends the statements of a request and returns its summary
+
+        The summary is kept for GET /debug/sql, and is None outside of a
+        profiled request
+        """
+        statements = g.get("sql_profile")
+        if statements is None:
+            return None
+        g.sql_profile = None
+        summary = {
+            "method": request.method,
+            "path": request.full_path.rstrip("?"),
+            "endpoint": request.endpoint,
+            "status": response.status_code,
+            "queries": len(statements),
+            "time_ms": round(sum(statement["ms"] for statement in statements), 3),
+            "statements": statements,
+        }
+        with self._lock:
+            self._requests.append(summary)
+        return summary
+
+    def report(self, limit=50):
+        """ Returns the statements that took the most time and the latest requests """
+        with self._lock:
+            fingerprints = sorted(self._fingerprints.values(), key=lambda stats: -stats["total_ms"])[:limit]
+            fingerprints = [
+                dict(stats, total_ms=round(stats["total_ms"], 3), max_ms=round(stats["max_ms"], 3),
+                     origins=dict(stats["origins"]))
+                for stats in fingerprints
+            ]
+            requests = list(self._requests)
+        return {"fingerprints": fingerprints, "requests": requests}
+
+
+profiler = SQLProfiler()
+
+
+def init_app(app):
+    """ Turns the profiler on if the configuration of app asks for it """
+    profiler.configure(app.config["SQL_PROFILER"], app.config["SQL_SLOW_QUERY_MS"])
@@ -5,16 +5,29 @@ Describe what your service does here
 """
 
 import os
+import re
 import sys
+import json
+import time
+import base64
+import binascii
 import logging
-from flask import Flask, jsonify, request, url_for, make_response, abort
+from functools import wraps
+from urllib.parse import urlencode
+from flask import Flask, Response, jsonify, request, session, url_for, make_response, abort
+from flask import stream_with_context, json as flask_json
 from flask_api import status  # HTTP Status Codes
 from werkzeug.exceptions import NotFound
 
 # For this example we'll use SQLAlchemy, a popular ORM that supports a
 # variety of backends including SQLite, MySQL, and PostgreSQL
 from flask_sqlalchemy import SQLAlchemy
-from service.models import Supplier, Product, Association, DataValidationError
+from service.models import db, Supplier, Product, Association, TableVersion, ImportJob, DataValidationError, cache
+from service.pool import pool_stats
+from service import metrics
+from service.profiler import profiler
+from service.jobs import FORMATS as IMPORT_FORMATS, EXTENSIONS as IMPORT_EXTENSIONS, parse_rows
+from service.jobs import workers as import_workers
 
 # Import Flask application
 from . import app
@@ -96,6 +109,154 @@ def internal_server_error(error):
         status.HTTP_500_INTERNAL_SERVER_ERROR,
     )
 
+######################################################################
+# LIST RESPONSE CACHE
+######################################################################
+CACHED_HEADERS = ("Link", "X-Missing-Ids")
+
+
+def cached_list(*tables):
+    """
+    Caches the JSON responses of a list route by path and query string
+
+    The key includes the current generation of every table the response
+    is built from, so a write to one of them makes the cached pages
+    unreachable and they expire on their own. Bodies larger than
+    CACHE_LIST_MAX_BYTES aren't cached
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            generations = [cache.generation(table) for table in tables]
+            if None in generations:
+                return function(*args, **kwargs)
+            key = "list:{}?{}:{}".format(
+                request.path,
+                urlencode(sorted(request.args.items(multi=True))),
+                ".".join(str(generation) for generation in generations),
+            )
+            cached = cache.get(key)
+            if cached is not None:
+                return Response(
+                    cached["body"], status.HTTP_200_OK, cached["headers"], mimetype="application/json"
+                )
+            response = function(*args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                body = response.get_data()
+                if len(body) <= app.config["CACHE_LIST_MAX_BYTES"]:
+                    headers = {name: response.headers[name] for name in CACHED_HEADERS if name in response.headers}
+                    cache.set(key, {"body": body.decode("utf-8"), "headers": headers})
+            return response
+        return wrapper
+    return decorator
+
+######################################################################
+# CONDITIONAL REQUESTS
+######################################################################
+def conditional(*tables):
+    """
+    Answers GET requests with a strong ETag made of the versions of tables
+
+    The versions are read before the rows, and a request whose If-None-Match
+    matches them gets a 304 without the rows being loaded or serialized.
+    A request that reads from a replica skips the cache and reads the
+    versions from the replica too, so the ETag never claims a version its
+    body doesn't contain
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            versions = TableVersion.current(*tables)
+            if None in versions:
+                return function(*args, **kwargs)
+            etag = "-".join(
+                "{}.{}".format(table, version) for table, version in zip(tables, versions)
+            )
+            if request.if_none_match.contains(etag):
+                response = Response(status=status.HTTP_304_NOT_MODIFIED)
+                response.set_etag(etag)
+                return response
+            response = make_response(function(*args, **kwargs))
+            if response.status_code == status.HTTP_200_OK:
+                response.set_etag(etag)
+            return response
+        return wrapper
+    return decorator
+
+######################################################################
+# READ REPLICA ROUTING
+######################################################################
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+# POST endpoints that only read
+READ_ENDPOINTS = ("lookup_suppliers", "lookup_products", "lookup_associations")
+
+
+def is_read():
+    """ Returns True if the request doesn't write """
+    return request.method in READ_METHODS or request.endpoint in READ_ENDPOINTS
+
+
+@app.before_request
+def route_reads():
+    """ Reads from a replica unless the client wrote recently """
+    if is_read() and db.replicas:
+        last_write = session.get("last_write", 0)
+        if time.time() - last_write >= app.config["REPLICA_STICKY_SECONDS"]:
+            db.route_reads()
+
+
+@app.after_request
+def remember_write(response):
+    """ Sends the next reads of a client that wrote to the primary """
+    if not is_read() and db.replicas and response.status_code < 400:
+        session["last_write"] = time.time()
+    return response
+
+
+@app.teardown_request
+def route_to_primary(error=None):
+    """ Stops routing the reads of the session to a replica """
+    db.route_to_primary()
+
+######################################################################
+# REQUEST METRICS
+######################################################################
+@app.before_request
+def start_metrics():
+    """ Starts measuring the request, labelled by its endpoint """
+    metrics.start_request(request.endpoint or "none")
+
+
+@app.after_request
+def record_metrics(response):
+    """ Records the latency, size and queries of the request """
+    metrics.finish_request(request.method, response)
+    return response
+
+
+@app.teardown_request
+def end_metrics(error=None):
+    """ Stops counting the request as in progress """
+    metrics.end_request()
+
+######################################################################
+# SQL PROFILER
+######################################################################
+@app.before_request
+def start_sql_profile():
+    """ Collects the statements of the request while the profiler is on """
+    if profiler.enabled:
+        profiler.start_request()
+
+
+@app.after_request
+def finish_sql_profile(response):
+    """ Sums up the statements of the request, in a header when debugging """
+    summary = profiler.finish_request(response) if profiler.enabled else None
+    if summary is not None and app.config["SQL_PROFILER_DEBUG"]:
+        response.headers["X-SQL-Profile"] = "queries={}; time_ms={}".format(summary["queries"], summary["time_ms"])
+    return response
+
 ######################################################################
 # GET INDEX
 ######################################################################
@@ -137,37 +298,201 @@ def create_suppliers():
         jsonify(message), status.HTTP_201_CREATED, {"Location": location_url}
     )
 
+######################################################################
+# CREATE MANY SUPPLIERS
+######################################################################
+@app.route("/suppliers/bulk", methods=["POST"])
+def bulk_create_suppliers():
+    """
+    Creates many Suppliers in one transaction
+    This endpoint accepts a JSON array or newline delimited JSON of Suppliers,
+    creates the valid ones and reports the outcome of every row
+    """
+    app.logger.info("Request to bulk create Suppliers")
+    start = time.perf_counter()
+    results = []
+    suppliers = []
+    for index, data in enumerate(get_bulk_rows()):
+        try:
+            suppliers.append(Supplier().deserialize(data))
+            results.append({"index": index, "status": status.HTTP_201_CREATED})
+        except DataValidationError as error:
+            results.append({"index": index, "status": status.HTTP_400_BAD_REQUEST, "error": str(error)})
+    if not results:
+        abort(status.HTTP_400_BAD_REQUEST, "No Suppliers were posted")
+
+    ids = iter(Supplier.bulk_create(suppliers, app.config["BULK_BATCH_SIZE"]))
+    for result in results:
+        if result["status"] == status.HTTP_201_CREATED:
+            result["id"] = next(ids)
+    elapsed = time.perf_counter() - start
+
+    if not suppliers:
+        return_code = status.HTTP_400_BAD_REQUEST
+    elif len(suppliers) < len(results):
+        return_code = status.HTTP_207_MULTI_STATUS
+    else:
+        return_code = status.HTTP_201_CREATED
+    message = {
+        "created": len(suppliers),
+        "failed": len(results) - len(suppliers),
+        "elapsed_seconds": round(elapsed, 6),
+        "rows_per_sec": round(len(results) / elapsed, 1),
+        "results": results,
+    }
+    app.logger.info("Bulk created %s Suppliers at %s rows/sec", len(suppliers), message["rows_per_sec"])
+    return make_response(jsonify(message), return_code)
+
 ######################################################################
 # LIST ALL SUPPLIERS
 ######################################################################
 @app.route("/suppliers", methods=["GET"])
+@conditional("supplier")
+@cached_list("supplier")
 def list_suppliers():
     """ Returns all of the Suppliers """
     app.logger.info("Request for supplier list")
-    suppliers = []
-    name = request.args.get("name")
-    email = request.args.get("email")
-    address = request.args.get("address")
-    available = request.args.get("available")
+    filters = get_supplier_filters(("fields", "sort_by", "q", "limit", "cursor"))
+    fields = get_fields(Supplier.FIELDS)
     sort_by = request.args.get('sort_by')
+    text = request.args.get("q")
+    limit, after = get_page_args(1)
+
+    if text:
+        return search_suppliers(text, filters or sort_by is not None, limit, after, fields)
+    if filters:
+        query = Supplier.find_by_filters(**filters)
+    elif sort_by is not None:
+        if limit is not None:
+            abort(status.HTTP_400_BAD_REQUEST, "sort_by cannot be combined with limit or cursor")
+        query = Supplier.sort_by(sort_by)
+    else:
+        query = None
 
+    if app.config["LIST_JSON_IN_DATABASE"]:
+        return list_suppliers_json(query, fields, limit, after, filters.get("ids"))
 
-    if name:
-        suppliers = Supplier.find_by_name(name)
-    elif email:
-        suppliers = Supplier.find_by_email(email)
-    elif address:
-        suppliers = Supplier.find_by_address(address)    
-    elif available:
-        suppliers = Supplier.find_by_available(available)             
+    # the Suppliers are serialized straight from row tuples, not model objects,
+    # and only the columns of the requested fields are selected
+    headers = {}
+    if limit is not None:
+        rows = Supplier.page(limit, after, Supplier.rows(query, fields))
+        headers = next_page_headers(rows, limit, lambda row: [row.id])
+    else:
+        rows = Supplier.rows(query, fields).all()
+        headers = missing_ids_headers(filters.get("ids"), [row.id for row in rows])
+
+    results = Supplier.serialize_rows(rows, fields)
+    return make_response(jsonify(results), status.HTTP_200_OK, headers)
+
+def list_suppliers_json(query, fields, limit, after, ids=None):
+    """
+    Returns the Suppliers as JSON built by the database
+    Each row already holds a Supplier with its products nested, so the rows
+    are joined into the response without being decoded or encoded again
+    """
+    headers = {}
+    if limit is not None:
+        rows = Supplier.page(limit, after, Supplier.json_rows(query, fields))
+        headers = next_page_headers(rows, limit, lambda row: [row.id])
     else:
-        if sort_by is not None:
-            suppliers = Supplier.sort_by(sort_by)
-        else:
-            suppliers = Supplier.all()
+        rows = Supplier.json_rows(query, fields).all()
+        headers = missing_ids_headers(ids, [row.id for row in rows])
+    body = "[" + ",".join(row[1] for row in rows) + "]\n"
+    return Response(body, status.HTTP_200_OK, headers, mimetype="application/json")
 
+def search_suppliers(text, filtered, limit, after, fields=None):
+    """
+    Returns the Suppliers whose name or address contains text, best first
+    Unlike the other lists, the cursor of a search holds the OFFSET of the
+    next page of matches, since the ranking by similarity has no key to seek
+    on. Deep pages get slower, and a supplier written between two requests
+    may shift a match to the next or previous page
+    """
+    if filtered:
+        abort(status.HTTP_400_BAD_REQUEST, "q cannot be combined with other filters or sort_by")
+    if limit is None:
+        limit = app.config["PAGE_SIZE_DEFAULT"]
+    offset = after[0] if after else 0
+    if offset < 0:
+        abort(status.HTTP_400_BAD_REQUEST, "Invalid search cursor, the offset must not be negative")
+    suppliers = Supplier.search(text, limit, offset)
+    headers = next_page_headers(suppliers, limit, lambda supplier: [offset + limit])
     results = [supplier.serialize() for supplier in suppliers]
-    return make_response(jsonify(results), status.HTTP_200_OK)
+    if fields is not None:
+        results = [{field: result[field] for field in fields} for result in results]
+    return make_response(jsonify(results), status.HTTP_200_OK, headers)
+
+######################################################################
+# LOOK UP MANY SUPPLIERS
+######################################################################
+@app.route("/suppliers/lookup", methods=["POST"])
+def lookup_suppliers():
+    """
+    Looks up many Suppliers by id
+    This endpoint returns the Suppliers with the ids of the body, in the order
+    they were asked for, and the ids that were not found. The Suppliers are
+    read with one IN query and their products with another
+    """
+    app.logger.info("Request to look up Suppliers")
+    ids = get_lookup_ids()
+    fields = get_fields(Supplier.FIELDS)
+    rows = {row.id: row for row in Supplier.rows(Supplier.find_many(ids), fields)}
+    suppliers = Supplier.serialize_rows([rows[by_id] for by_id in ids if by_id in rows], fields)
+    missing = [by_id for by_id in ids if by_id not in rows]
+    return make_response(jsonify(suppliers=suppliers, missing=missing), status.HTTP_200_OK)
+
+######################################################################
+# EXPORT ALL SUPPLIERS
+######################################################################
+@app.route("/suppliers/export", methods=["GET"])
+def export_suppliers():
+    """
+    Streams all of the Suppliers as newline delimited JSON
+    Suppliers are read and written in batches so memory use stays bounded
+    """
+    app.logger.info("Request to export all suppliers")
+    export_format = request.args.get("format", "ndjson")
+    if export_format != "ndjson":
+        abort(status.HTTP_400_BAD_REQUEST, "Unsupported export format '{}'".format(export_format))
+    batch_size = app.config["EXPORT_BATCH_SIZE"]
+
+    def generate():
+        lines = []
+        for supplier in Supplier.stream(batch_size):
+            lines.append(flask_json.dumps(supplier.serialize(), separators=(",", ":")) + "\n")
+            if len(lines) == batch_size:
+                yield "".join(lines)
+                lines = []
+        if lines:
+            yield "".join(lines)
+
+    return Response(
+        stream_with_context(generate()),
+        status=status.HTTP_200_OK,
+        mimetype="application/x-ndjson",
+    )
+
+######################################################################
+# DELETE MANY SUPPLIERS
+######################################################################
+@app.route("/suppliers", methods=["DELETE"])
+def delete_all_suppliers():
+    """
+    Delete many Suppliers
+    This endpoint deletes every Supplier matching the name, email, address,
+    available and ids query parameters. Deleting all of the Suppliers needs
+    an explicit all=true instead of the filters
+    """
+    app.logger.info("Request to delete suppliers matching %s", request.args.to_dict())
+    filters = get_supplier_filters(("all",))
+    everything = parse_bool(request.args.get("all", "false"))
+    if filters and everything:
+        abort(status.HTTP_400_BAD_REQUEST, "all=true cannot be combined with filters")
+    if not filters and not everything:
+        abort(status.HTTP_400_BAD_REQUEST, "Give a filter, or all=true to delete every Supplier")
+    Supplier.delete_all(everything=everything, **filters)
+    return make_response("", status.HTTP_204_NO_CONTENT)
 
 ######################################################################
 # DELETE A SUPPLIER
@@ -188,16 +513,17 @@ def delete_suppliers(id):
 # READ A SUPPLIER
 ######################################################################
 @app.route("/suppliers/<int:supplier_id>", methods=["GET"])
+@conditional("supplier")
 def get_supplier(supplier_id):
     """
     Read a single Supplier
     This endpoint will return a Supplier based on it's id
     """
     app.logger.info("Request for supplier with id: %s", supplier_id)
-    supplier = Supplier.find(supplier_id)
+    supplier = Supplier.find_cached(supplier_id)
     if not supplier:
         raise NotFound("Supplier with id '{}' was not found.".format(supplier_id))
-    return make_response(jsonify(supplier.serialize()), status.HTTP_200_OK)
+    return make_response(jsonify(supplier), status.HTTP_200_OK)
 
 
 ######################################################################
@@ -232,6 +558,57 @@ def unavailable_supplier(supplier_id):
     supplier.save()
     return make_response(jsonify(supplier.serialize()), status.HTTP_200_OK)
 
+######################################################################
+# IMPORT SUPPLIERS IN THE BACKGROUND
+######################################################################
+@app.route("/imports", methods=["POST"])
+def create_import():
+    """
+    Queues a file of Suppliers to be created in the background
+    The file is uploaded as the "file" field of a form, or sent as the body,
+    as a JSON array or newline delimited JSON. The response is a 202 with the
+    job that reports the progress at its Location
+    """
+    app.logger.info("Request to import Suppliers")
+    upload = request.files.get("file")
+    if upload is not None:
+        content_type = IMPORT_EXTENSIONS.get(os.path.splitext(upload.filename or "")[1].lower(), upload.mimetype)
+        data = upload.read()
+    else:
+        content_type = request.mimetype
+        data = request.get_data()
+    if content_type not in IMPORT_FORMATS:
+        app.logger.error("Invalid Content-Type: %s", content_type)
+        abort(415, "Content-Type must be application/json or application/x-ndjson")
+    try:
+        payload = data.decode("utf-8")
+    except UnicodeDecodeError:
+        abort(status.HTTP_400_BAD_REQUEST, "The file must be UTF-8 encoded")
+    if not payload.strip():
+        abort(status.HTTP_400_BAD_REQUEST, "No Suppliers were posted")
+
+    job = ImportJob(content_type=content_type, payload=payload)
+    job.create()
+    message = job.serialize()
+    import_workers.start(app)
+    import_workers.notify()
+    location_url = url_for("get_import", import_id=job.id, _external=True)
+    return make_response(jsonify(message), status.HTTP_202_ACCEPTED, {"Location": location_url})
+
+######################################################################
+# RETRIEVE THE PROGRESS OF AN IMPORT
+######################################################################
+@app.route("/imports/<int:import_id>", methods=["GET"])
+def get_import(import_id):
+    """
+    Retrieves the progress, throughput and row errors of an import
+    """
+    app.logger.info("Request for import with id: %s", import_id)
+    job = ImportJob.find(import_id)
+    if not job:
+        raise NotFound("Import with id '{}' was not found.".format(import_id))
+    return make_response(jsonify(job.serialize()), status.HTTP_200_OK)
+
 ########################################################################################################################################## 
 # PRODUCT ROUTES
 ########################################################################################################################################### 
@@ -260,16 +637,17 @@ def create_products():
 # READ A PRODUCT
 ######################################################################
 @app.route("/products/<int:product_id>", methods=["GET"])
+@conditional("product")
 def get_product(product_id):
     """
     Read a single Product
     This endpoint will return a product based on it's id
     """
     app.logger.info("Request for product with id: %s", product_id)
-    product = Product.find(product_id)
+    product = Product.find_cached(product_id)
     if not product:
         raise NotFound("product with id '{}' was not found.".format(product_id))
-    return make_response(jsonify(product.serialize()), status.HTTP_200_OK)
+    return make_response(jsonify(product), status.HTTP_200_OK)
 
 ######################################################################
 # UPDATE A PRODUCT
@@ -309,18 +687,49 @@ def delete_products(id):
 # LIST ALL PRODUCTS
 ######################################################################
 @app.route("/products", methods=["GET"])
+@conditional("product")
+@cached_list("product")
 def list_products():
     """ Returns all of the products """
     app.logger.info("Request for product list")
-    products = []
+    headers = {}
     name = request.args.get("name")
-    if name:
-        products = Product.find_by_name(name)
+    ids = request.args.get("ids")
+    limit, after = get_page_args(1)
+    if ids:
+        ids = parse_ids(ids)
+        query = Product.find_many(ids)
+    elif name:
+        query = Product.find_by_name(name)
     else:
-        products = Product.all()
+        query = None
 
-    results = [product.serialize() for product in products]
-    return make_response(jsonify(results), status.HTTP_200_OK)
+    if limit is not None:
+        rows = Product.page(limit, after, Product.rows(query))
+        headers = next_page_headers(rows, limit, lambda row: [row.id])
+    else:
+        rows = Product.rows(query).all()
+        headers = missing_ids_headers(ids, [row.id for row in rows])
+
+    results = Product.serialize_rows(rows)
+    return make_response(jsonify(results), status.HTTP_200_OK, headers)
+
+######################################################################
+# LOOK UP MANY PRODUCTS
+######################################################################
+@app.route("/products/lookup", methods=["POST"])
+def lookup_products():
+    """
+    Looks up many Products by id
+    This endpoint returns the Products with the ids of the body, in the order
+    they were asked for, and the ids that were not found, with one IN query
+    """
+    app.logger.info("Request to look up Products")
+    ids = get_lookup_ids()
+    rows = {row.id: row for row in Product.rows(Product.find_many(ids))}
+    products = Product.serialize_rows([rows[by_id] for by_id in ids if by_id in rows])
+    missing = [by_id for by_id in ids if by_id not in rows]
+    return make_response(jsonify(products=products, missing=missing), status.HTTP_200_OK)
 
 ########################################################################################################################################## 
 # ASSOCIATION ROUTES
@@ -364,11 +773,11 @@ def get_association(supplier_id, product_id):
     """
     app.logger.info("Request for association with id: %s", supplier_id, product_id)
 
-    association = Association.find(supplier_id, product_id)
+    association = Association.find_cached(supplier_id, product_id)
 
     if not association:
         raise NotFound("association with supplier id '{}' and with product id '{}' was not found.".format(supplier_id, product_id))
-    return make_response(jsonify(association.serialize()), status.HTTP_200_OK)
+    return make_response(jsonify(association), status.HTTP_200_OK)
 
 
 ######################################################################
@@ -396,15 +805,37 @@ def update_association(supplier_id, product_id):
 # LIST ALL ASSOCIATIONS
 ######################################################################
 @app.route("/associations", methods=["GET"])
+@cached_list("association")
 def list_associations():
     """ Returns all of the associations """
     app.logger.info("Request for association list")
-    associations = []
-    
-    associations = Association.all()
+    headers = {}
+    limit, after = get_page_args(2)
+    if limit is not None:
+        rows = Association.page(limit, after, Association.rows())
+        headers = next_page_headers(rows, limit, lambda row: [row.supplier_id, row.product_id])
+    else:
+        rows = Association.rows().all()
 
-    results = [association.serialize() for association in associations]
-    return make_response(jsonify(results), status.HTTP_200_OK)
+    results = Association.serialize_rows(rows)
+    return make_response(jsonify(results), status.HTTP_200_OK, headers)
+
+######################################################################
+# LOOK UP MANY ASSOCIATIONS
+######################################################################
+@app.route("/associations/lookup", methods=["POST"])
+def lookup_associations():
+    """
+    Looks up many Associations by supplier and product id
+    This endpoint returns the Associations with the keys of the body, in the
+    order they were asked for, and the keys that were not found
+    """
+    app.logger.info("Request to look up Associations")
+    keys = get_lookup_keys()
+    rows = {(row.supplier_id, row.product_id): row for row in Association.find_many(keys)}
+    associations = Association.serialize_rows([rows[key] for key in keys if key in rows])
+    missing = [{"supplier_id": key[0], "product_id": key[1]} for key in keys if key not in rows]
+    return make_response(jsonify(associations=associations, missing=missing), status.HTTP_200_OK)
 
 ######################################################################
 # LIST ALL SUPPLIERS PRODUCTS
@@ -417,6 +848,29 @@ def list_supplier_products(supplier_id):
 
     return make_response(jsonify(result["products"]), status.HTTP_200_OK)
 
+######################################################################
+# REPLACE THE PRODUCTS OF A SUPPLIER
+######################################################################
+@app.route("/suppliers/<int:supplier_id>/products", methods=["PUT"])
+def replace_supplier_products(supplier_id):
+    """
+    Replaces the products of a Supplier
+    This endpoint takes the whole catalog of a supplier as a JSON array of
+    {product_id, wholesale_price}, upserts it and deletes the associations
+    that aren't in it, all in one transaction
+    """
+    app.logger.info("Request to replace the products of Supplier %s", supplier_id)
+    check_content_type("application/json")
+    prices = get_supplier_prices()
+    if not Supplier.find_many([supplier_id]).with_entities(Supplier.id).first():
+        raise NotFound("Supplier with id '{}' was not found.".format(supplier_id))
+    found = {row.id for row in Product.rows(Product.find_many(list(prices)))} if prices else set()
+    unknown = [product_id for product_id in prices if product_id not in found]
+    if unknown:
+        abort(status.HTTP_400_BAD_REQUEST, "Unknown product ids {}".format(",".join(map(str, unknown))))
+    counts = Association.replace_all(supplier_id, prices, app.config["BULK_BATCH_SIZE"])
+    return make_response(jsonify(counts), status.HTTP_200_OK)
+
 ######################################################################
 # DELETE AN ASSOCIATION
 ######################################################################
@@ -438,15 +892,261 @@ def delete_association(supplier_id, product_id):
 
     return make_response("", status.HTTP_204_NO_CONTENT)
 
+######################################################################
+# SERVICE STATISTICS
+######################################################################
+@app.route("/stats", methods=["GET"])
+def get_stats():
+    """ Returns the counters used to size and tune the service """
+    return make_response(jsonify(cache=cache.stats(), pool=pool_stats(db.engine)), status.HTTP_200_OK)
+
+######################################################################
+# PROMETHEUS METRICS
+######################################################################
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """ Returns the request, query and pool metrics of this process for Prometheus """
+    metrics.record_pool(pool_stats(db.engine))
+    return Response(metrics.registry.render(), status.HTTP_200_OK, content_type=metrics.CONTENT_TYPE)
+
+######################################################################
+# SQL PROFILE
+######################################################################
+@app.route("/debug/sql", methods=["GET"])
+def get_sql_profile():
+    """ Returns the slowest statements and the latest profiled requests, when debugging """
+    if not app.config["SQL_PROFILER_DEBUG"]:
+        raise NotFound("The SQL profile is not enabled.")
+    return make_response(jsonify(enabled=profiler.enabled, **profiler.report()), status.HTTP_200_OK)
+
 ######################################################################
 #  U T I L I T Y   F U N C T I O N S
 ######################################################################
 
+@app.before_first_request
+def init_search():
+    """ Chooses how this process searches once the database is reachable """
+    Supplier.init_search()
+
+@app.before_first_request
+def start_import_workers():
+    """ Starts the import workers of this process, which resume any waiting jobs """
+    import_workers.start(app)
+
 def init_db():
     """ Initialies the SQLAlchemy app """
     global app
     Supplier.init_db(app)
 
+def parse_bool(value):
+    """ Converts a true/false query parameter into a bool """
+    if value.lower() in ("true", "1", "yes"):
+        return True
+    if value.lower() in ("false", "0", "no"):
+        return False
+    abort(status.HTTP_400_BAD_REQUEST, "Invalid boolean '{}'".format(value))
+
+
+def parse_ids(value):
+    """ Converts a comma separated list of at most LOOKUP_MAX_IDS ids into a list of integers """
+    try:
+        ids = [int(by_id) for by_id in value.split(",") if by_id.strip()]
+    except ValueError:
+        abort(status.HTTP_400_BAD_REQUEST, "Invalid list of ids '{}'".format(value))
+    if len(ids) > app.config["LOOKUP_MAX_IDS"]:
+        abort(status.HTTP_400_BAD_REQUEST, "At most {} ids can be looked up".format(app.config["LOOKUP_MAX_IDS"]))
+    return ids
+
+
+SUPPLIER_FILTERS = ("name", "email", "address", "available", "ids")
+
+
+def get_supplier_filters(allowed=()):
+    """Returns the Supplier filters given as query parameters
+
+    A filter that is present is applied even when it is empty, so ?name=
+    only matches the Suppliers with an empty name
+
+    Args:
+        allowed (tuple): the other query parameters the endpoint accepts
+
+    Raises:
+        BadRequest: when a query parameter is neither a filter nor allowed
+    """
+    unknown = sorted(set(request.args) - set(SUPPLIER_FILTERS) - set(allowed))
+    if unknown:
+        abort(status.HTTP_400_BAD_REQUEST, "Unknown query parameters {}".format(", ".join(unknown)))
+    filters = {}
+    for field in ("name", "email", "address"):
+        if field in request.args:
+            filters[field] = request.args.get(field)
+    if "available" in request.args:
+        filters["available"] = parse_bool(request.args.get("available"))
+    if "ids" in request.args:
+        filters["ids"] = parse_ids(request.args.get("ids"))
+    return filters
+
+
+def is_id(value):
+    """ Returns True if a JSON value is an integer id """
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def get_lookup_ids():
+    """
+    Returns the ids of the JSON body {"ids": [...]} of a lookup in the order
+    they were given, without duplicates
+    """
+    check_content_type("application/json")
+    data = request.get_json()
+    ids = data.get("ids") if isinstance(data, dict) else None
+    if not isinstance(ids, list) or not ids or not all(is_id(by_id) for by_id in ids):
+        abort(status.HTTP_400_BAD_REQUEST, "Body must be an object with a list of integer ids")
+    ids = list(dict.fromkeys(ids))
+    if len(ids) > app.config["LOOKUP_MAX_IDS"]:
+        abort(status.HTTP_400_BAD_REQUEST, "At most {} ids can be looked up".format(app.config["LOOKUP_MAX_IDS"]))
+    return ids
+
+
+def get_lookup_keys():
+    """
+    Returns the (supplier_id, product_id) keys of the JSON body
+    {"keys": [{"supplier_id": 1, "product_id": 2}, ...]} of a lookup in the
+    order they were given, without duplicates
+    """
+    check_content_type("application/json")
+    data = request.get_json()
+    keys = data.get("keys") if isinstance(data, dict) else None
+    if not isinstance(keys, list) or not keys or not all(
+        isinstance(key, dict) and is_id(key.get("supplier_id")) and is_id(key.get("product_id")) for key in keys
+    ):
+        abort(
+            status.HTTP_400_BAD_REQUEST,
+            "Body must be an object with a list of keys with integer supplier_id and product_id",
+        )
+    keys = list(dict.fromkeys((key["supplier_id"], key["product_id"]) for key in keys))
+    if len(keys) > app.config["LOOKUP_MAX_IDS"]:
+        abort(status.HTTP_400_BAD_REQUEST, "At most {} keys can be looked up".format(app.config["LOOKUP_MAX_IDS"]))
+    return keys
+
+
+def get_supplier_prices():
+    """
+    Returns the wholesale price of every product id of a JSON array of
+    {"product_id": 1, "wholesale_price": 100}, in the order they were given
+    """
+    rows = request.get_json()
+    if not isinstance(rows, list):
+        abort(status.HTTP_400_BAD_REQUEST, "Body must be a JSON array of products")
+    prices = {}
+    for index, row in enumerate(rows):
+        if not isinstance(row, dict) or not is_id(row.get("product_id")) or not is_id(row.get("wholesale_price")):
+            abort(
+                status.HTTP_400_BAD_REQUEST,
+                "Product {} must have an integer product_id and wholesale_price".format(index),
+            )
+        if row["product_id"] in prices:
+            abort(status.HTTP_400_BAD_REQUEST, "Product id {} is listed twice".format(row["product_id"]))
+        prices[row["product_id"]] = row["wholesale_price"]
+    return prices
+
+
+def missing_ids_headers(ids, found):
+    """ Returns the X-Missing-Ids header of the ids of a list that matched nothing """
+    if not ids:
+        return {}
+    found = set(found)
+    missing = [by_id for by_id in dict.fromkeys(ids) if by_id not in found]
+    return {"X-Missing-Ids": ",".join(str(by_id) for by_id in missing)} if missing else {}
+
+
+def get_fields(allowed):
+    """
+    Returns the fields of a sparse fieldset like fields=id,name in the order
+    they were asked for, or None to return every field
+    """
+    value = request.args.get("fields")
+    if value is None:
+        return None
+    fields = [field.strip() for field in value.split(",") if field.strip()]
+    if not fields:
+        abort(status.HTTP_400_BAD_REQUEST, "fields cannot be empty")
+    for field in fields:
+        if field not in allowed:
+            abort(status.HTTP_400_BAD_REQUEST, "Unknown field '{}'".format(field))
+    return fields
+
+
+def encode_cursor(key):
+    """ Encodes the primary key of the last row of a page as an opaque cursor """
+    return base64.urlsafe_b64encode(json.dumps(key).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor, key_length):
+    """ Decodes a cursor back into the primary key it was made from """
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, binascii.Error):
+        abort(status.HTTP_400_BAD_REQUEST, "Invalid cursor '{}'".format(cursor))
+    if (
+        not isinstance(key, list)
+        or len(key) != key_length
+        or not all(is_id(value) for value in key)
+    ):
+        abort(status.HTTP_400_BAD_REQUEST, "Invalid cursor '{}'".format(cursor))
+    return key
+
+
+def get_page_args(key_length):
+    """
+    Returns the limit and decoded cursor of a paginated request
+    Both are None when the client asked for the whole list
+    """
+    limit = request.args.get("limit")
+    cursor = request.args.get("cursor")
+    if limit is None and cursor is None:
+        return None, None
+    if limit is None:
+        limit = app.config["PAGE_SIZE_DEFAULT"]
+    # only ASCII digits: str.isdigit() and int() also take others, like ² or ٥
+    elif not re.fullmatch("[0-9]+", limit) or not 0 < int(limit) <= app.config["PAGE_SIZE_MAX"]:
+        abort(
+            status.HTTP_400_BAD_REQUEST,
+            "limit must be between 1 and {}".format(app.config["PAGE_SIZE_MAX"]),
+        )
+    after = decode_cursor(cursor, key_length) if cursor else None
+    return int(limit), after
+
+
+def next_page_headers(rows, limit, get_key):
+    """ Returns the Link header pointing at the page that follows rows """
+    if len(rows) < limit:
+        return {}
+    args = request.args.to_dict()
+    args["limit"] = limit
+    args["cursor"] = encode_cursor(get_key(rows[-1]))
+    next_url = url_for(request.endpoint, _external=True, **args)
+    return {"Link": '<{}>; rel="next"'.format(next_url)}
+
+
+def get_bulk_rows():
+    """
+    Returns the rows of a bulk request body
+    The body is either a JSON array or newline delimited JSON, and a line
+    that is not valid JSON is returned as None so it is reported as bad data
+    """
+    content_type = request.headers.get("Content-Type")
+    if content_type == "application/json":
+        rows = request.get_json()
+        if not isinstance(rows, list):
+            abort(status.HTTP_400_BAD_REQUEST, "Body must be a JSON array of Suppliers")
+        return rows
+    if content_type == "application/x-ndjson":
+        return parse_rows(content_type, request.get_data(as_text=True))
+    app.logger.error("Invalid Content-Type: %s", content_type)
+    abort(415, "Content-Type must be application/json or application/x-ndjson")
+
+
 def check_content_type(content_type):
     """ Checks that the media type is correct """
     if request.headers["Content-Type"] == content_type:
@@ -0,0 +1,63 @@
+"""
+Read replica routing
+
+Sessions send their reads to a read replica while one is chosen for them,
+and everything else (writes, flushes and reads of sessions without a
+replica) to the primary database
+"""
+import random
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import create_engine, orm
+from service.pool import engine_options
+
+
+class RoutingSession(SignallingSession):
+    """ A session that reads from the replica stored in its info, if any """
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = self.info.get("replica")
+        if replica is None or self._flushing or getattr(clause, "is_dml", False):
+            return super().get_bind(mapper, clause)
+        return replica
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """ Flask-SQLAlchemy with read replicas that sessions can be routed to """
+
+    def __init__(self, *args, **kwargs):
+        self.replicas = []
+        super().__init__(*args, **kwargs)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def init_replicas(self, config):
+        """Creates an engine for every replica in DATABASE_REPLICA_URIS
+
+        Args:
+            config (dict): the application configuration with the comma
+                separated DATABASE_REPLICA_URIS and the pool settings
+        """
+        for replica in self.replicas:
+            replica.dispose()
+        uris = [uri.strip() for uri in config.get("DATABASE_REPLICA_URIS", "").split(",")]
+        self.replicas = [
+            create_engine(uri, **engine_options(dict(config, SQLALCHEMY_DATABASE_URI=uri)))
+            for uri in uris if uri
+        ]
+
+    def route_reads(self):
+        """ Sends the reads of the current session to a random replica """
+        if self.replicas:
+            self.session().info["replica"] = random.choice(self.replicas)
+
+    def route_to_primary(self):
+        """ Sends every statement of the current session to the primary """
+        session = self.session()
+        if session.info.pop("replica", None) is not None:
+            # releases the replica connection and expires what was read from it
+            session.rollback()
+
+    def reading_replica(self):
+        """ Returns True while the current session reads from a replica """
+        return bool(self.replicas) and "replica" in self.session().info
@@ -0,0 +1,119 @@
+"""
+Trigram search index
+
+A pure Python stand-in for PostgreSQL's pg_trgm used to search Suppliers by
+name and address on databases without trigram indexes (e.g. SQLite in tests)
+"""
+import re
+import threading
+from collections import defaultdict
+
+
+def word_trigrams(text):
+    """Returns the trigrams of every word in text the way pg_trgm does
+
+    Each lower cased word is padded with two spaces in front and one behind
+    so that prefixes weigh more than the rest of the word
+    """
+    grams = set()
+    for word in re.findall(r"[^\W_]+", text.lower()):
+        padded = "  " + word + " "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def similarity(grams, other):
+    """ Returns the share of trigrams two sets have in common, like pg_trgm """
+    if not grams or not other:
+        return 0.0
+    return len(grams & other) / len(grams | other)
+
+
+def substring_trigrams(text):
+    """ Returns every three character slice of text, used to find substrings """
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class TrigramIndex:
+    """
+    In memory trigram index over (id, name, address) rows
+
+    Substring candidates come from intersecting the posting lists of the
+    trigrams of the search text, and matches are ranked name prefixes first,
+    then by pg_trgm style similarity, then by id
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._postings = defaultdict(set)
+        # the number of invalidations, and the (version, changes) it was built at
+        self._changes = 0
+        self._built = None
+
+    @property
+    def stale(self):
+        """ True if the index was never built or was invalidated since """
+        return self._built is None or self._built[1] != self._changes
+
+    def is_current(self, version):
+        """ Returns True if the index was built from version and not invalidated since """
+        return not self.stale and self._built[0] == version
+
+    def invalidate(self):
+        """ Marks the index as out of date so it is rebuilt before the next search """
+        with self._lock:
+            self._changes += 1
+
+    def rebuild(self, rows, version=None):
+        """Replaces the contents of the index
+
+        The index stays stale if it is invalidated while the rows are read,
+        since they may miss the write
+
+        Args:
+            rows (iterable): (id, name, address) tuples to index
+            version: the version of the rows, read before them
+        """
+        built = (version, self._changes)
+        entries = {}
+        postings = defaultdict(set)
+        for by_id, name, address in rows:
+            name = (name or "").lower()
+            address = (address or "").lower()
+            entries[by_id] = (name, address, word_trigrams(name), word_trigrams(address))
+            for gram in substring_trigrams(name) | substring_trigrams(address):
+                postings[gram].add(by_id)
+        with self._lock:
+            self._entries = entries
+            self._postings = postings
+            self._built = built
+
+    def search(self, text, limit, offset=0):
+        """Returns the ids of the best matches of text in name or address
+
+        Args:
+            text (string): the text to look for
+            limit (int): the maximum number of ids to return
+            offset (int): the number of ranked matches to skip
+        """
+        text = text.lower()
+        with self._lock:
+            entries = self._entries
+            postings = self._postings
+        grams = substring_trigrams(text)
+        if grams:
+            lists = sorted((postings.get(gram, set()) for gram in grams), key=len)
+            candidates = set.intersection(*lists)
+        else:
+            candidates = entries.keys()
+        text_grams = word_trigrams(text)
+        ranked = []
+        for by_id in candidates:
+            name, address, name_grams, address_grams = entries[by_id]
+            if text not in name and text not in address:
+                continue
+            score = max(similarity(text_grams, name_grams), similarity(text_grams, address_grams))
+            ranked.append((not name.startswith(text), -score, by_id))
+        ranked.sort()
+        return [by_id for _, _, by_id in ranked[offset:offset + limit]]
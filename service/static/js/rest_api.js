@@ -205,28 +205,22 @@ $(function () {
         var name = $("#supplier_name").val();
         var email = $("#supplier_email").val();
         var address = $("#supplier_address").val();
-        var phone_number = $("#supplier_phone_number").val();
         var available = $('input[name="supplier_available"]:checked').val() == "true";
 
-        var queryString = ""
+        // phone_number isn't a filter of the service, which rejects unknown parameters
+        var params = []
 
         if (name) {
-            queryString += 'name=' + name
+            params.push('name=' + encodeURIComponent(name))
         }
         if (email) {
-            queryString += 'email=' + email
+            params.push('email=' + encodeURIComponent(email))
         }
         if (address) {
-            queryString += 'address=' + address
-        }
-        if (phone_number) {
-            queryString += 'phone_number=' + phone_number
-        }
-        if (queryString.length > 0) {
-            queryString += '&available=' + available
-        } else {
-            queryString += 'available=' + available
+            params.push('address=' + encodeURIComponent(address))
         }
+        params.push('available=' + available)
+        var queryString = params.join('&')
 
         var ajax = $.ajax({
             type: "GET",
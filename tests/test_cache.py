@@ -0,0 +1,181 @@
+"""
+Test cases for the read-through cache
+
+"""
+import time
+import unittest
+from service.cache import LRUCache, RedisCache, Cache, create_backend
+from service.fakeredis import FakeRedis, FakeRedisServer
+
+
+class FakeClock:
+    """ A clock that only moves when told to """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+######################################################################
+#  L R U   C A C H E   T E S T   C A S E S
+######################################################################
+class TestLRUCache(unittest.TestCase):
+    """ Test Cases for LRUCache """
+
+    def setUp(self):
+        """ This runs before each test """
+        self.clock = FakeClock()
+        self.cache = LRUCache(maxsize=2, ttl=10, clock=self.clock)
+
+    def test_get_and_set(self):
+        """ Cache a value and count hits and misses """
+        self.assertIsNone(self.cache.get("a"))
+        self.cache.set("a", {"id": 1})
+        self.assertEqual(self.cache.get("a"), {"id": 1})
+        stats = self.cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["size"], 1)
+
+    def test_evict_least_recently_used(self):
+        """ Evict the least recently used entry when full """
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.cache.get("a")
+        self.cache.set("c", 3)
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertEqual(self.cache.get("c"), 3)
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+    def test_expire(self):
+        """ Entries expire after the time to live """
+        self.cache.set("a", 1)
+        self.clock.now = 9.9
+        self.assertEqual(self.cache.get("a"), 1)
+        self.clock.now = 10
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.stats()["expirations"], 1)
+        self.assertEqual(self.cache.stats()["size"], 0)
+
+    def test_delete_and_clear(self):
+        """ Remove some or all of the entries """
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.cache.delete("a", "missing")
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.get("b"), 2)
+        self.cache.clear()
+        self.assertIsNone(self.cache.get("b"))
+
+    def test_disabled(self):
+        """ A cache of size 0 never stores anything """
+        self.cache.configure(0, 10)
+        self.cache.set("a", 1)
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.stats()["maxsize"], 0)
+
+    def test_generations(self):
+        """ Bump the generations of tables, which survive clearing the cache """
+        self.assertEqual(self.cache.generation("supplier"), 0)
+        self.cache.bump("supplier", "product")
+        self.cache.bump("supplier")
+        self.assertEqual(self.cache.generation("supplier"), 2)
+        self.assertEqual(self.cache.generation("product"), 1)
+        self.cache.clear()
+        self.assertEqual(self.cache.generation("supplier"), 2)
+
+    def test_set_if_current(self):
+        """ A value loaded while its table was written isn't cached """
+        cache = Cache(self.cache)
+        generation = cache.generation("supplier")
+        cache.set_if_current("a", 1, "supplier", generation)
+        self.assertEqual(cache.get("a"), 1)
+        generation = cache.generation("supplier")
+        # a writer commits, bumps and deletes between the query and the set
+        cache.bump("supplier")
+        cache.delete("b")
+        cache.set_if_current("b", 1, "supplier", generation)
+        self.assertIsNone(cache.get("b"))
+        cache.set_if_current("c", 1, "supplier", None)
+        self.assertIsNone(cache.get("c"))
+
+
+######################################################################
+#  R E D I S   C A C H E   T E S T   C A S E S
+######################################################################
+class TestRedisCache(unittest.TestCase):
+    """ Test Cases for RedisCache on the embedded Redis stand-in """
+
+    def setUp(self):
+        """ Two workers sharing one server, each with a local tier """
+        server = FakeRedisServer()
+        self.worker1 = RedisCache(FakeRedis(server), ttl=60, local=LRUCache(10, 60))
+        self.worker2 = RedisCache(FakeRedis(server), ttl=60, local=LRUCache(10, 60))
+
+    def tearDown(self):
+        for worker in (self.worker1, self.worker2):
+            if worker._listener is not None:
+                worker._listener.stop()
+
+    def wait_for(self, condition):
+        """ Waits for the invalidation listener to catch up """
+        deadline = time.monotonic() + 2
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(condition())
+
+    def test_shared_between_workers(self):
+        """ A value cached by one worker is read by the others """
+        self.assertIsNone(self.worker2.get("a"))
+        self.worker1.set("a", {"id": 1})
+        self.assertEqual(self.worker2.get("a"), {"id": 1})
+        self.assertEqual(self.worker2.local.get("a"), {"id": 1})
+        self.assertEqual(self.worker2.stats()["hits"], 1)
+        self.assertEqual(self.worker2.stats()["misses"], 1)
+
+    def test_publish_invalidations(self):
+        """ Deleting a key removes it from the local tier of every worker """
+        self.worker1.set("a", 1)
+        self.worker1.set("b", 2)
+        self.assertEqual(self.worker2.get("a"), 1)
+        self.assertEqual(self.worker2.get("b"), 2)
+        self.worker1.delete("a")
+        self.wait_for(lambda: self.worker2.local.get("a") is None)
+        self.assertIsNone(self.worker2.get("a"))
+        self.worker1.clear()
+        self.wait_for(lambda: self.worker2.local.get("b") is None)
+        self.assertIsNone(self.worker2.get("b"))
+
+    def test_generations(self):
+        """ Generations are shared between workers and survive clearing the cache """
+        self.assertEqual(self.worker2.generation("supplier"), 0)
+        self.worker1.bump("supplier")
+        self.assertEqual(self.worker2.generation("supplier"), 1)
+        self.worker1.set("a", 1)
+        self.worker1.clear()
+        self.assertIsNone(self.worker2.get("a"))
+        self.assertEqual(self.worker2.generation("supplier"), 1)
+
+    def test_unavailable(self):
+        """ Redis errors are counted and handled as misses """
+        class DownRedis(FakeRedis):
+            def get(self, name):
+                raise ConnectionRefusedError("down")
+
+        cache = RedisCache(DownRedis())
+        self.assertIsNone(cache.get("a"))
+        self.assertIsNone(cache.generation("supplier"))
+        self.assertEqual(cache.stats()["errors"], 2)
+
+    def test_create_backend(self):
+        """ Choose the backend from the configuration """
+        config = dict(CACHE_MAX_SIZE=10, CACHE_TTL=60, CACHE_LOCAL_SIZE=0, CACHE_LOCAL_TTL=5)
+        cache = Cache(create_backend(dict(config, CACHE_BACKEND="memory")))
+        self.assertEqual(cache.stats()["backend"], "LRUCache")
+        cache.configure(create_backend(dict(config, CACHE_BACKEND="fakeredis")))
+        self.assertEqual(cache.stats()["backend"], "RedisCache")
+        self.assertIsNone(cache.backend.local)
+        self.assertRaises(ValueError, create_backend, dict(config, CACHE_BACKEND="other"))
@@ -0,0 +1,97 @@
+"""
+Test cases for the gunicorn configuration
+
+"""
+import os
+import json
+import runpy
+import unittest
+from unittest.mock import patch
+
+# importing the configuration exports WEB_CONCURRENCY, keep it out of the tests
+with patch.dict(os.environ):
+    import gunicorn_config
+
+
+######################################################################
+#  G U N I C O R N   C O N F I G   T E S T   C A S E S
+######################################################################
+class TestGunicornConfig(unittest.TestCase):
+    """ Test Cases for sizing the workers and threads """
+
+    def test_parse_size(self):
+        """ Parse Cloud Foundry and cgroup memory sizes """
+        self.assertEqual(gunicorn_config.parse_size_mb("128M"), 128)
+        self.assertEqual(gunicorn_config.parse_size_mb("1g"), 1024)
+        self.assertEqual(gunicorn_config.parse_size_mb("512MB"), 512)
+        self.assertEqual(gunicorn_config.parse_size_mb("268435456"), 256)
+
+    def test_worker_count(self):
+        """ Two workers per CPU plus one, as many as fit in memory """
+        self.assertEqual(gunicorn_config.worker_count(2, 4096), 5)
+        self.assertEqual(gunicorn_config.worker_count(4, 512), 7)
+        self.assertEqual(gunicorn_config.worker_count(4, 256), 3)
+        self.assertEqual(gunicorn_config.worker_count(4, 128), 1)
+        self.assertEqual(gunicorn_config.worker_count(1, 64), 1)
+
+    def test_memory_limit(self):
+        """ The Cloud Foundry memory limit wins over the machine """
+        with patch.dict(os.environ, {"MEMORY_LIMIT": "256M"}):
+            self.assertEqual(gunicorn_config.memory_limit_mb(), 256)
+        with patch.dict(os.environ, {"MEMORY_LIMIT": ""}):
+            self.assertGreater(gunicorn_config.memory_limit_mb(), 0)
+
+    def test_cpu_count(self):
+        """ A cgroup CPU quota limits the CPUs """
+        with patch.object(gunicorn_config, "read_cgroup", return_value="150000 100000"):
+            self.assertEqual(gunicorn_config.cpu_count(), 1)
+        self.assertGreaterEqual(gunicorn_config.cpu_count(), 1)
+
+    def test_thread_count(self):
+        """ A worker never runs more threads than its pool has connections """
+        with patch.dict(os.environ, {"GUNICORN_THREADS": "1000"}):
+            threads = gunicorn_config.thread_count()
+        from config import DB_POOL_SIZE, DB_MAX_OVERFLOW
+        self.assertEqual(threads, DB_POOL_SIZE + DB_MAX_OVERFLOW)
+        with patch.dict(os.environ, {"GUNICORN_THREADS": "0"}):
+            self.assertEqual(gunicorn_config.thread_count(), 1)
+
+    def test_preload(self):
+        """ The app is loaded once in the master """
+        self.assertTrue(gunicorn_config.preload_app)
+        self.assertEqual(gunicorn_config.worker_class == "gthread", gunicorn_config.threads > 1)
+
+    def test_exports_workers(self):
+        """ The number of workers is exported for config.py """
+        with patch.dict(os.environ, {"WEB_CONCURRENCY": "3", "METRICS_DIR": ""}):
+            settings = runpy.run_path(gunicorn_config.__file__)
+            self.assertEqual(settings["workers"], 3)
+            self.assertEqual(os.environ["WEB_CONCURRENCY"], "3")
+            # several workers add up their metrics in a fresh directory
+            directory = os.environ["METRICS_DIR"]
+            with open(os.path.join(directory, "1.json"), "w") as snapshot:
+                snapshot.write("{}")
+            settings["on_starting"](None)
+            self.assertEqual(os.listdir(directory), [])
+            settings["on_exit"](None)
+            self.assertFalse(os.path.exists(directory))
+        with patch.dict(os.environ, {"WEB_CONCURRENCY": "3", "METRICS_DIR": "/tmp/given"}):
+            settings = runpy.run_path(gunicorn_config.__file__)
+            self.assertIsNone(settings["metrics_tempdir"])
+        with patch.dict(os.environ):
+            os.environ.pop("WEB_CONCURRENCY", None)
+            settings = runpy.run_path(gunicorn_config.__file__)
+            self.assertEqual(os.environ["WEB_CONCURRENCY"], str(settings["workers"]))
+
+    def test_config_shared_by_workers(self):
+        """ Several workers share max_conns and don't cache per process """
+        vcap = json.dumps({"user-provided": [{"credentials": {"url": "sqlite://", "max_conns": 20}}]})
+        config_file = os.path.join(os.path.dirname(gunicorn_config.__file__), "config.py")
+        with patch.dict(os.environ, {"VCAP_SERVICES": vcap, "WEB_CONCURRENCY": "4", "CACHE_BACKEND": "memory"}):
+            settings = runpy.run_path(config_file)
+        self.assertEqual(settings["DB_POOL_SIZE"] + settings["DB_MAX_OVERFLOW"], 5)
+        self.assertEqual(settings["CACHE_MAX_SIZE"], 0)
+        with patch.dict(os.environ, {"VCAP_SERVICES": vcap, "WEB_CONCURRENCY": "1", "CACHE_BACKEND": "memory"}):
+            settings = runpy.run_path(config_file)
+        self.assertEqual(settings["DB_POOL_SIZE"] + settings["DB_MAX_OVERFLOW"], 15)
+        self.assertGreater(settings["CACHE_MAX_SIZE"], 0)
@@ -0,0 +1,69 @@
+"""
+Test cases for the JSON provider
+
+"""
+import json
+import unittest
+from datetime import date
+from flask import Flask, jsonify
+from service.json_provider import create_encoder, available_providers, init_app
+
+
+######################################################################
+#  J S O N   P R O V I D E R   T E S T   C A S E S
+######################################################################
+class TestJSONProvider(unittest.TestCase):
+    """ Test Cases for encoding the responses with each provider """
+
+    DATA = [{"id": 1, "name": "Acmé / Tools", "available": True, "products": [], "since": date(2021, 1, 2)}]
+
+    def test_providers_agree(self):
+        """ Every installed provider returns the same JSON as the standard library """
+        self.assertEqual(available_providers()[-1], "json")
+        expected = None
+        for name in available_providers():
+            app = Flask(__name__)
+            app.config["JSON_PROVIDER"] = name
+            init_app(app)
+            self.assertEqual(app.json_encoder.provider, name)
+            with app.app_context():
+                data = jsonify(self.DATA).get_json()
+            if expected is None:
+                expected = data
+            self.assertEqual(data, expected)
+        self.assertEqual(expected[0]["since"], "Sat, 02 Jan 2021 00:00:00 GMT")
+
+    def test_json_as_ascii(self):
+        """ Every provider writes the same bytes as the standard library, ASCII or not """
+        data = [{"name": "Acmé / Tools \u20ac\U0001f600\u2028", "ids": [1, 2]}]
+        for as_ascii in (True, False):
+            bodies = set()
+            for name in available_providers():
+                app = Flask(__name__)
+                app.config["JSON_PROVIDER"] = name
+                app.config["JSON_AS_ASCII"] = as_ascii
+                init_app(app)
+                with app.app_context():
+                    bodies.add(jsonify(data).get_data())
+            self.assertEqual(len(bodies), 1, bodies)
+            self.assertEqual(bodies.pop().isascii(), as_ascii)
+
+    def test_auto(self):
+        """ auto picks the fastest installed provider """
+        self.assertEqual(create_encoder("auto").provider, available_providers()[0])
+
+    def test_sort_keys(self):
+        """ Keys are sorted like the standard library encoder """
+        encoder = create_encoder("auto")(sort_keys=True)
+        self.assertEqual(encoder.encode({"b": 1, "a": 2}), '{"a":2,"b":1}')
+
+    def test_fallback(self):
+        """ Values a provider cannot encode go through the standard library """
+        encoder = create_encoder("auto")(sort_keys=True)
+        self.assertEqual(json.loads(encoder.encode([2 ** 70])), [2 ** 70])
+        with self.assertRaises(TypeError):
+            encoder.encode([object()])
+
+    def test_unknown_provider(self):
+        """ An unknown provider is an error """
+        self.assertRaises(ValueError, create_encoder, "simplejson")
@@ -3,10 +3,15 @@ Test cases for Supplier Model
 
 """
 import logging
+import threading
 import unittest
+from unittest.mock import patch
+from sqlalchemy import event
 from werkzeug.exceptions import NotFound
 import os
-from service.models import Supplier, Product, Association, DataValidationError, db
+from service.models import Supplier, Product, Association, TableVersion, DataValidationError, db
+from service.models import create_missing_indexes, cache
+from service.search import TrigramIndex
 from service import app
 
 DATABASE_URI = os.getenv(
@@ -193,6 +198,21 @@ class TestSupplier(unittest.TestCase):
         supplier = Supplier()
         self.assertRaises(DataValidationError, supplier.deserialize, data)
 
+    def test_deserialize_bad_types(self):
+        """ Reject values of the wrong type or too long for their column """
+        data = {
+            "name": "Jim Jones",
+            "address": "123 Main Street, Anytown USA",
+            "email": "jjones@gmail.com",
+            "available": True,
+            "products": []
+        }
+        Supplier().deserialize(data)
+        for field, value in (("available", "yes"), ("name", 5), ("email", None), ("name", "x" * 64),
+                             ("phone_number", 800)):
+            bad = dict(data, **{field: value})
+            self.assertRaises(DataValidationError, Supplier().deserialize, bad)
+
     def test_deserialize_bad_data(self):
         """ Test deserialization of bad data """
         data = "this is not a dictionary"
@@ -213,6 +233,57 @@ class TestSupplier(unittest.TestCase):
         self.assertEqual(supplier.id, suppliers[1].id)
         self.assertEqual(supplier.name, suppliers[1].name)
 
+    def test_find_cached_during_write(self):
+        """ A Supplier read while it is written isn't cached """
+        supplier = self._create_supplier()
+        supplier.create()
+        find = Supplier.find
+
+        def write_meanwhile(by_id):
+            found = find(by_id)
+            # the invalidation of a writer that commits after the query
+            cache.bump(Supplier.__tablename__)
+            cache.delete(Supplier.cache_key(by_id))
+            return found
+
+        with patch.object(Supplier, "find", side_effect=write_meanwhile):
+            self.assertEqual(Supplier.find_cached(supplier.id)["name"], "Jim Jones")
+        self.assertIsNone(cache.get(Supplier.cache_key(supplier.id)))
+        Supplier.find_cached(supplier.id)
+        self.assertEqual(cache.get(Supplier.cache_key(supplier.id))["name"], "Jim Jones")
+
+    def test_search_index_after_commit(self):
+        """ The in memory search index follows commits and the writes of other workers """
+        search_index, Supplier.search_index = Supplier.search_index, TrigramIndex()
+        try:
+            self._create_supplier().create()
+            # another request searches between the flush and the commit
+            db.session.add(Supplier(name="Jim Flushed", email="a@b.com", address="1 Rd", available=True))
+            db.session.flush()
+            found = []
+
+            def search():
+                with app.app_context():
+                    found.extend(Supplier.search("jim", 10))
+                    db.session.remove()
+
+            thread = threading.Thread(target=search)
+            thread.start()
+            thread.join()
+            self.assertEqual(len(found), 1)
+            db.session.commit()
+            self.assertEqual(len(Supplier.search("jim", 10)), 2)
+            # another worker inserts a Supplier and bumps the shared version
+            db.session.execute(Supplier.__table__.insert(), dict(
+                self._create_supplier().column_values(), name="Jim Elsewhere"
+            ))
+            TableVersion.bump(Supplier.__tablename__)
+            db.session.commit()
+            cache.delete(TableVersion.cache_key(Supplier.__tablename__))
+            self.assertEqual(len(Supplier.search("jim", 10)), 3)
+        finally:
+            Supplier.search_index = search_index
+
     def test_find_by_name(self):
         """ Find a supplier by Name """
         Supplier(
@@ -330,6 +401,54 @@ class TestSupplier(unittest.TestCase):
         self.assertEqual(suppliers[0].available, False)
         self.assertEqual(suppliers[0].phone_number, None)
 
+    def test_find_by_filters(self):
+        """ Find Suppliers matching several filters at once """
+        Supplier(name="Supplier 1", email="one@email.com", address="Address 1", available=True).create()
+        Supplier(name="Supplier 1", email="one@email.com", address="Address 2", available=False).create()
+        Supplier(name="Supplier 2", email="two@email.com", address="Address 1", available=True).create()
+
+        suppliers = Supplier.find_by_filters(name="Supplier 1").all()
+        self.assertEqual(len(suppliers), 2)
+        suppliers = Supplier.find_by_filters(name="Supplier 1", available=True).all()
+        self.assertEqual([supplier.id for supplier in suppliers], [1])
+        suppliers = Supplier.find_by_filters(email="one@email.com", address="Address 2").all()
+        self.assertEqual([supplier.id for supplier in suppliers], [2])
+        suppliers = Supplier.find_by_filters(address="Address 1", ids=[2, 3]).all()
+        self.assertEqual([supplier.id for supplier in suppliers], [3])
+        self.assertEqual(len(Supplier.find_by_filters().all()), 3)
+
+    def _explain(self, query):
+        """ Returns the query plan of a query, preferring indexes over scans """
+        sql = str(query.statement.compile(db.engine, compile_kwargs={"literal_binds": True}))
+        if db.engine.dialect.name == "postgresql":
+            # the tables are tiny so make the planner show that it can use an index
+            db.session.execute("SET LOCAL enable_seqscan = off")
+            plan = [row[0] for row in db.session.execute("EXPLAIN " + sql)]
+        else:
+            plan = [row[-1] for row in db.session.execute("EXPLAIN QUERY PLAN " + sql)]
+        db.session.rollback()
+        return "\n".join(plan)
+
+    def test_filters_use_indexes(self):
+        """ Filtered Supplier queries are answered with index scans """
+        for supplier in self._create_suppliers(5):
+            supplier.create()
+        plan = self._explain(Supplier.find_by_filters(name="Jim Jones", email="jjones@gmail.com"))
+        self.assertRegex(plan, r"(?i)index")
+        self.assertRegex(plan, r"ix_supplier_(name|email)")
+        plan = self._explain(Supplier.find_by_filters(email="jjones@gmail.com"))
+        self.assertIn("ix_supplier_email", plan)
+        plan = self._explain(Supplier.find_by_filters(available=True).order_by(Supplier.id))
+        self.assertRegex(plan, r"ix_supplier_available")
+
+    def test_create_missing_indexes(self):
+        """ Create the indexes missing from an existing table """
+        db.session.execute("DROP INDEX ix_supplier_name")
+        db.session.commit()
+        create_missing_indexes()
+        plan = self._explain(Supplier.find_by_filters(name="Jim Jones"))
+        self.assertIn("ix_supplier_name", plan)
+
     def test_sort_by(self):
         """ Find a supplier by available """
         Supplier(
@@ -356,6 +475,35 @@ class TestSupplier(unittest.TestCase):
         self.assertEqual(suppliers[1].email, "bsupplier2@email.com")
 
 
+    def test_page_suppliers(self):
+        """ Page through Suppliers by id """
+        suppliers = self._create_suppliers(5)
+        for supplier in suppliers:
+            supplier.create()
+        page = Supplier.page(2)
+        self.assertEqual([supplier.id for supplier in page], [1, 2])
+        page = Supplier.page(2, after=[page[-1].id])
+        self.assertEqual([supplier.id for supplier in page], [3, 4])
+        page = Supplier.page(2, after=[page[-1].id])
+        self.assertEqual([supplier.id for supplier in page], [5])
+        page = Supplier.page(2, after=[5], query=Supplier.find_by_name("Jim Jones"))
+        self.assertEqual(page, [])
+
+    def test_serialize_rows(self):
+        """ Serialize Suppliers from row tuples like serialize() """
+        self._create_association()
+        self._create_supplier().create()
+        suppliers = Supplier.query.order_by(Supplier.id).all()
+        rows = Supplier.rows().order_by(Supplier.id).all()
+        self.assertEqual(Supplier.serialize_rows(rows, batch_size=1), [s.serialize() for s in suppliers])
+        self.assertEqual(len(Supplier.serialize_rows(rows)[0]["products"]), 1)
+        rows = Supplier.rows(fields=["name"]).order_by(Supplier.id).all()
+        self.assertEqual(Supplier.serialize_rows(rows, ["name"]), [{"name": s.name} for s in suppliers])
+        rows = Product.rows().all()
+        self.assertEqual(Product.serialize_rows(rows), [p.serialize() for p in Product.all()])
+        rows = Association.rows().all()
+        self.assertEqual(Association.serialize_rows(rows), [a.serialize() for a in Association.all()])
+
     def test_find_or_404_found(self):
         """ Find or return 404 found """
         suppliers = self._create_suppliers(3)
@@ -568,6 +716,83 @@ class TestSupplier(unittest.TestCase):
         association = Association()
         self.assertRaises(DataValidationError, association.deserialize, data)
 
+    def test_serialize_suppliers_query_count(self):
+        """ Serialize many Suppliers without a query per Supplier """
+        for _ in range(10):
+            self._create_association()
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        db.session.expire_all()
+        event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            results = [supplier.serialize() for supplier in Supplier.all()]
+        finally:
+            event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+        self.assertEqual(len(results), 10)
+        self.assertEqual(len(statements), 2)
+
+    def test_table_versions_bumped_last(self):
+        """ The table versions are bumped in name order as the last statements of a commit """
+        def versions():
+            return dict(db.session.query(TableVersion.name, TableVersion.version))
+
+        product = self._create_product()
+        product.create()
+        before = versions()
+        supplier = self._create_supplier()
+        supplier.products.append(Association(wholesale_price=5, product=product))
+        db.session.add(supplier)
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, *args):
+            statements.append((statement, parameters))
+
+        event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            db.session.commit()
+        finally:
+            event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+        bumps = [statement.startswith("UPDATE table_version") for statement, _ in statements]
+        self.assertEqual(bumps, sorted(bumps))
+        bumped = [
+            sorted(parameters.values(), key=str)[-1] if isinstance(parameters, dict) else parameters[-1]
+            for statement, parameters in statements if statement.startswith("UPDATE table_version")
+        ]
+        self.assertIn("association", bumped)
+        self.assertEqual(bumped, sorted(set(bumped)))
+        after = versions()
+        self.assertEqual(after["supplier"], before["supplier"] + 1)
+        self.assertEqual(after["import_job"], before["import_job"])
+
+        # already flushed, or rolled back
+        supplier.name = "Other Name"
+        db.session.flush()
+        db.session.commit()
+        self.assertEqual(versions()["supplier"], after["supplier"] + 1)
+        supplier.name = "Rolled Back"
+        db.session.flush()
+        db.session.rollback()
+        db.session.commit()
+        self.assertEqual(versions()["supplier"], after["supplier"] + 1)
+
+    def test_find_many_associations(self):
+        """ Look up Associations by their keys, not the cross product of their ids """
+        self._create_association()
+        self._create_association()
+        db.session.add(Association(supplier_id=1, product_id=2, wholesale_price=5))
+        db.session.add(Association(supplier_id=2, product_id=1, wholesale_price=6))
+        db.session.commit()
+        keys = [(1, 1), (2, 2), (3, 3)]
+        for batch_size in (200, 1):
+            rows = Association.find_many(keys, batch_size)
+            self.assertEqual(sorted((row[0], row[1]) for row in rows), [(1, 1), (2, 2)])
+        rows = Association.find_many([(1, 2), (2, 2)])
+        self.assertEqual(sorted((row[0], row[1], row[2]) for row in rows), [(1, 2, 5), (2, 2, 999)])
+        self.assertEqual(Association.find_many([]), [])
+
     def test_multiple_associations(self):
         """ Create two associations, list them out, and confirm both were created """    
         supplier = self._create_association()     
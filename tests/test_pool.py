@@ -0,0 +1,68 @@
+"""
+Test cases for the database connection pool
+
+"""
+import unittest
+from sqlalchemy import create_engine, exc
+from service.pool import InstrumentedQueuePool, engine_options, pool_stats
+
+CONFIG = dict(
+    DB_POOL_SIZE=1,
+    DB_MAX_OVERFLOW=1,
+    DB_POOL_TIMEOUT=0.1,
+    DB_POOL_RECYCLE=1800,
+    DB_POOL_PRE_PING=True,
+    DB_STATEMENT_TIMEOUT=5000,
+)
+
+
+######################################################################
+#  P O O L   T E S T   C A S E S
+######################################################################
+class TestPool(unittest.TestCase):
+    """ Test Cases for the connection pool """
+
+    def test_engine_options(self):
+        """ Build the pool options from the configuration """
+        options = engine_options(dict(CONFIG, SQLALCHEMY_DATABASE_URI="postgres://localhost/db"))
+        self.assertEqual(options["poolclass"], InstrumentedQueuePool)
+        self.assertEqual(options["pool_size"], 1)
+        self.assertEqual(options["max_overflow"], 1)
+        self.assertEqual(options["pool_timeout"], 0.1)
+        self.assertTrue(options["pool_pre_ping"])
+        self.assertEqual(options["connect_args"], {"options": "-c statement_timeout=5000"})
+        options = engine_options(
+            dict(CONFIG, SQLALCHEMY_DATABASE_URI="postgres://localhost/db", DB_STATEMENT_TIMEOUT=0)
+        )
+        self.assertNotIn("connect_args", options)
+        self.assertEqual(engine_options(dict(CONFIG, SQLALCHEMY_DATABASE_URI="sqlite://")), {})
+
+    def test_metrics(self):
+        """ Count checkouts, connections in use, overflows and timeouts """
+        options = engine_options(dict(CONFIG, SQLALCHEMY_DATABASE_URI="postgres://localhost/db"))
+        del options["connect_args"]
+        engine = create_engine("sqlite:///:memory:", **options)
+        first = engine.connect()
+        self.assertEqual(pool_stats(engine)["checked_out"], 1)
+        self.assertEqual(pool_stats(engine)["overflows"], 0)
+        second = engine.connect()
+        stats = pool_stats(engine)
+        self.assertEqual(stats["checked_out"], 2)
+        self.assertEqual(stats["overflow"], 1)
+        self.assertEqual(stats["overflows"], 1)
+        self.assertRaises(exc.TimeoutError, engine.connect)
+        second.close()
+        first.close()
+        stats = pool_stats(engine)
+        self.assertEqual(stats["checked_out"], 0)
+        self.assertEqual(stats["checkouts"], 2)
+        self.assertEqual(stats["timeouts"], 1)
+        self.assertGreaterEqual(stats["checkout_ms_max"], stats["checkout_ms_avg"])
+
+        # the counters survive a dispose of the engine
+        engine.dispose()
+        self.assertEqual(pool_stats(engine)["checkouts"], 2)
+
+    def test_not_instrumented(self):
+        """ Engines with other pools have no stats """
+        self.assertIsNone(pool_stats(create_engine("sqlite://")))
@@ -0,0 +1,78 @@
+"""
+Test cases for the in memory trigram search index
+
+"""
+import unittest
+from service.search import TrigramIndex, word_trigrams, similarity
+
+ROWS = [
+    (1, "Acme Tools", "12 Spain Dr"),
+    (2, "Best Acme", "14 Cashville Ln"),
+    (3, "Acme", "123 Baywatch Rd"),
+    (4, "Zeta Supplies", "18 Foxboro Pl"),
+    (5, "Bea", "9 Acme Road"),
+]
+
+######################################################################
+#  T R I G R A M   I N D E X   T E S T   C A S E S
+######################################################################
+class TestTrigramIndex(unittest.TestCase):
+    """ Test Cases for TrigramIndex """
+
+    def setUp(self):
+        """ This runs before each test """
+        self.index = TrigramIndex()
+        self.index.rebuild(ROWS)
+
+    def test_word_trigrams(self):
+        """ Words are padded and lower cased like pg_trgm """
+        self.assertEqual(word_trigrams("Cat"), {"  c", " ca", "cat", "at "})
+        self.assertEqual(word_trigrams("a-b"), {"  a", " a ", "  b", " b "})
+        self.assertEqual(similarity(word_trigrams("acme"), word_trigrams("ACME")), 1.0)
+        self.assertEqual(similarity(set(), word_trigrams("acme")), 0.0)
+
+    def test_rank_prefix_then_similarity(self):
+        """ Name prefixes come first, then the most similar matches """
+        self.assertEqual(self.index.search("acme", 10), [3, 1, 2, 5])
+
+    def test_substring(self):
+        """ Match text in the middle of a name or address """
+        self.assertEqual(self.index.search("upp", 10), [4])
+        self.assertEqual(self.index.search("baywatch", 10), [3])
+        self.assertEqual(self.index.search("nothing here", 10), [])
+
+    def test_short_text(self):
+        """ Text shorter than a trigram scans every entry """
+        self.assertEqual(self.index.search("be", 10), [5, 2])
+
+    def test_paging(self):
+        """ Page through the ranked matches """
+        self.assertEqual(self.index.search("acme", 2), [3, 1])
+        self.assertEqual(self.index.search("acme", 2, offset=2), [2, 5])
+
+    def test_invalidate(self):
+        """ The index is stale until it is rebuilt """
+        self.assertFalse(self.index.stale)
+        self.index.invalidate()
+        self.assertTrue(self.index.stale)
+        self.index.rebuild(ROWS[:1])
+        self.assertFalse(self.index.stale)
+        self.assertEqual(self.index.search("acme", 10), [1])
+
+    def test_invalidate_while_rebuilding(self):
+        """ A write during a rebuild leaves the index stale """
+        def rows():
+            yield ROWS[0]
+            self.index.invalidate()
+            yield ROWS[1]
+
+        self.index.rebuild(rows())
+        self.assertTrue(self.index.stale)
+
+    def test_versions(self):
+        """ The index is only current for the version it was built from """
+        self.index.rebuild(ROWS, 7)
+        self.assertTrue(self.index.is_current(7))
+        self.assertFalse(self.index.is_current(8))
+        self.index.invalidate()
+        self.assertFalse(self.index.is_current(7))